@@ -0,0 +1,121 @@
+"""
+Concurrent-request throughput, sync engine versus DATABASE_ASYNC.
+
+Starts the API under uvicorn once per mode, keeps --concurrency requests in
+flight against read-only endpoints for --seconds, and prints requests per
+second and latency percentiles of the successful requests for each mode.
+Needs uvicorn, and POSTGRES_URI (and API_KEY for the authenticated routes)
+pointing at a database with the schema applied. The server logs at WARNING
+unless LOG_LEVEL says otherwise, so the results are not buried in request logs.
+
+    python -m benchmarks.async_load --concurrency 64 --seconds 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+import httpx
+
+ENDPOINTS = [
+    ("GET", "/catalog/", None),
+    ("GET", "/carts/search/?sort_col=timestamp&sort_order=desc", None),
+    ("POST", "/inventory/plan", None),
+    ("POST", "/bottler/plan", None),
+]
+
+
+def start_server(port, async_mode, workers):
+    env = dict(os.environ, DATABASE_ASYNC="1" if async_mode else "0",
+               LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"))
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.api.server:app", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        env=env
+    )
+
+
+async def wait_until_ready(client, server=None, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server is not None and server.poll() is not None:
+            raise SystemExit(f"Server exited with code {server.returncode} before it was ready.")
+        try:
+            if (await client.get("/")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise SystemExit("Server did not start.")
+
+
+async def drive(client, concurrency, seconds):
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + seconds
+
+    async def worker(offset):
+        nonlocal errors
+        i = offset
+        while time.monotonic() < deadline:
+            method, path, body = ENDPOINTS[i % len(ENDPOINTS)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+            except httpx.TransportError:
+                errors += 1
+                continue
+            if response.status_code >= 400:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(offset) for offset in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+async def measure(port, async_mode, args):
+    server = start_server(port, async_mode, args.workers)
+    try:
+        headers = {"access_token": os.environ.get("API_KEY", "")}
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", headers=headers,
+                                     limits=limits, timeout=60) as client:
+            await wait_until_ready(client, server)
+            await drive(client, min(args.concurrency, 4), 2)
+            latencies, errors, elapsed = await drive(client, args.concurrency, args.seconds)
+    finally:
+        server.terminate()
+        server.wait()
+
+    mode = "async" if async_mode else "sync"
+    if not latencies:
+        raise SystemExit(f"{mode}: all {errors} requests failed; check POSTGRES_URI and API_KEY.")
+    latencies.sort()
+    return {
+        "mode": mode,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[max(int(len(latencies) * 0.95) - 1, 0)] * 1000,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    results = [asyncio.run(measure(args.port, async_mode, args)) for async_mode in (False, True)]
+    for result in results:
+        print(f"{result['mode']:>5}: {result['rps']:8.1f} req/s  p50 {result['p50_ms']:7.1f} ms  "
+              f"p95 {result['p95_ms']:7.1f} ms  {result['requests']} requests, {result['errors']} errors")
+    print(f"async / sync throughput: {results[1]['rps'] / results[0]['rps']:.2f}x")
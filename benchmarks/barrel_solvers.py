@@ -0,0 +1,101 @@
+"""
+Knapsack versus pulp wholesale barrel solvers on random catalogs.
+
+Generates random wholesale catalogs of each requested size together with gold,
+ml balances and free capacity. Each instance is solved with both solvers under
+the threshold rule and under random per-color target levels, and the script
+fails if the knapsack solver's total ml differs from CBC's on any instance.
+Prints per-solver latency for each catalog size, and how many instances
+handed off to pulp (mixed barrels on capped colors, or too many DP states).
+Needs no database.
+
+    python -m benchmarks.barrel_solvers --instances 100 --sizes 4,8,16,32,64
+    python -m benchmarks.barrel_solvers --instances 50 --sizes 16 --mixed 0.3 --units 10
+"""
+import argparse
+import random
+import statistics
+import time
+from types import SimpleNamespace
+from src import wholesale
+
+BARREL_SIZES = [(200, 60), (500, 100), (2500, 250), (10000, 750)]
+SINGLE_COLORS = [[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0], [0, 0, 0, 1]]
+
+
+def random_catalog(rng, size, mixed):
+    catalog = []
+    for index in range(size):
+        ml_per_barrel, price = rng.choice(BARREL_SIZES)
+        if rng.random() < mixed:
+            potion_type = [rng.choice([0, 1, 2]) for _ in wholesale.ML_COLORS]
+            if not any(potion_type):
+                potion_type[rng.randrange(len(potion_type))] = 1
+        else:
+            potion_type = rng.choice(SINGLE_COLORS)
+        catalog.append(SimpleNamespace(
+            sku=f"BARREL_{index}", ml_per_barrel=ml_per_barrel, potion_type=potion_type,
+            price=max(1, int(price * rng.uniform(0.7, 1.4))), quantity=rng.randint(1, 30)
+        ))
+    return catalog
+
+
+def random_instance(rng, size, mixed, units):
+    catalog = random_catalog(rng, size, mixed)
+    ml = {color: rng.choice([0, rng.randint(0, 1500), rng.randint(0, 5000)]) for color in wholesale.ML_COLORS}
+    capacity = max(0, units * 10000 - sum(ml.values()))
+    gold = rng.randint(0, 200) if rng.random() < 0.3 else rng.randint(200, 5000)
+    return catalog, gold, ml, capacity
+
+
+def random_levels(rng):
+    return {color: rng.choice([0, 2000, 5000, 10000]) for color in wholesale.ML_COLORS}
+
+
+def timed(solve, *args):
+    start = time.perf_counter()
+    solution = solve(*args)
+    return solution, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--instances", type=int, default=100, help="instances per catalog size")
+    parser.add_argument("--sizes", default="4,8,16,32,64", help="comma-separated catalog sizes")
+    parser.add_argument("--mixed", type=float, default=0.1, help="share of mixed-color barrels")
+    parser.add_argument("--units", type=int, default=1, help="ml capacity units (10000 ml each)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    mismatches = []
+    for size in (int(size) for size in args.sizes.split(",")):
+        knapsack_times, pulp_times, handed_off = [], [], 0
+        for instance in range(args.instances):
+            catalog, gold, ml, capacity = random_instance(rng, size, args.mixed, args.units)
+            for levels in ({}, random_levels(rng)):
+                targets = wholesale.color_targets(ml, levels)
+                candidates = wholesale.eligible(catalog, targets, gold, capacity)
+                if not candidates:
+                    continue
+                knapsack, knapsack_seconds = timed(wholesale.solve_knapsack, candidates, gold, capacity, targets)
+                pulp, pulp_seconds = timed(wholesale.solve_pulp, candidates, gold, capacity, targets)
+                pulp_times.append(pulp_seconds)
+                if knapsack is None:
+                    handed_off += 1
+                    continue
+                knapsack_times.append(knapsack_seconds)
+                if knapsack.ml != pulp.ml or knapsack.gold > gold:
+                    mismatches.append((size, instance, knapsack.ml, pulp.ml))
+
+        print(f"{size} barrels:")
+        for name, times in (("knapsack", knapsack_times), ("pulp", pulp_times)):
+            if times:
+                print(f"  {name:>8}: p50 {statistics.median(times) * 1000:7.2f} ms  "
+                      f"max {max(times) * 1000:7.2f} ms over {len(times)} solves")
+        print(f"  handed off to pulp: {handed_off}")
+
+    for size, instance, knapsack_ml, pulp_ml in mismatches:
+        print(f"{size} barrels, instance {instance}: knapsack {knapsack_ml} ml vs pulp {pulp_ml} ml")
+    if mismatches:
+        raise SystemExit(f"Solvers disagree on {len(mismatches)} instances.")
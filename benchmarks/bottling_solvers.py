@@ -0,0 +1,87 @@
+"""
+Native versus pulp bottling solvers on random shop states.
+
+Generates random recipe sets, ml balances, inventory and capacity, solves each
+instance with both solvers, and fails if the native solver misses the CBC
+objective on any instance where both finished with a proven optimum. Prints
+per-solver latency. Needs no database.
+
+    python -m benchmarks.bottling_solvers --instances 200 --recipes 6 --seed 7
+    python -m benchmarks.bottling_solvers --instances 50 --recipes 40 --step 10
+"""
+import argparse
+import math
+import random
+import statistics
+import time
+from types import SimpleNamespace
+from src import bottling
+
+def random_recipes(rng, count, step):
+    color_steps = list(range(0, 101, step))
+    recipes, seen = [], set()
+    while len(recipes) < count:
+        red, green, blue = (rng.choice(color_steps) for _ in range(3))
+        dark = 100 - red - green - blue
+        if dark < 0 or (red, green, blue, dark) in seen:
+            continue
+        seen.add((red, green, blue, dark))
+        recipes.append(SimpleNamespace(
+            id=len(recipes) + 1, price=rng.randint(15, 90),
+            red_component=red, green_component=green, blue_component=blue, dark_component=dark
+        ))
+    return recipes
+
+
+def random_instance(rng, recipe_count, step=25):
+    recipes = random_recipes(rng, recipe_count, step)
+    ml = {color: rng.choice([0, rng.randint(0, 1500), rng.randint(0, 10000)]) for color in bottling.ML_COLORS}
+    inventory = {recipe.id: rng.randint(0, 50) for recipe in recipes if rng.random() < 0.5}
+    capacity = rng.randint(1, 100) if rng.random() < 0.8 else rng.randint(100, 400)
+    return recipes, ml, inventory, capacity
+
+
+def timed(solve, *args):
+    start = time.perf_counter()
+    solution = solve(*args)
+    return solution, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--instances", type=int, default=200)
+    parser.add_argument("--recipes", type=int, default=6)
+    parser.add_argument("--step", type=int, default=25, help="ml granularity of recipe components")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--budget-ms", type=float, default=bottling.BOTTLING_TIME_BUDGET_MS)
+    args = parser.parse_args()
+    possible = math.comb(100 // args.step + 3, 3)
+    if 100 % args.step or args.recipes > possible:
+        raise SystemExit(f"--step {args.step} allows at most {possible} distinct recipes.")
+
+    rng = random.Random(args.seed)
+    native_times, pulp_times = [], []
+    mismatches, timeouts = [], 0
+    for instance in range(args.instances):
+        recipes, ml, inventory, capacity = random_instance(rng, args.recipes, args.step)
+        candidates = bottling.candidates(recipes, inventory, capacity)
+        if not candidates:
+            continue
+        native, native_seconds = timed(bottling.solve_native, candidates, ml, capacity, args.budget_ms)
+        pulp, pulp_seconds = timed(bottling.solve_pulp, candidates, ml, capacity)
+        native_times.append(native_seconds)
+        pulp_times.append(pulp_seconds)
+        if not native.optimal:
+            timeouts += 1
+            continue
+        if pulp.optimal and abs(native.objective - pulp.objective) > 1e-6:
+            mismatches.append((instance, native.objective, pulp.objective))
+
+    for name, times in (("native", native_times), ("pulp", pulp_times)):
+        print(f"{name:>6}: p50 {statistics.median(times) * 1000:7.2f} ms  "
+              f"max {max(times) * 1000:7.2f} ms over {len(times)} instances")
+    print(f"native hit its {args.budget_ms:.0f} ms budget on {timeouts} instances")
+    for instance, native_objective, pulp_objective in mismatches:
+        print(f"instance {instance}: native {native_objective:.1f} vs pulp {pulp_objective:.1f}")
+    if mismatches:
+        raise SystemExit(f"Solvers disagree on {len(mismatches)} instances.")
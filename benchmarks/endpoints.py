@@ -0,0 +1,256 @@
+"""
+Endpoint latency as the ledgers grow.
+
+For each --volumes size, wipes the shop tables and seeds that many rows into
+each ledger, along with transactions, customers and checked-out carts. It then
+times GET /catalog/, GET /inventory/audit, POST /carts/{id}/checkout and the
+plan endpoints in-process through the FastAPI app. The catalog and bottling
+plan caches are cleared before every call, so each timing includes the
+database work.
+
+Results go to --output as JSON, tagged with the git commit, so runs on
+different commits can be compared. DESTRUCTIVE: needs POSTGRES_URI pointing at
+a scratch database with the schema applied, plus --wipe to confirm. The
+requests use API_KEY, or a benchmark-only key when it is not set.
+
+    python -m benchmarks.endpoints --wipe --volumes 10000,100000,1000000 --output endpoints.json
+    python -m benchmarks.endpoints --wipe --volumes 10000000 --repeats 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+
+import sqlalchemy
+from fastapi.testclient import TestClient
+from src import database as db
+from src import balances
+from src import catalog_cache
+from src import catalog_index
+from src import plan_cache
+from src.api import auth
+from src.api.server import app
+
+LEDGERS = ["gold_ledger_entries", "ml_ledger_entries", "potion_inventory_ledger_entries"]
+SHOP_TABLES = LEDGERS + [f"{ledger}_archive" for ledger in LEDGERS] + [
+    "gold_ledger_summary", "ml_ledger_summary", "potion_ledger_summaries", "ledger_compactions",
+    "transactions", "delivered_orders", "carts_items", "carts", "customer_info", "capacity_purchases",
+    "balance_checkpoint_potions", "balance_checkpoints", "potion_balances", "potion_catalog",
+]
+WHOLESALE_CATALOG = [
+    {"sku": f"{size}_{color.upper()}_BARREL", "ml_per_barrel": ml, "potion_type": potion_type,
+     "price": price, "quantity": 10}
+    for size, ml, price in (("SMALL", 500, 100), ("MEDIUM", 2500, 250), ("LARGE", 10000, 750))
+    for color, potion_type in (("red", [1, 0, 0, 0]), ("green", [0, 1, 0, 0]),
+                               ("blue", [0, 0, 1, 0]), ("dark", [0, 0, 0, 1]))
+]
+
+
+def recipes(count):
+    # Distinct potion types in 25 ml steps, at most 35 of them.
+    types = [
+        (red, green, blue, 100 - red - green - blue)
+        for red in range(0, 101, 25) for green in range(0, 101 - red, 25) for blue in range(0, 101 - red - green, 25)
+    ]
+    return [
+        {"name": f"Bench Potion {i}", "sku": f"BENCH_POTION_{i}", "price": 20 + 5 * (i % 12),
+         "red": red, "green": green, "blue": blue, "dark": dark}
+        for i, (red, green, blue, dark) in enumerate(types[:count], start=1)
+    ]
+
+
+def seed(connection, rows, potions):
+    """
+    Replace the shop data with rows entries per ledger. Balance triggers are
+    off while seeding, and the running balances are rebuilt once at the end.
+    """
+    connection.execute(sqlalchemy.text(f"TRUNCATE {', '.join(SHOP_TABLES)} RESTART IDENTITY CASCADE"))
+    connection.execute(sqlalchemy.text("INSERT INTO gold_ledger_summary DEFAULT VALUES"))
+    connection.execute(sqlalchemy.text("INSERT INTO ml_ledger_summary DEFAULT VALUES"))
+    connection.execute(sqlalchemy.text("""
+        INSERT INTO potion_catalog (name, red_component, green_component, blue_component, dark_component,
+                                    price, quantity, sku, inventory)
+        VALUES (:name, :red, :green, :blue, :dark, :price, 0, :sku, 0)
+    """), recipes(potions))
+    connection.execute(sqlalchemy.text("""
+        INSERT INTO capacity_purchases (potion_capacity, ml_capacity) VALUES (10, 10)
+    """))
+
+    for ledger in LEDGERS:
+        connection.execute(sqlalchemy.text(f"ALTER TABLE {ledger} DISABLE TRIGGER USER"))
+    try:
+        connection.execute(sqlalchemy.text("""
+            INSERT INTO transactions (description, created_at)
+            SELECT 'Bench transaction ' || g, now() - (:rows - g) * interval '1 second'
+            FROM generate_series(1, :rows) g
+        """), {"rows": rows})
+        # Each ledger nets out positive and stays within capacity: a large
+        # opening entry, then small changes that cancel out over every 4 rows.
+        connection.execute(sqlalchemy.text("""
+            INSERT INTO gold_ledger_entries (transaction_id, change, description, created_at)
+            SELECT g, CASE WHEN g = 1 THEN 100000 ELSE (g % 4) * 10 - 15 END, 'Bench gold',
+                   now() - (:rows - g) * interval '1 second'
+            FROM generate_series(1, :rows) g
+        """), {"rows": rows})
+        connection.execute(sqlalchemy.text("""
+            INSERT INTO ml_ledger_entries (transaction_id, red_ml_change, green_ml_change, blue_ml_change,
+                                           dark_ml_change, description, created_at)
+            SELECT g, d, d, d, d, 'Bench ml', now() - (:rows - g) * interval '1 second'
+            FROM (
+                SELECT g, CASE WHEN g = 1 THEN 5000 ELSE (g % 4) * 10 - 15 END AS d
+                FROM generate_series(1, :rows) g
+            ) changes
+        """), {"rows": rows})
+        connection.execute(sqlalchemy.text("""
+            INSERT INTO potion_inventory_ledger_entries (potion_catalog_id, transaction_id, change,
+                                                         description, created_at)
+            SELECT 1 + g % :potions, g, CASE WHEN g <= :potions THEN 20 ELSE (g / :potions % 4) * 2 - 3 END,
+                   'Bench potions', now() - (:rows - g) * interval '1 second'
+            FROM generate_series(1, :rows) g
+        """), {"rows": rows, "potions": potions})
+    finally:
+        for ledger in LEDGERS:
+            connection.execute(sqlalchemy.text(f"ALTER TABLE {ledger} ENABLE TRIGGER USER"))
+
+    customers = max(rows // 100, 100)
+    connection.execute(sqlalchemy.text("""
+        INSERT INTO customer_info (customer_name, customer_class, level)
+        SELECT 'bench-customer-' || g, 'Bench', g % 20
+        FROM generate_series(1, :customers) g
+    """), {"customers": customers})
+    connection.execute(sqlalchemy.text("""
+        INSERT INTO carts (customer_id, status, created_at)
+        SELECT 1 + g % :customers, 'checked_out', now() - g * interval '1 second'
+        FROM generate_series(1, :carts) g
+    """), {"customers": customers, "carts": max(rows // 10, 100)})
+    connection.execute(sqlalchemy.text("""
+        INSERT INTO carts_items (cart_id, catalog_id, quantity, sku)
+        SELECT c.id, pc.id, 1 + c.id % 3, pc.sku
+        FROM carts c
+        JOIN potion_catalog pc ON pc.id = 1 + c.id % :potions
+    """), {"potions": potions})
+
+    balances.rebuild(connection)
+    connection.execute(sqlalchemy.text(f"ANALYZE {', '.join(SHOP_TABLES)}"))
+
+
+def open_cart(connection):
+    """
+    A fresh active cart holding one unit of an in-stock potion, for a checkout.
+    """
+    potion = connection.execute(sqlalchemy.text("""
+        SELECT pc.id, pc.sku
+        FROM potion_balances pb
+        JOIN potion_catalog pc ON pc.id = pb.potion_catalog_id
+        WHERE pb.quantity > 0
+        ORDER BY pb.quantity DESC
+        LIMIT 1
+    """)).one()
+    cart_id = connection.execute(sqlalchemy.text("""
+        INSERT INTO carts (customer_id, status) VALUES (1, 'active') RETURNING id
+    """)).scalar_one()
+    connection.execute(sqlalchemy.text("""
+        INSERT INTO carts_items (cart_id, catalog_id, quantity, sku) VALUES (:cart_id, :catalog_id, 1, :sku)
+    """), {"cart_id": cart_id, "catalog_id": potion.id, "sku": potion.sku})
+    return cart_id
+
+
+def clear_caches():
+    catalog_cache.invalidate()
+    plan_cache.bottling_plans.clear()
+
+
+def endpoints():
+    """
+    (name, prepare) pairs; prepare runs untimed and returns the request to make.
+    """
+    def checkout():
+        with db.begin() as connection:
+            cart_id = open_cart(connection)
+        return "POST", f"/carts/{cart_id}/checkout", {"payment": "bench"}
+
+    return [
+        ("GET /catalog/", lambda: ("GET", "/catalog/", None)),
+        ("GET /inventory/audit", lambda: ("GET", "/inventory/audit", None)),
+        ("POST /carts/{cart_id}/checkout", checkout),
+        ("POST /bottler/plan", lambda: ("POST", "/bottler/plan", None)),
+        ("POST /barrels/plan", lambda: ("POST", "/barrels/plan", WHOLESALE_CATALOG)),
+        ("POST /inventory/plan", lambda: ("POST", "/inventory/plan", None)),
+    ]
+
+
+def measure(client, prepare, repeats):
+    timings, statuses = [], {}
+    for _ in range(repeats):
+        method, path, body = prepare()
+        clear_caches()
+        start = time.perf_counter()
+        response = client.request(method, path, json=body)
+        timings.append(time.perf_counter() - start)
+        statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+    timings.sort()
+    return {
+        "runs": len(timings),
+        "mean_ms": round(statistics.fmean(timings) * 1000, 3),
+        "p50_ms": round(statistics.median(timings) * 1000, 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000, 3),
+        "max_ms": round(timings[-1] * 1000, 3),
+        "statuses": statuses,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--volumes", default="10000,100000,1000000,10000000",
+                        help="comma-separated rows per ledger, one seeded run each")
+    parser.add_argument("--repeats", type=int, default=20, help="timed calls per endpoint")
+    parser.add_argument("--potions", type=int, default=12, help="recipes in the seeded catalog (at most 35)")
+    parser.add_argument("--output", default="endpoint_benchmarks.json")
+    parser.add_argument("--wipe", action="store_true", help="confirm the database may be wiped")
+    args = parser.parse_args()
+    if not args.wipe:
+        raise SystemExit("This benchmark deletes all shop data; rerun with --wipe against a scratch database.")
+    if not 1 <= args.potions <= 35:
+        raise SystemExit("--potions must be between 1 and 35.")
+
+    results = {
+        "commit": git_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "repeats": args.repeats,
+        "runs": [],
+    }
+    api_key = os.environ.get("API_KEY") or "bench"
+    if api_key not in auth.api_keys:
+        auth.api_keys.append(api_key)
+    with TestClient(app, raise_server_exceptions=False) as client:
+        client.headers["access_token"] = api_key
+        for volume in (int(volume) for volume in args.volumes.split(",")):
+            start = time.perf_counter()
+            with db.begin(statement_timeout_ms=0) as connection:
+                seed(connection, volume, args.potions)
+            catalog_index.invalidate()
+            seed_seconds = time.perf_counter() - start
+            print(f"{volume} rows per ledger: seeded in {seed_seconds:.1f}s")
+
+            run = {"ledger_rows": volume, "seed_seconds": round(seed_seconds, 3), "endpoints": {}}
+            for name, prepare in endpoints():
+                run["endpoints"][name] = stats = measure(client, prepare, args.repeats)
+                print(f"  {name:<32} p50 {stats['p50_ms']:9.2f} ms  p95 {stats['p95_ms']:9.2f} ms  "
+                      f"statuses {stats['statuses']}")
+            results["runs"].append(run)
+
+            with open(args.output, "w") as output:
+                json.dump(results, output, indent=2)
+    print(f"Wrote {args.output}")
@@ -0,0 +1,64 @@
+"""
+Cold-start check for `import src.api.server`.
+
+Imports the app in fresh interpreters with `python -X importtime`, keeps the
+fastest run, and fails if it exceeds the budget, or if importing the app
+loaded a database driver or the ILP solver. POSTGRES_URI points at a closed
+port, so an import that tries to connect fails outright. Needs no database.
+
+    python -m benchmarks.import_time --runs 5 --budget-ms 1000
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+MODULE = "src.api.server"
+# None of these should load until a request needs them.
+DEFERRED_MODULES = ["pulp", "psycopg2", "asyncpg"]
+
+PROBE = f"""
+import sys
+import {MODULE}
+loaded = [name for name in {DEFERRED_MODULES!r} if name in sys.modules]
+print(",".join(loaded))
+"""
+
+
+def import_once():
+    env = dict(os.environ, POSTGRES_URI="postgresql+psycopg2://bench@127.0.0.1:1/none", DATABASE_ASYNC="0")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE],
+        env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"Importing {MODULE} failed:\n{result.stderr[-2000:]}")
+
+    cumulative_us = None
+    for line in result.stderr.splitlines():
+        parts = [part.strip() for part in line.split("|")]
+        if len(parts) == 3 and parts[2] == MODULE:
+            cumulative_us = int(parts[1])
+    loaded = [name for name in result.stdout.strip().split(",") if name]
+    return cumulative_us / 1000, loaded
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=float(os.environ.get("IMPORT_TIME_BUDGET_MS", "1000")))
+    args = parser.parse_args()
+
+    timings = []
+    loaded = []
+    for _ in range(args.runs):
+        milliseconds, loaded = import_once()
+        timings.append(milliseconds)
+
+    best = min(timings)
+    print(f"import {MODULE}: best {best:.1f} ms, worst {max(timings):.1f} ms over {args.runs} runs "
+          f"(budget {args.budget_ms:.0f} ms)")
+    if loaded:
+        raise SystemExit(f"Importing the app loaded deferred modules: {', '.join(loaded)}")
+    if best > args.budget_ms:
+        raise SystemExit(f"Import time regressed: {best:.1f} ms > {args.budget_ms:.0f} ms budget.")
@@ -0,0 +1,286 @@
+"""
+Tick-by-tick load test in the Potion Exchange call order.
+
+Each tick replays the sequence from APISpec.md. Customers come first: the
+catalog, then a visits batch, then one new cart per customer, add items and
+checkout, with --concurrency customers in flight at once. The supply cycles
+follow in order: current time, barrel plan and delivery, bottler plan and
+delivery, capacity plan and delivery.
+
+The run repeats at each concurrency level and reports, per level:
+- throughput
+- latency percentiles per route
+- error and rejection rates per route
+- consistency violations
+
+Violations are checked against /inventory/audit after every tick: selling
+more of a SKU than the catalog offered, negative balances, and gold or potion
+totals that do not match what the tick's responses say moved. Only this
+script may drive the shop while it runs, or the totals will not add up.
+
+Starts the API under uvicorn unless --url is given. That needs POSTGRES_URI and
+API_KEY pointing at a scratch database. --reset calls /admin/reset before each
+level.
+
+    python -m benchmarks.tick_load --reset --concurrency 8,32,128 --ticks 5
+    python -m benchmarks.tick_load --url http://127.0.0.1:8000 --concurrency 64 --customers 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from collections import defaultdict
+import httpx
+from benchmarks.async_load import start_server, wait_until_ready
+
+WHOLESALE_CATALOG = [
+    {"sku": f"{size}_{color.upper()}_BARREL", "ml_per_barrel": ml, "potion_type": potion_type,
+     "price": price, "quantity": 10}
+    for size, ml, price in (("SMALL", 500, 100), ("MEDIUM", 2500, 250), ("LARGE", 10000, 750))
+    for color, potion_type in (("red", [1, 0, 0, 0]), ("green", [0, 1, 0, 0]),
+                               ("blue", [0, 0, 1, 0]), ("dark", [0, 0, 0, 1]))
+]
+CAPACITY_UNIT_COST = 1000
+DAYS = ["Edgeday", "Bloomday", "Arcanaday", "Hearthday", "Crownday", "Blesseday", "Soulday"]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.rejected = defaultdict(int)
+        self.violations = []
+
+    async def call(self, client, route, method, path, body=None):
+        """
+        The decoded response, or None if the call failed. A 4xx/5xx status or
+        a transport error counts as an error; an {"error": ...} body, such as
+        a sold-out checkout, as a rejection.
+        """
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, path, json=body)
+            data = response.json() if response.content else None
+        except (httpx.TransportError, ValueError):
+            response, data = None, None
+        self.latencies[route].append(time.perf_counter() - start)
+        if response is None or response.status_code >= 400:
+            self.errors[route] += 1
+            return None
+        if isinstance(data, dict) and "error" in data:
+            self.rejected[route] += 1
+            return None
+        return data
+
+    def violation(self, tick, message):
+        self.violations.append(f"tick {tick}: {message}")
+
+
+async def audit(client, recorder):
+    data = await recorder.call(client, "GET /inventory/audit", "GET", "/inventory/audit")
+    if data is None:
+        return None
+    return {
+        "gold": data["gold"],
+        "ml": data["ml_inventory"],
+        "potions": {potion["name"]: potion["inventory"] for potion in data["potion_inventory"]["custom_potions"]},
+    }
+
+
+async def customer(client, recorder, rng, catalog, tick):
+    """
+    One customer's cart: returns ({sku: units bought}, gold paid).
+    """
+    cart = await recorder.call(client, "POST /carts/", "POST", "/carts/")
+    if cart is None:
+        return {}, 0
+    cart_id = cart["cart_id"]
+    wanted = {}
+    for item in rng.sample(catalog, min(len(catalog), rng.randint(1, 2))):
+        quantity = rng.randint(1, 3)
+        added = await recorder.call(client, "POST /carts/{cart_id}/items/{item_sku}", "POST",
+                                    f"/carts/{cart_id}/items/{item['sku']}", {"quantity": quantity})
+        if added is not None:
+            wanted[item["sku"]] = quantity
+    if not wanted:
+        return {}, 0
+    result = await recorder.call(client, "POST /carts/{cart_id}/checkout", "POST",
+                                 f"/carts/{cart_id}/checkout", {"payment": "gold"})
+    if result is None:
+        return {}, 0
+    if result["total_potions_bought"] != sum(wanted.values()):
+        recorder.violation(tick, f"cart {cart_id} bought {result['total_potions_bought']} of {sum(wanted.values())}")
+    return wanted, result["total_gold_paid"]
+
+
+async def customers_phase(client, recorder, rng, tick, customers, concurrency):
+    catalog = await recorder.call(client, "GET /catalog/", "GET", "/catalog/") or []
+    visitors = [
+        {"customer_name": f"load-customer-{rng.randrange(customers * 4)}",
+         "character_class": rng.choice(["Wizard", "Rogue", "Knight", "Druid"]), "level": rng.randint(1, 20)}
+        for _ in range(customers)
+    ]
+    await recorder.call(client, "POST /carts/visits/{visit_id}", "POST", f"/carts/visits/{tick}", visitors)
+
+    in_stock = [item for item in catalog if item["quantity"] > 0]
+    sold, paid = defaultdict(int), 0
+    if in_stock:
+        limit = asyncio.Semaphore(concurrency)
+
+        async def one(seed):
+            async with limit:
+                return await customer(client, recorder, random.Random(seed), in_stock, tick)
+
+        for bought, gold in await asyncio.gather(*(one(rng.random()) for _ in range(customers))):
+            for sku, quantity in bought.items():
+                sold[sku] += quantity
+            paid += gold
+
+    offered = {item["sku"]: item["quantity"] for item in catalog}
+    for sku, quantity in sold.items():
+        if quantity > offered.get(sku, 0):
+            recorder.violation(tick, f"sold {quantity} of {sku}, catalog offered {offered.get(sku, 0)}")
+    return sum(sold.values()), paid
+
+
+async def supply_phase(client, recorder, tick, order_id):
+    """
+    Run the supply cycles; returns (gold spent, potions bottled).
+    """
+    await recorder.call(client, "POST /info/current_time", "POST", "/info/current_time",
+                        {"day": DAYS[tick // 12 % len(DAYS)], "hour": tick % 12 * 2})
+
+    spent, bottled = 0, 0
+    plan = await recorder.call(client, "POST /barrels/plan", "POST", "/barrels/plan", WHOLESALE_CATALOG)
+    if isinstance(plan, list) and plan:
+        barrels = {barrel["sku"]: barrel for barrel in WHOLESALE_CATALOG}
+        order = [dict(barrels[entry["sku"]], quantity=entry["quantity"]) for entry in plan]
+        if await recorder.call(client, "POST /barrels/deliver/{order_id}", "POST",
+                               f"/barrels/deliver/{order_id}", order) is not None:
+            spent += sum(barrel["price"] * barrel["quantity"] for barrel in order)
+
+    plan = await recorder.call(client, "POST /bottler/plan", "POST", "/bottler/plan")
+    if isinstance(plan, list) and plan:
+        if await recorder.call(client, "POST /bottler/deliver/{order_id}", "POST",
+                               f"/bottler/deliver/{order_id}", plan) is not None:
+            bottled += sum(entry["quantity"] for entry in plan)
+
+    plan = await recorder.call(client, "POST /inventory/plan", "POST", "/inventory/plan")
+    if plan and (plan["potion_capacity"] or plan["ml_capacity"]):
+        if await recorder.call(client, "POST /inventory/deliver/{order_id}", "POST",
+                               f"/inventory/deliver/{order_id}", plan) is not None:
+            spent += (plan["potion_capacity"] + plan["ml_capacity"]) * CAPACITY_UNIT_COST
+    return spent, bottled
+
+
+def check_tick(recorder, tick, before, after, paid, sold, spent, bottled):
+    if before is None or after is None:
+        recorder.violation(tick, "audit failed")
+        return
+    if after["gold"] < 0 or any(amount < 0 for amount in after["ml"].values()):
+        recorder.violation(tick, f"negative balance: gold {after['gold']}, ml {after['ml']}")
+    negative = {name: quantity for name, quantity in after["potions"].items() if quantity < 0}
+    if negative:
+        recorder.violation(tick, f"negative potion inventory: {negative}")
+    if after["gold"] != before["gold"] + paid - spent:
+        recorder.violation(tick, f"gold {before['gold']} + {paid} paid - {spent} spent != {after['gold']}")
+    potions_before, potions_after = sum(before["potions"].values()), sum(after["potions"].values())
+    if potions_after != potions_before + bottled - sold:
+        recorder.violation(tick, f"potions {potions_before} + {bottled} bottled - {sold} sold != {potions_after}")
+
+
+def percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))] * 1000
+
+
+async def run_level(client, args, concurrency):
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    if args.reset:
+        await recorder.call(client, "POST /admin/reset", "POST", "/admin/reset")
+    customers = max(args.customers, concurrency)
+    # Order ids must not repeat across runs, or deliveries would be replays.
+    first_order_id = int(time.time() * 1000)
+
+    start = time.perf_counter()
+    for tick in range(args.ticks):
+        before = await audit(client, recorder)
+        sold, paid = await customers_phase(client, recorder, rng, tick, customers, concurrency)
+        spent, bottled = await supply_phase(client, recorder, tick, first_order_id + tick)
+        after = await audit(client, recorder)
+        check_tick(recorder, tick, before, after, paid, sold, spent, bottled)
+    elapsed = time.perf_counter() - start
+
+    routes = {}
+    for route, latencies in sorted(recorder.latencies.items()):
+        latencies.sort()
+        routes[route] = {
+            "requests": len(latencies),
+            "error_rate": recorder.errors[route] / len(latencies),
+            "rejected_rate": recorder.rejected[route] / len(latencies),
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+        }
+    requests = sum(route["requests"] for route in routes.values())
+    return {
+        "concurrency": concurrency,
+        "customers_per_tick": customers,
+        "ticks": args.ticks,
+        "seconds": elapsed,
+        "requests_per_second": requests / elapsed,
+        "error_rate": sum(recorder.errors.values()) / max(requests, 1),
+        "routes": routes,
+        "violations": recorder.violations,
+    }
+
+
+async def main(args):
+    server = None
+    url = args.url
+    if url is None:
+        server = start_server(args.port, args.async_mode, args.workers)
+        url = f"http://127.0.0.1:{args.port}"
+    try:
+        headers = {"access_token": os.environ.get("API_KEY", "")}
+        limits = httpx.Limits(max_connections=max(int(level) for level in args.concurrency.split(",")) + 4)
+        async with httpx.AsyncClient(base_url=url, headers=headers, limits=limits, timeout=60) as client:
+            await wait_until_ready(client, server)
+            return [await run_level(client, args, int(level)) for level in args.concurrency.split(",")]
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="8,32,128", help="comma-separated customers in flight per level")
+    parser.add_argument("--customers", type=int, default=100, help="customers per tick (at least the concurrency)")
+    parser.add_argument("--ticks", type=int, default=5, help="ticks per level")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--reset", action="store_true", help="call /admin/reset before each level")
+    parser.add_argument("--url", help="drive an already running instance instead of starting one")
+    parser.add_argument("--async-mode", action="store_true", help="start the server with DATABASE_ASYNC=1")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--output", help="also write the results here as JSON")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    for result in results:
+        print(f"concurrency {result['concurrency']:>4}: {result['requests_per_second']:8.1f} req/s  "
+              f"errors {result['error_rate']:6.2%}  violations {len(result['violations'])}")
+        for route, stats in result["routes"].items():
+            print(f"    {route:<40} p50 {stats['p50_ms']:8.1f} ms  p95 {stats['p95_ms']:8.1f} ms  "
+                  f"p99 {stats['p99_ms']:8.1f} ms  errors {stats['error_rate']:6.2%}  "
+                  f"rejected {stats['rejected_rate']:6.2%}")
+        for violation in result["violations"][:20]:
+            print(f"    VIOLATION {violation}")
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+    if any(result["violations"] for result in results):
+        raise SystemExit("Consistency violations found.")
@@ -0,0 +1,58 @@
+"""
+Round trips per POST /carts/visits batch.
+
+Calls the visits handler with growing batches of synthetic customers and counts
+the statements it sends to Postgres. The count should stay flat as the batch
+grows. Needs POSTGRES_URI pointing at a scratch database; the synthetic
+customers are deleted afterwards.
+
+    python -m benchmarks.visit_round_trips --sizes 1 10 50 200
+"""
+import argparse
+import time
+import sqlalchemy
+from sqlalchemy import event
+from src import database as db
+from src.api import carts
+
+NAME_PREFIX = "bench-visitor-"
+
+
+def run(sizes):
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", count_statement)
+    results = []
+    try:
+        for size in sizes:
+            customers = [
+                carts.Customer(customer_name=f"{NAME_PREFIX}{i}", character_class="Bench", level=i % 20)
+                for i in range(size)
+            ]
+            statements.clear()
+            start = time.perf_counter()
+            carts.post_visits(size, customers)
+            elapsed = time.perf_counter() - start
+            results.append({"batch_size": size, "round_trips": len(statements), "seconds": elapsed})
+    finally:
+        event.remove(db.engine, "before_cursor_execute", count_statement)
+        with db.engine.begin() as connection:
+            connection.execute(sqlalchemy.text("""
+                DELETE FROM customer_info WHERE customer_name LIKE :prefix
+            """), {"prefix": f"{NAME_PREFIX}%"})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 50, 200])
+    args = parser.parse_args()
+
+    results = run(args.sizes)
+    for result in results:
+        print(f"batch {result['batch_size']:>5}: {result['round_trips']} round trips, {result['seconds'] * 1000:.1f} ms")
+    if len({result["round_trips"] for result in results}) > 1:
+        raise SystemExit("Round trips per visit batch grew with batch size.")
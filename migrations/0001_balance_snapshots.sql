@@ -0,0 +1,112 @@
+-- Balance snapshots for the gold, ml and potion ledgers.
+-- Safe to re-run: seeds the snapshots from the existing ledgers on first apply.
+-- Apply in a single transaction (psql -1 -f ...).
+
+LOCK TABLE gold_ledger_entries, ml_ledger_entries, potion_inventory_ledger_entries
+IN SHARE ROW EXCLUSIVE MODE;
+
+CREATE TABLE IF NOT EXISTS gold_balance (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    balance INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS ml_balance (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    red_ml INT NOT NULL DEFAULT 0,
+    green_ml INT NOT NULL DEFAULT 0,
+    blue_ml INT NOT NULL DEFAULT 0,
+    dark_ml INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS potion_balances (
+    potion_catalog_id INT PRIMARY KEY REFERENCES potion_catalog(id),
+    quantity INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO gold_balance (balance)
+SELECT COALESCE(SUM(change), 0) FROM gold_ledger_entries
+ON CONFLICT (id) DO NOTHING;
+
+INSERT INTO ml_balance (red_ml, green_ml, blue_ml, dark_ml)
+SELECT
+    COALESCE(SUM(red_ml_change), 0),
+    COALESCE(SUM(green_ml_change), 0),
+    COALESCE(SUM(blue_ml_change), 0),
+    COALESCE(SUM(dark_ml_change), 0)
+FROM ml_ledger_entries
+ON CONFLICT (id) DO NOTHING;
+
+INSERT INTO potion_balances (potion_catalog_id, quantity)
+SELECT potion_catalog_id, SUM(change)
+FROM potion_inventory_ledger_entries
+GROUP BY potion_catalog_id
+ON CONFLICT (potion_catalog_id) DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS balance_checkpoints (
+    id SERIAL PRIMARY KEY,
+    gold_entry_id INT NOT NULL,
+    ml_entry_id INT NOT NULL,
+    potion_entry_id INT NOT NULL,
+    gold INT NOT NULL,
+    red_ml INT NOT NULL,
+    green_ml INT NOT NULL,
+    blue_ml INT NOT NULL,
+    dark_ml INT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS balance_checkpoint_potions (
+    checkpoint_id INT NOT NULL REFERENCES balance_checkpoints(id) ON DELETE CASCADE,
+    potion_catalog_id INT NOT NULL REFERENCES potion_catalog(id),
+    quantity INT NOT NULL,
+    PRIMARY KEY (checkpoint_id, potion_catalog_id)
+);
+
+CREATE OR REPLACE FUNCTION apply_gold_ledger_entry() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE gold_balance
+    SET balance = balance + NEW.change, updated_at = CURRENT_TIMESTAMP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION apply_ml_ledger_entry() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE ml_balance
+    SET red_ml = red_ml + COALESCE(NEW.red_ml_change, 0),
+        green_ml = green_ml + COALESCE(NEW.green_ml_change, 0),
+        blue_ml = blue_ml + COALESCE(NEW.blue_ml_change, 0),
+        dark_ml = dark_ml + COALESCE(NEW.dark_ml_change, 0),
+        updated_at = CURRENT_TIMESTAMP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION apply_potion_ledger_entry() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO potion_balances (potion_catalog_id, quantity)
+    VALUES (NEW.potion_catalog_id, NEW.change)
+    ON CONFLICT (potion_catalog_id) DO UPDATE
+    SET quantity = potion_balances.quantity + EXCLUDED.quantity,
+        updated_at = CURRENT_TIMESTAMP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS gold_ledger_entries_balance ON gold_ledger_entries;
+CREATE TRIGGER gold_ledger_entries_balance
+AFTER INSERT ON gold_ledger_entries
+FOR EACH ROW EXECUTE FUNCTION apply_gold_ledger_entry();
+
+DROP TRIGGER IF EXISTS ml_ledger_entries_balance ON ml_ledger_entries;
+CREATE TRIGGER ml_ledger_entries_balance
+AFTER INSERT ON ml_ledger_entries
+FOR EACH ROW EXECUTE FUNCTION apply_ml_ledger_entry();
+
+DROP TRIGGER IF EXISTS potion_inventory_ledger_entries_balance ON potion_inventory_ledger_entries;
+CREATE TRIGGER potion_inventory_ledger_entries_balance
+AFTER INSERT ON potion_inventory_ledger_entries
+FOR EACH ROW EXECUTE FUNCTION apply_potion_ledger_entry();
@@ -0,0 +1,28 @@
+-- Unique customer names, required by the batch upsert in POST /carts/visits.
+-- Duplicate customers left behind by the old select-then-insert path are
+-- merged into the oldest row first, repointing their carts.
+-- Apply in a single transaction (psql -1 -f ...).
+
+LOCK TABLE customer_info IN SHARE ROW EXCLUSIVE MODE;
+
+WITH duplicates AS (
+    SELECT id, MIN(id) OVER (PARTITION BY customer_name) AS keep_id
+    FROM customer_info
+)
+UPDATE carts
+SET customer_id = duplicates.keep_id
+FROM duplicates
+WHERE carts.customer_id = duplicates.id
+  AND duplicates.id <> duplicates.keep_id;
+
+WITH duplicates AS (
+    SELECT id, MIN(id) OVER (PARTITION BY customer_name) AS keep_id
+    FROM customer_info
+)
+DELETE FROM customer_info
+USING duplicates
+WHERE customer_info.id = duplicates.id
+  AND duplicates.id <> duplicates.keep_id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS customer_info_customer_name_key
+ON customer_info (customer_name);
@@ -0,0 +1,14 @@
+-- Trigram indexes for the substring filters in GET /carts/search/
+-- (customer_name and potion SKU ILIKE '%...%'), plus the carts_items
+-- index needed to get from matching potions to their line items.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS customer_info_customer_name_trgm_idx
+ON customer_info USING gin (customer_name gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS potion_catalog_sku_trgm_idx
+ON potion_catalog USING gin (sku gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS carts_items_catalog_id_idx
+ON carts_items (catalog_id);
@@ -0,0 +1,177 @@
+-- Time-partitioned ledgers with compaction (see src/ledgers.py).
+-- gold_ledger_entries, ml_ledger_entries and potion_inventory_ledger_entries
+-- become tables range-partitioned on created_at. Existing rows keep their ids
+-- and land in a DEFAULT partition, which the first compaction folds away.
+-- Closed partitions are folded into the *_ledger_summary tables and their
+-- rows moved to the *_archive tables.
+-- Safe to re-run. Apply in a single transaction (psql -1 -f ...).
+
+LOCK TABLE gold_ledger_entries, ml_ledger_entries, potion_inventory_ledger_entries
+IN ACCESS EXCLUSIVE MODE;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'gold_ledger_entries'::regclass
+    ) THEN
+        ALTER TABLE gold_ledger_entries RENAME TO gold_ledger_entries_unpartitioned;
+        ALTER TABLE gold_ledger_entries_unpartitioned RENAME CONSTRAINT gold_ledger_entries_pkey
+            TO gold_ledger_entries_unpartitioned_pkey;
+        CREATE TABLE gold_ledger_entries (
+            id INT NOT NULL DEFAULT nextval('gold_ledger_entries_id_seq'),
+            transaction_id INT,
+            change INT NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            description TEXT,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at);
+        CREATE TABLE gold_ledger_entries_default PARTITION OF gold_ledger_entries DEFAULT;
+        ALTER SEQUENCE gold_ledger_entries_id_seq OWNED BY gold_ledger_entries.id;
+        INSERT INTO gold_ledger_entries (id, transaction_id, change, created_at, description)
+        SELECT id, transaction_id, change, COALESCE(created_at, CURRENT_TIMESTAMP), description
+        FROM gold_ledger_entries_unpartitioned;
+        DROP TABLE gold_ledger_entries_unpartitioned;
+    END IF;
+
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'ml_ledger_entries'::regclass
+    ) THEN
+        ALTER TABLE ml_ledger_entries RENAME TO ml_ledger_entries_unpartitioned;
+        ALTER TABLE ml_ledger_entries_unpartitioned RENAME CONSTRAINT ml_ledger_entries_pkey
+            TO ml_ledger_entries_unpartitioned_pkey;
+        CREATE TABLE ml_ledger_entries (
+            id INT NOT NULL DEFAULT nextval('ml_ledger_entries_id_seq'),
+            transaction_id INT,
+            red_ml_change INT DEFAULT 0,
+            green_ml_change INT DEFAULT 0,
+            blue_ml_change INT DEFAULT 0,
+            dark_ml_change INT DEFAULT 0,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            description TEXT,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at);
+        CREATE TABLE ml_ledger_entries_default PARTITION OF ml_ledger_entries DEFAULT;
+        ALTER SEQUENCE ml_ledger_entries_id_seq OWNED BY ml_ledger_entries.id;
+        INSERT INTO ml_ledger_entries (id, transaction_id, red_ml_change, green_ml_change, blue_ml_change,
+                                       dark_ml_change, created_at, description)
+        SELECT id, transaction_id, red_ml_change, green_ml_change, blue_ml_change, dark_ml_change,
+               COALESCE(created_at, CURRENT_TIMESTAMP), description
+        FROM ml_ledger_entries_unpartitioned;
+        DROP TABLE ml_ledger_entries_unpartitioned;
+    END IF;
+
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'potion_inventory_ledger_entries'::regclass
+    ) THEN
+        ALTER TABLE potion_inventory_ledger_entries RENAME TO potion_inventory_ledger_entries_unpartitioned;
+        ALTER TABLE potion_inventory_ledger_entries_unpartitioned
+            RENAME CONSTRAINT potion_inventory_ledger_entries_pkey
+            TO potion_inventory_ledger_entries_unpartitioned_pkey;
+        CREATE TABLE potion_inventory_ledger_entries (
+            id INT NOT NULL DEFAULT nextval('potion_inventory_ledger_entries_id_seq'),
+            potion_catalog_id INT NOT NULL REFERENCES potion_catalog(id),
+            transaction_id INT,
+            change INT NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            description TEXT,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at);
+        CREATE TABLE potion_inventory_ledger_entries_default PARTITION OF potion_inventory_ledger_entries DEFAULT;
+        ALTER SEQUENCE potion_inventory_ledger_entries_id_seq OWNED BY potion_inventory_ledger_entries.id;
+        INSERT INTO potion_inventory_ledger_entries (id, potion_catalog_id, transaction_id, change,
+                                                     created_at, description)
+        SELECT id, potion_catalog_id, transaction_id, change, COALESCE(created_at, CURRENT_TIMESTAMP), description
+        FROM potion_inventory_ledger_entries_unpartitioned;
+        DROP TABLE potion_inventory_ledger_entries_unpartitioned;
+    END IF;
+END $$;
+
+-- The balance triggers went with the old tables; recreate them on the new
+-- ones, after the copy above so it did not count every entry twice.
+DROP TRIGGER IF EXISTS gold_ledger_entries_balance ON gold_ledger_entries;
+CREATE TRIGGER gold_ledger_entries_balance
+AFTER INSERT ON gold_ledger_entries
+FOR EACH ROW EXECUTE FUNCTION apply_gold_ledger_entry();
+
+DROP TRIGGER IF EXISTS ml_ledger_entries_balance ON ml_ledger_entries;
+CREATE TRIGGER ml_ledger_entries_balance
+AFTER INSERT ON ml_ledger_entries
+FOR EACH ROW EXECUTE FUNCTION apply_ml_ledger_entry();
+
+DROP TRIGGER IF EXISTS potion_inventory_ledger_entries_balance ON potion_inventory_ledger_entries;
+CREATE TRIGGER potion_inventory_ledger_entries_balance
+AFTER INSERT ON potion_inventory_ledger_entries
+FOR EACH ROW EXECUTE FUNCTION apply_potion_ledger_entry();
+
+-- Totals of every entry compacted so far, one row per account.
+CREATE TABLE IF NOT EXISTS gold_ledger_summary (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    change INT NOT NULL DEFAULT 0,
+    entries BIGINT NOT NULL DEFAULT 0,
+    compacted_before TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS ml_ledger_summary (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    red_ml_change INT NOT NULL DEFAULT 0,
+    green_ml_change INT NOT NULL DEFAULT 0,
+    blue_ml_change INT NOT NULL DEFAULT 0,
+    dark_ml_change INT NOT NULL DEFAULT 0,
+    entries BIGINT NOT NULL DEFAULT 0,
+    compacted_before TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS potion_ledger_summaries (
+    potion_catalog_id INT PRIMARY KEY REFERENCES potion_catalog(id),
+    change INT NOT NULL DEFAULT 0,
+    entries BIGINT NOT NULL DEFAULT 0,
+    compacted_before TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO gold_ledger_summary DEFAULT VALUES ON CONFLICT (id) DO NOTHING;
+INSERT INTO ml_ledger_summary DEFAULT VALUES ON CONFLICT (id) DO NOTHING;
+
+-- Detail rows of compacted partitions.
+CREATE TABLE IF NOT EXISTS gold_ledger_entries_archive (
+    id INT NOT NULL,
+    transaction_id INT,
+    change INT NOT NULL,
+    created_at TIMESTAMP NOT NULL,
+    description TEXT,
+    PRIMARY KEY (id, created_at)
+);
+
+CREATE TABLE IF NOT EXISTS ml_ledger_entries_archive (
+    id INT NOT NULL,
+    transaction_id INT,
+    red_ml_change INT DEFAULT 0,
+    green_ml_change INT DEFAULT 0,
+    blue_ml_change INT DEFAULT 0,
+    dark_ml_change INT DEFAULT 0,
+    created_at TIMESTAMP NOT NULL,
+    description TEXT,
+    PRIMARY KEY (id, created_at)
+);
+
+CREATE TABLE IF NOT EXISTS potion_inventory_ledger_entries_archive (
+    id INT NOT NULL,
+    potion_catalog_id INT NOT NULL,
+    transaction_id INT,
+    change INT NOT NULL,
+    created_at TIMESTAMP NOT NULL,
+    description TEXT,
+    PRIMARY KEY (id, created_at)
+);
+
+CREATE TABLE IF NOT EXISTS ledger_compactions (
+    id SERIAL PRIMARY KEY,
+    ledger TEXT NOT NULL,
+    partition_name TEXT NOT NULL,
+    range_start TIMESTAMP,
+    range_end TIMESTAMP NOT NULL,
+    entries BIGINT NOT NULL,
+    compacted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
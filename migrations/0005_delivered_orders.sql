@@ -0,0 +1,12 @@
+-- Idempotent deliveries (see src/deliveries.py). One row per delivered
+-- (endpoint, order_id) holding the response it returned, so a retried
+-- delivery is answered from here instead of being applied twice.
+-- Safe to re-run. Apply in a single transaction (psql -1 -f ...).
+
+CREATE TABLE IF NOT EXISTS delivered_orders (
+    endpoint TEXT NOT NULL,
+    order_id BIGINT NOT NULL,
+    response JSONB,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (endpoint, order_id)
+);
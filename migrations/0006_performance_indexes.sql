@@ -0,0 +1,31 @@
+-- Secondary indexes for the lookups, joins and sorts on foreign keys that
+-- had none. On the partitioned ledgers each index is created on every
+-- partition, and partitions created later get it when they are attached.
+-- customer_info.customer_name needs nothing here: it is UNIQUE (0002), and
+-- substring search uses its trigram index (0003).
+-- test/test_query_plans.py checks the hot queries still use them.
+-- Safe to re-run. Apply in a single transaction (psql -1 -f ...).
+
+-- Per-recipe ledger lookups, and the foreign key check when a recipe is deleted.
+CREATE INDEX IF NOT EXISTS potion_inventory_ledger_entries_potion_catalog_id_idx
+ON potion_inventory_ledger_entries (potion_catalog_id);
+
+-- The entries of a transaction, in every ledger.
+CREATE INDEX IF NOT EXISTS gold_ledger_entries_transaction_id_idx
+ON gold_ledger_entries (transaction_id);
+
+CREATE INDEX IF NOT EXISTS ml_ledger_entries_transaction_id_idx
+ON ml_ledger_entries (transaction_id);
+
+CREATE INDEX IF NOT EXISTS potion_inventory_ledger_entries_transaction_id_idx
+ON potion_inventory_ledger_entries (transaction_id);
+
+CREATE INDEX IF NOT EXISTS capacity_purchases_transaction_id_idx
+ON capacity_purchases (transaction_id);
+
+-- Order search: joining carts to customers, and the default newest-first sort.
+CREATE INDEX IF NOT EXISTS carts_customer_id_idx
+ON carts (customer_id);
+
+CREATE INDEX IF NOT EXISTS carts_created_at_idx
+ON carts (created_at);
@@ -17,7 +17,7 @@ CREATE TABLE potion_catalog (
 CREATE TABLE customer_info (
     id SERIAL PRIMARY KEY,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    customer_name TEXT NOT NULL,
+    customer_name TEXT UNIQUE NOT NULL,
     customer_class TEXT NOT NULL,
     level INT NOT NULL
 );
@@ -40,32 +40,113 @@ CREATE TABLE carts_items (
     FOREIGN KEY (catalog_id) REFERENCES potion_catalog(id)
 );
 
+-- The ledgers are partitioned by time and compacted by src/ledgers.py: closed
+-- partitions are folded into the *_ledger_summary tables and their rows moved
+-- to the *_archive tables. The DEFAULT partitions catch rows outside the
+-- partitions created so far.
 CREATE TABLE gold_ledger_entries (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     transaction_id INT,
     change INT NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    description TEXT
-);
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    description TEXT,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+CREATE TABLE gold_ledger_entries_default PARTITION OF gold_ledger_entries DEFAULT;
 
 CREATE TABLE ml_ledger_entries (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     transaction_id INT,
     red_ml_change INT DEFAULT 0,
     green_ml_change INT DEFAULT 0,
     blue_ml_change INT DEFAULT 0,
     dark_ml_change INT DEFAULT 0,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    description TEXT
-);
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    description TEXT,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+CREATE TABLE ml_ledger_entries_default PARTITION OF ml_ledger_entries DEFAULT;
 
 CREATE TABLE potion_inventory_ledger_entries (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     potion_catalog_id INT NOT NULL REFERENCES potion_catalog(id),
     transaction_id INT,
     change INT NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    description TEXT
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    description TEXT,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+CREATE TABLE potion_inventory_ledger_entries_default PARTITION OF potion_inventory_ledger_entries DEFAULT;
+
+CREATE TABLE gold_ledger_summary (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    change INT NOT NULL DEFAULT 0,
+    entries BIGINT NOT NULL DEFAULT 0,
+    compacted_before TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE ml_ledger_summary (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    red_ml_change INT NOT NULL DEFAULT 0,
+    green_ml_change INT NOT NULL DEFAULT 0,
+    blue_ml_change INT NOT NULL DEFAULT 0,
+    dark_ml_change INT NOT NULL DEFAULT 0,
+    entries BIGINT NOT NULL DEFAULT 0,
+    compacted_before TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE potion_ledger_summaries (
+    potion_catalog_id INT PRIMARY KEY REFERENCES potion_catalog(id),
+    change INT NOT NULL DEFAULT 0,
+    entries BIGINT NOT NULL DEFAULT 0,
+    compacted_before TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO gold_ledger_summary DEFAULT VALUES;
+INSERT INTO ml_ledger_summary DEFAULT VALUES;
+
+CREATE TABLE gold_ledger_entries_archive (
+    id INT NOT NULL,
+    transaction_id INT,
+    change INT NOT NULL,
+    created_at TIMESTAMP NOT NULL,
+    description TEXT,
+    PRIMARY KEY (id, created_at)
+);
+
+CREATE TABLE ml_ledger_entries_archive (
+    id INT NOT NULL,
+    transaction_id INT,
+    red_ml_change INT DEFAULT 0,
+    green_ml_change INT DEFAULT 0,
+    blue_ml_change INT DEFAULT 0,
+    dark_ml_change INT DEFAULT 0,
+    created_at TIMESTAMP NOT NULL,
+    description TEXT,
+    PRIMARY KEY (id, created_at)
+);
+
+CREATE TABLE potion_inventory_ledger_entries_archive (
+    id INT NOT NULL,
+    potion_catalog_id INT NOT NULL,
+    transaction_id INT,
+    change INT NOT NULL,
+    created_at TIMESTAMP NOT NULL,
+    description TEXT,
+    PRIMARY KEY (id, created_at)
+);
+
+CREATE TABLE ledger_compactions (
+    id SERIAL PRIMARY KEY,
+    ledger TEXT NOT NULL,
+    partition_name TEXT NOT NULL,
+    range_start TIMESTAMP,
+    range_end TIMESTAMP NOT NULL,
+    entries BIGINT NOT NULL,
+    compacted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
 CREATE TABLE transactions (
@@ -73,6 +154,15 @@ CREATE TABLE transactions (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     description TEXT
 );
+-- Responses of delivered orders, so retried deliveries are not applied twice.
+CREATE TABLE delivered_orders (
+    endpoint TEXT NOT NULL,
+    order_id BIGINT NOT NULL,
+    response JSONB,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (endpoint, order_id)
+);
+
 CREATE TABLE capacity_purchases (
     id SERIAL PRIMARY KEY,
     transaction_id INT REFERENCES transactions(id),
@@ -80,3 +170,125 @@ CREATE TABLE capacity_purchases (
     ml_capacity INT DEFAULT 0,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+
+-- Running balances maintained by the ledger triggers below, so balance reads
+-- never have to aggregate the full ledgers.
+CREATE TABLE gold_balance (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    balance INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE ml_balance (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    red_ml INT NOT NULL DEFAULT 0,
+    green_ml INT NOT NULL DEFAULT 0,
+    blue_ml INT NOT NULL DEFAULT 0,
+    dark_ml INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE potion_balances (
+    potion_catalog_id INT PRIMARY KEY REFERENCES potion_catalog(id),
+    quantity INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO gold_balance DEFAULT VALUES;
+INSERT INTO ml_balance DEFAULT VALUES;
+
+CREATE TABLE balance_checkpoints (
+    id SERIAL PRIMARY KEY,
+    gold_entry_id INT NOT NULL,
+    ml_entry_id INT NOT NULL,
+    potion_entry_id INT NOT NULL,
+    gold INT NOT NULL,
+    red_ml INT NOT NULL,
+    green_ml INT NOT NULL,
+    blue_ml INT NOT NULL,
+    dark_ml INT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE balance_checkpoint_potions (
+    checkpoint_id INT NOT NULL REFERENCES balance_checkpoints(id) ON DELETE CASCADE,
+    potion_catalog_id INT NOT NULL REFERENCES potion_catalog(id),
+    quantity INT NOT NULL,
+    PRIMARY KEY (checkpoint_id, potion_catalog_id)
+);
+
+CREATE FUNCTION apply_gold_ledger_entry() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE gold_balance
+    SET balance = balance + NEW.change, updated_at = CURRENT_TIMESTAMP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION apply_ml_ledger_entry() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE ml_balance
+    SET red_ml = red_ml + COALESCE(NEW.red_ml_change, 0),
+        green_ml = green_ml + COALESCE(NEW.green_ml_change, 0),
+        blue_ml = blue_ml + COALESCE(NEW.blue_ml_change, 0),
+        dark_ml = dark_ml + COALESCE(NEW.dark_ml_change, 0),
+        updated_at = CURRENT_TIMESTAMP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION apply_potion_ledger_entry() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO potion_balances (potion_catalog_id, quantity)
+    VALUES (NEW.potion_catalog_id, NEW.change)
+    ON CONFLICT (potion_catalog_id) DO UPDATE
+    SET quantity = potion_balances.quantity + EXCLUDED.quantity,
+        updated_at = CURRENT_TIMESTAMP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER gold_ledger_entries_balance
+AFTER INSERT ON gold_ledger_entries
+FOR EACH ROW EXECUTE FUNCTION apply_gold_ledger_entry();
+
+CREATE TRIGGER ml_ledger_entries_balance
+AFTER INSERT ON ml_ledger_entries
+FOR EACH ROW EXECUTE FUNCTION apply_ml_ledger_entry();
+
+CREATE TRIGGER potion_inventory_ledger_entries_balance
+AFTER INSERT ON potion_inventory_ledger_entries
+FOR EACH ROW EXECUTE FUNCTION apply_potion_ledger_entry();
+
+-- Substring search for /carts/search/.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX customer_info_customer_name_trgm_idx
+ON customer_info USING gin (customer_name gin_trgm_ops);
+
+CREATE INDEX potion_catalog_sku_trgm_idx
+ON potion_catalog USING gin (sku gin_trgm_ops);
+
+CREATE INDEX carts_items_catalog_id_idx
+ON carts_items (catalog_id);
+
+CREATE INDEX potion_inventory_ledger_entries_potion_catalog_id_idx
+ON potion_inventory_ledger_entries (potion_catalog_id);
+
+CREATE INDEX gold_ledger_entries_transaction_id_idx
+ON gold_ledger_entries (transaction_id);
+
+CREATE INDEX ml_ledger_entries_transaction_id_idx
+ON ml_ledger_entries (transaction_id);
+
+CREATE INDEX potion_inventory_ledger_entries_transaction_id_idx
+ON potion_inventory_ledger_entries (transaction_id);
+
+CREATE INDEX capacity_purchases_transaction_id_idx
+ON capacity_purchases (transaction_id);
+
+CREATE INDEX carts_customer_id_idx
+ON carts (customer_id);
+
+CREATE INDEX carts_created_at_idx
+ON carts (created_at);
@@ -1,20 +1,15 @@
 from fastapi import APIRouter, Depends
 from pydantic import BaseModel
-from typing import List
-from src.api import auth
-import sqlalchemy
-from src import database as db
-
-router = APIRouter(
-    prefix="/admin",
-    tags=["admin"],
-    dependencies=[Depends(auth.get_api_key)],
-)
-
-from fastapi import APIRouter, Depends
+import logging
 import sqlalchemy
 from src.api import auth
 from src import database as db
+from src import balances
+from src import ledgers
+from src import catalog_cache
+from src import catalog_index
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(
     prefix="/admin",
@@ -23,12 +18,28 @@ router = APIRouter(
 )
 
 @router.post("/reset")
+@db.endpoint
 def reset():
-    with db.engine.begin() as connection:
+    with catalog_cache.invalidating(), catalog_index.invalidating(), \
+            db.begin(statement_timeout_ms=balances.STATEMENT_TIMEOUT_MS) as connection:
         connection.execute(sqlalchemy.text("DELETE FROM gold_ledger_entries"))
         connection.execute(sqlalchemy.text("DELETE FROM ml_ledger_entries"))
         connection.execute(sqlalchemy.text("DELETE FROM potion_inventory_ledger_entries"))
+        connection.execute(sqlalchemy.text("DELETE FROM gold_ledger_entries_archive"))
+        connection.execute(sqlalchemy.text("DELETE FROM ml_ledger_entries_archive"))
+        connection.execute(sqlalchemy.text("DELETE FROM potion_inventory_ledger_entries_archive"))
+        connection.execute(sqlalchemy.text("""
+            UPDATE gold_ledger_summary
+            SET change = 0, entries = 0, compacted_before = NULL, updated_at = CURRENT_TIMESTAMP
+        """))
+        connection.execute(sqlalchemy.text("""
+            UPDATE ml_ledger_summary
+            SET red_ml_change = 0, green_ml_change = 0, blue_ml_change = 0, dark_ml_change = 0,
+                entries = 0, compacted_before = NULL, updated_at = CURRENT_TIMESTAMP
+        """))
+        connection.execute(sqlalchemy.text("DELETE FROM potion_ledger_summaries"))
         connection.execute(sqlalchemy.text("DELETE FROM transactions"))
+        connection.execute(sqlalchemy.text("DELETE FROM delivered_orders"))
         connection.execute(sqlalchemy.text("DELETE FROM carts_items"))
         connection.execute(sqlalchemy.text("DELETE FROM carts"))
         connection.execute(sqlalchemy.text("""
@@ -54,7 +65,74 @@ def reset():
             VALUES (NULL, :change, :description)
         """), {"change": 100, "description": "Initial gold balance after reset"})
 
+        balances.rebuild(connection)
+
     return {"message": "Shop has been reset. Inventory levels set to zero, gold balance set to 100."}
 
 
+class PriceChange(BaseModel):
+    price: int
+
+
+@router.post("/catalog/{sku}/price")
+@db.endpoint
+def set_potion_price(sku: str, price_change: PriceChange):
+    """
+    Change a potion's price. The catalog index and the cached catalog are
+    dropped once the change commits, so /catalog/ shows the new price at once.
+    """
+    if price_change.price < 0:
+        return {"error": "Price cannot be negative."}
+    with catalog_cache.invalidating(), catalog_index.invalidating(), db.begin() as connection:
+        updated = connection.execute(sqlalchemy.text("""
+            UPDATE potion_catalog SET price = :price WHERE sku = :sku RETURNING id
+        """), {"price": price_change.price, "sku": sku}).one_or_none()
+    if updated is None:
+        return {"error": f"No potion with SKU {sku}."}
+    logger.info("Set the price of %s to %s.", sku, price_change.price)
+    return {"sku": sku, "price": price_change.price}
+
+
+@router.post("/balances/checkpoint")
+@db.endpoint
+def checkpoint_balances():
+    """
+    Verify the running balances against the ledger tail since the last checkpoint
+    and record a new checkpoint.
+    """
+    with catalog_cache.invalidating():
+        result = balances.take_checkpoint()
+    logger.info("Balance checkpoint: %s", result)
+    return result
+
+
+@router.post("/balances/check")
+@db.endpoint
+def check_balances(repair: bool = False):
+    """
+    Compare the running balances against the full ledgers, optionally repairing them.
+    """
+    with catalog_cache.invalidating():
+        result = balances.run_check(repair=repair)
+    logger.info("Balance check: %s", result)
+    return result
+
+
+@router.post("/ledgers/compact")
+@db.endpoint
+def compact_ledgers():
+    """
+    Fold closed ledger partitions into the summaries and archive their rows.
+    """
+    with db.begin(statement_timeout_ms=balances.STATEMENT_TIMEOUT_MS) as connection:
+        result = ledgers.compact(connection)
+    logger.info("Ledger compaction: %s", result)
+    return result
+
 
+@router.get("/pool")
+def get_pool_status():
+    """
+    Connection pool occupancy and how long requests waited for a connection.
+    """
+    return db.pool_status()
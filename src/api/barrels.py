@@ -2,9 +2,15 @@ from fastapi import APIRouter, Depends
 from pydantic import BaseModel
 from typing import List
 from src.api import auth
+import logging
 import sqlalchemy
 from src import database as db
-from pulp import LpMaximize, LpProblem, LpVariable, lpSum, LpInteger
+from src import deliveries
+from src import shop_state
+from src import wholesale
+from src import solver_pool
+
+logger = logging.getLogger(__name__)
 
 
 router = APIRouter(
@@ -22,9 +28,10 @@ class Barrel(BaseModel):
 
 
 @router.post("/deliver/{order_id}")
+@db.endpoint
 def post_deliver_barrels(barrels_delivered: List[Barrel], order_id: int):
-    print(f"Delivering barrels for Order ID: {order_id}")
-    print(f"Barrels to deliver: {barrels_delivered}")
+    logger.info("Delivering barrels for Order ID: %s", order_id)
+    logger.debug("Barrels to deliver", extra={"payload": barrels_delivered})
 
     total_gold_deducted = 0
     total_green_ml_added = 0
@@ -37,41 +44,26 @@ def post_deliver_barrels(barrels_delivered: List[Barrel], order_id: int):
         total_gold_deducted += cost
         ml_added = barrel.ml_per_barrel * barrel.quantity
 
-        if barrel.potion_type == [0, 1, 0, 0]:
-            total_green_ml_added += ml_added
-        elif barrel.potion_type == [1, 0, 0, 0]:
-            total_red_ml_added += ml_added
-        elif barrel.potion_type == [0, 0, 1, 0]:
-            total_blue_ml_added += ml_added
-        elif barrel.potion_type == [0, 0, 0, 1]:
-            total_dark_ml_added += ml_added
-        else:
-            print(f"Invalid potion type for barrel SKU: {barrel.sku}")
+        if (len(barrel.potion_type) != len(wholesale.ML_COLORS) or min(barrel.potion_type) < 0
+                or not wholesale.color_shares(barrel)):
+            logger.warning("Invalid potion type for barrel SKU: %s", barrel.sku)
             raise ValueError(f"Invalid potion type for barrel SKU: {barrel.sku}")
 
-    with db.engine.begin() as connection:
-        ml_result = connection.execute(sqlalchemy.text("""
-            SELECT 
-                COALESCE(SUM(red_ml_change), 0) AS red_ml_total,
-                COALESCE(SUM(green_ml_change), 0) AS green_ml_total,
-                COALESCE(SUM(blue_ml_change), 0) AS blue_ml_total,
-                COALESCE(SUM(dark_ml_change), 0) AS dark_ml_total
-            FROM ml_ledger_entries 
-        """)).fetchone()
-
-        ml_inventory = {
-            "red": ml_result.red_ml_total or 0,
-            "green": ml_result.green_ml_total or 0,
-            "blue": ml_result.blue_ml_total or 0,
-            "dark": ml_result.dark_ml_total or 0
-        }
-
-        capacity_result = connection.execute(sqlalchemy.text("""
-            SELECT COALESCE(SUM(ml_capacity), 0) AS total_ml_capacity
-            FROM capacity_purchases
-        """)).fetchone()
-        total_ml_capacity_units = 1 + (capacity_result.total_ml_capacity or 0)
-        total_ml_capacity = total_ml_capacity_units * 10000
+        split = wholesale.split_ml(barrel, ml_added)
+        total_red_ml_added += split["red"]
+        total_green_ml_added += split["green"]
+        total_blue_ml_added += split["blue"]
+        total_dark_ml_added += split["dark"]
+
+    with db.begin() as connection:
+        replayed = deliveries.claim(connection, "barrels", order_id)
+        if replayed is not None:
+            logger.info("Barrel order %s was already delivered.", order_id)
+            return replayed
+
+        state = shop_state.load(connection, lock_gold=True, lock_ml=True)
+        ml_inventory = state.ml
+        total_ml_capacity = state.ml_capacity
 
         new_red_ml = ml_inventory["red"] + total_red_ml_added
         new_green_ml = ml_inventory["green"] + total_green_ml_added
@@ -82,19 +74,16 @@ def post_deliver_barrels(barrels_delivered: List[Barrel], order_id: int):
             new_green_ml > total_ml_capacity or
             new_blue_ml > total_ml_capacity or
             new_dark_ml > total_ml_capacity):
-            print("Cannot add ML. ML capacity would be exceeded.")
+            logger.warning("Cannot add ML. ML capacity would be exceeded.")
             raise Exception("Cannot exceed ML inventory capacity.")
 
-        gold_result = connection.execute(sqlalchemy.text("""
-            SELECT COALESCE(SUM(change), 0) as gold_total FROM gold_ledger_entries
-        """)).fetchone()
-        current_gold = gold_result.gold_total or 0
+        current_gold = state.gold
 
         updated_gold = current_gold - total_gold_deducted
-        print(f"Current Gold: {current_gold}, Gold Deducted: {total_gold_deducted}, Updated Gold: {updated_gold}")
+        logger.info("Current Gold: %s, Gold Deducted: %s, Updated Gold: %s", current_gold, total_gold_deducted, updated_gold)
 
         if updated_gold < 0:
-            print("Error: Not enough gold to complete the delivery.")
+            logger.warning("Not enough gold to complete the delivery.")
             raise Exception("Not enough gold")
 
         transaction_result = connection.execute(sqlalchemy.text("""
@@ -122,104 +111,35 @@ def post_deliver_barrels(barrels_delivered: List[Barrel], order_id: int):
             "dark_ml": total_dark_ml_added,
             "description": f"Barrel delivery order {order_id}"
         })
+        response = deliveries.record(connection, "barrels", order_id, {"message": "Inventory updated via ledger"})
 
-    print("Global inventory updated successfully via ledger entries.")
-    return {"message": "Inventory updated via ledger"}
+    logger.info("Global inventory updated successfully via ledger entries.")
+    return response
 
 
 @router.post("/plan")
+@db.endpoint
 def get_wholesale_purchase_plan(wholesale_catalog: List[Barrel]): 
     try:
-        print("Generating optimized wholesale purchase plan.")
-        with db.engine.begin() as connection:
-            gold_result = connection.execute(sqlalchemy.text("""
-                SELECT COALESCE(SUM(change), 0) AS gold_total FROM gold_ledger_entries
-            """))
-            gold = gold_result.fetchone().gold_total or 0
-            print(f"Current Gold: {gold}")
-
-            ml_result = connection.execute(sqlalchemy.text("""
-                SELECT 
-                    COALESCE(SUM(red_ml_change), 0) AS red_ml_total,
-                    COALESCE(SUM(green_ml_change), 0) AS green_ml_total,
-                    COALESCE(SUM(blue_ml_change), 0) AS blue_ml_total,
-                    COALESCE(SUM(dark_ml_change), 0) AS dark_ml_total
-                FROM ml_ledger_entries 
-            """)).fetchone()
-
-            ml_inventory = {
-                "red": ml_result.red_ml_total or 0,
-                "green": ml_result.green_ml_total or 0,
-                "blue": ml_result.blue_ml_total or 0,
-                "dark": ml_result.dark_ml_total or 0
-            }
-
-            capacity_result = connection.execute(sqlalchemy.text("""
-                SELECT COALESCE(SUM(ml_capacity), 0) AS total_ml_capacity
-                FROM capacity_purchases
-            """)).fetchone()
-            total_ml_capacity_units = 1 + (capacity_result.total_ml_capacity or 0)
-            total_ml_capacity = total_ml_capacity_units * 10000
-
-            current_total_ml = sum(ml_inventory.values())
-            remaining_capacity = total_ml_capacity - current_total_ml
-            print(f"Remaining ML Capacity: {remaining_capacity} ml")
-
-            ml_threshold = 1000  
-            ml_needs = [color for color, amount in ml_inventory.items() if amount < ml_threshold]
-
-            barrel_vars = {}
-            for barrel in wholesale_catalog:
-                ml_type = ''
-                if barrel.potion_type == [1, 0, 0, 0]:
-                    ml_type = 'red'
-                elif barrel.potion_type == [0, 1, 0, 0]:
-                    ml_type = 'green'
-                elif barrel.potion_type == [0, 0, 1, 0]:
-                    ml_type = 'blue'
-                elif barrel.potion_type == [0, 0, 0, 1]:
-                    ml_type = 'dark'
-
-                if ml_type in ml_needs:
-                    max_quantity = barrel.quantity
-                    var = LpVariable(f"b_{barrel.sku.replace(' ', '_')}", lowBound=0, upBound=max_quantity, cat=LpInteger)
-                    barrel_vars[barrel.sku] = {
-                        "variable": var,
-                        "barrel": barrel,
-                        "ml_type": ml_type
-                    }
-
-            if not barrel_vars:
-                print("No barrels needed or affordable.")
-                return []
-
-            prob = LpProblem("Wholesale_Purchase_Plan", LpMaximize)
-
-            prob += lpSum([
-                var["barrel"].ml_per_barrel * var["variable"]
-                for var in barrel_vars.values()
-            ]), "Total_ML"
-
-            prob += lpSum([
-                var["barrel"].price * var["variable"]
-                for var in barrel_vars.values()
-            ]) <= gold, "GoldConstraint"
-
-            prob += lpSum([
-                var["barrel"].ml_per_barrel * var["variable"]
-                for var in barrel_vars.values()
-            ]) <= remaining_capacity, "MLCapacityConstraint"
-
-            prob.solve()
-
-            purchase_plan = []
-            for sku, var in barrel_vars.items():
-                quantity = int(var["variable"].varValue) if var["variable"].varValue else 0
-                if quantity > 0:
-                    purchase_plan.append({"sku": sku, "quantity": quantity})
-
-            print(f"Final Purchase Plan: {purchase_plan}")
-            return purchase_plan
+        logger.info("Generating optimized wholesale purchase plan.")
+        with db.begin() as connection:
+            state = shop_state.load(connection)
+        gold = state.gold
+        logger.info("Current Gold: %s", gold)
+
+        remaining_capacity = state.ml_capacity - state.total_ml
+        logger.info("Remaining ML Capacity: %s ml", remaining_capacity)
+
+        try:
+            purchase_plan = db.run_blocking(
+                solver_pool.run, wholesale.plan, wholesale_catalog, gold, state.ml, remaining_capacity
+            )
+        except solver_pool.SolverTimeout:
+            logger.warning("Serving the greedy wholesale purchase plan.")
+            purchase_plan = wholesale.plan(wholesale_catalog, gold, state.ml, remaining_capacity, solver="greedy")
+
+        logger.debug("Final Purchase Plan", extra={"payload": purchase_plan})
+        return purchase_plan
     except Exception as e:
-        print(f"Error generating wholesale purchase plan: {e}")
+        logger.exception("Error generating wholesale purchase plan: %s", e)
         return {"status": "error", "message": "An error occurred while generating the wholesale purchase plan."}
@@ -2,10 +2,19 @@ from fastapi import APIRouter, Depends
 from enum import Enum
 from pydantic import BaseModel
 from src.api import auth
+import logging
 import sqlalchemy
 from typing import List
 from src import database as db
-from pulp import LpMaximize, LpProblem, LpVariable, lpSum, LpInteger
+from src import deliveries
+from src import shop_state
+from src import catalog_cache
+from src import catalog_index
+from src import plan_cache
+from src import bottling
+from src import solver_pool
+
+logger = logging.getLogger(__name__)
 
 
 router = APIRouter(
@@ -21,246 +30,171 @@ class PotionInventory(BaseModel):
 
 
 @router.post("/deliver/{order_id}")
+@db.endpoint
 def post_deliver_bottles(potions_delivered: List[PotionInventory], order_id: int):
-    print(f"Delivering potions for Order ID: {order_id}")
-    print(f"Potions to deliver: {potions_delivered}")
-
-    with db.engine.begin() as connection:
-        
-        potion_inventory_result = connection.execute(sqlalchemy.text("""
-            SELECT 
-                potion_catalog_id, 
-                COALESCE(SUM(change), 0) AS total_inventory
-            FROM potion_inventory_ledger_entries
-            GROUP BY potion_catalog_id
-        """)).fetchall()
-        current_potion_inventory = {row.potion_catalog_id: row.total_inventory for row in potion_inventory_result}
-
-        capacity_result = connection.execute(sqlalchemy.text("""
-            SELECT COALESCE(SUM(potion_capacity), 0) AS total_potion_capacity
-            FROM capacity_purchases
-        """)).fetchone()
-        total_potion_capacity_units = 1 + (capacity_result.total_potion_capacity or 0)
-        total_potion_capacity = total_potion_capacity_units * 50
-
-        total_potions_in_inventory = sum(current_potion_inventory.values())
-        total_potions_to_add = sum(potion.quantity for potion in potions_delivered)
-        new_total_potions = total_potions_in_inventory + total_potions_to_add
-
-        if new_total_potions > total_potion_capacity:
-            print(f"Cannot add potions. Current inventory: {total_potions_in_inventory}, Potions to add: {total_potions_to_add}, Capacity: {total_potion_capacity}")
-            return {"error": "Cannot exceed potion inventory capacity."}
+    logger.info("Delivering potions for Order ID: %s", order_id)
+    logger.debug("Potions to deliver", extra={"payload": potions_delivered})
 
-        transaction_result = connection.execute(sqlalchemy.text("""
-            INSERT INTO transactions (description) VALUES (:description) RETURNING id
-        """), {"description": f"Bottler delivery order {order_id}"})
-        transaction_id = transaction_result.fetchone().id
+    with catalog_cache.invalidating(), db.begin() as connection:
+        replayed = deliveries.claim(connection, "bottler", order_id)
+        if replayed is not None:
+            logger.info("Bottler order %s was already delivered.", order_id)
+            return replayed
+        return deliveries.record(connection, "bottler", order_id,
+                                 _deliver_bottles(connection, potions_delivered, order_id))
 
-        ml_result = connection.execute(sqlalchemy.text("""
-            SELECT 
-                COALESCE(SUM(red_ml_change), 0) AS red_ml_total,
-                COALESCE(SUM(green_ml_change), 0) AS green_ml_total,
-                COALESCE(SUM(blue_ml_change), 0) AS blue_ml_total,
-                COALESCE(SUM(dark_ml_change), 0) AS dark_ml_total
-            FROM ml_ledger_entries 
-        """)).fetchone()
 
-        ml_inventory = {
-            "red": ml_result.red_ml_total or 0,
-            "green": ml_result.green_ml_total or 0,
-            "blue": ml_result.blue_ml_total or 0,
-            "dark": ml_result.dark_ml_total or 0
+def _deliver_bottles(connection, potions_delivered, order_id):
+    """
+    Write the ledger entries for a bottler delivery and return its response.
+    Rejected deliveries return an error response and write nothing.
+    """
+    state = shop_state.load(connection, lock_ml=True)
+    total_potion_capacity = state.potion_capacity
+
+    total_potions_in_inventory = state.total_potions
+    total_potions_to_add = sum(potion.quantity for potion in potions_delivered)
+    new_total_potions = total_potions_in_inventory + total_potions_to_add
+
+    if new_total_potions > total_potion_capacity:
+        logger.warning("Cannot add potions. Current inventory: %s, Potions to add: %s, Capacity: %s", total_potions_in_inventory, total_potions_to_add, total_potion_capacity)
+        return {"error": "Cannot exceed potion inventory capacity."}
+
+    recipes = catalog_index.resolve_potion_types(
+        connection, [potion.potion_type for potion in potions_delivered]
+    )
+
+    produced = {}
+    for potion in potions_delivered:
+        potion_recipe = recipes[tuple(potion.potion_type)]
+        if not potion_recipe:
+            logger.warning("Invalid potion mix: %s", potion.potion_type)
+            return {"error": f"Invalid potion mix {potion.potion_type}"}
+        _, quantity = produced.get(potion_recipe.id, (potion_recipe, 0))
+        produced[potion_recipe.id] = (potion_recipe, quantity + potion.quantity)
+
+    ml_inventory = state.ml
+    logger.info("Initial ML Inventory: %s", ml_inventory)
+
+    # Ordered by potion id so potion_balances rows lock in the same order as checkout.
+    bottled = []
+    for potion_id in sorted(produced):
+        potion_recipe, quantity = produced[potion_id]
+        ml_required = {
+            "red": potion_recipe.red_component * quantity,
+            "green": potion_recipe.green_component * quantity,
+            "blue": potion_recipe.blue_component * quantity,
+            "dark": potion_recipe.dark_component * quantity
         }
-        print(f"Initial ML Inventory: {ml_inventory}")
-
-        for potion in potions_delivered:
-            print(f"Processing Potion Type: {potion.potion_type}, Quantity: {potion.quantity}")
-            potion_recipe = connection.execute(sqlalchemy.text("""
-                SELECT id, red_component, green_component, blue_component, dark_component
-                FROM potion_catalog
-                WHERE red_component = :red AND green_component = :green AND blue_component = :blue AND dark_component = :dark
-            """), {
-                "red": potion.potion_type[0],
-                "green": potion.potion_type[1],
-                "blue": potion.potion_type[2],
-                "dark": potion.potion_type[3]
-            }).fetchone()
-
-            if not potion_recipe:
-                print(f"Invalid potion mix: {potion.potion_type}")
-                return {"error": f"Invalid potion mix {potion.potion_type}"}
-
-            red_ml_required = potion_recipe.red_component * potion.quantity
-            green_ml_required = potion_recipe.green_component * potion.quantity
-            blue_ml_required = potion_recipe.blue_component * potion.quantity
-            dark_ml_required = potion_recipe.dark_component * potion.quantity
-
-            if (
-                ml_inventory["red"] < red_ml_required or
-                ml_inventory["green"] < green_ml_required or
-                ml_inventory["blue"] < blue_ml_required or
-                ml_inventory["dark"] < dark_ml_required
-            ):
-                print("Insufficient ML in inventory for potion production.")
-                return {"error": "Insufficient ml in inventory"}
-
-            ml_inventory["red"] -= red_ml_required
-            ml_inventory["green"] -= green_ml_required
-            ml_inventory["blue"] -= blue_ml_required
-            ml_inventory["dark"] -= dark_ml_required
-
-            connection.execute(sqlalchemy.text("""
-                INSERT INTO ml_ledger_entries (transaction_id, red_ml_change, green_ml_change, blue_ml_change, dark_ml_change, description)
-                VALUES (:transaction_id, :red_ml_change, :green_ml_change, :blue_ml_change, :dark_ml_change, :description)
-            """), {
-                "transaction_id": transaction_id,
-                "red_ml_change": -red_ml_required,
-                "green_ml_change": -green_ml_required,
-                "blue_ml_change": -blue_ml_required,
-                "dark_ml_change": -dark_ml_required,
-                "description": f"Used ml for potion {potion_recipe.id} in order {order_id}"
-            })
-
-            connection.execute(sqlalchemy.text("""
-                INSERT INTO potion_inventory_ledger_entries (potion_catalog_id, transaction_id, change, description)
-                VALUES (:catalog_id, :transaction_id, :change, :description)
-            """), {
-                "catalog_id": potion_recipe.id,
-                "transaction_id": transaction_id,
-                "change": potion.quantity,
-                "description": f"Produced {potion.quantity} units of potion {potion_recipe.id} in order {order_id}"
-            })
-
-        print(f"Global inventory updated successfully via ledger entries.")
-        return {"message": "Inventory updated successfully via ledger"}
+        for color, required in ml_required.items():
+            ml_inventory[color] -= required
+        bottled.append((potion_id, quantity, ml_required))
+
+    if any(amount < 0 for amount in ml_inventory.values()):
+        logger.warning("Insufficient ML in inventory for potion production.")
+        return {"error": "Insufficient ml in inventory"}
+
+    transaction_result = connection.execute(sqlalchemy.text("""
+        INSERT INTO transactions (description) VALUES (:description) RETURNING id
+    """), {"description": f"Bottler delivery order {order_id}"})
+    transaction_id = transaction_result.fetchone().id
+
+    connection.execute(sqlalchemy.text("""
+        INSERT INTO ml_ledger_entries (transaction_id, red_ml_change, green_ml_change, blue_ml_change, dark_ml_change, description)
+        SELECT :transaction_id, red_ml_change, green_ml_change, blue_ml_change, dark_ml_change, description
+        FROM unnest(
+            CAST(:red_ml_changes AS INT[]),
+            CAST(:green_ml_changes AS INT[]),
+            CAST(:blue_ml_changes AS INT[]),
+            CAST(:dark_ml_changes AS INT[]),
+            CAST(:descriptions AS TEXT[])
+        ) AS entries(red_ml_change, green_ml_change, blue_ml_change, dark_ml_change, description)
+    """), {
+        "transaction_id": transaction_id,
+        "red_ml_changes": [-ml_required["red"] for _, _, ml_required in bottled],
+        "green_ml_changes": [-ml_required["green"] for _, _, ml_required in bottled],
+        "blue_ml_changes": [-ml_required["blue"] for _, _, ml_required in bottled],
+        "dark_ml_changes": [-ml_required["dark"] for _, _, ml_required in bottled],
+        "descriptions": [f"Used ml for potion {potion_id} in order {order_id}" for potion_id, _, _ in bottled]
+    })
+
+    connection.execute(sqlalchemy.text("""
+        INSERT INTO potion_inventory_ledger_entries (potion_catalog_id, transaction_id, change, description)
+        SELECT potion_catalog_id, :transaction_id, change, description
+        FROM unnest(
+            CAST(:potion_catalog_ids AS INT[]),
+            CAST(:changes AS INT[]),
+            CAST(:descriptions AS TEXT[])
+        ) WITH ORDINALITY AS entries(potion_catalog_id, change, description, position)
+        ORDER BY position
+    """), {
+        "transaction_id": transaction_id,
+        "potion_catalog_ids": [potion_id for potion_id, _, _ in bottled],
+        "changes": [quantity for _, quantity, _ in bottled],
+        "descriptions": [
+            f"Produced {quantity} units of potion {potion_id} in order {order_id}"
+            for potion_id, quantity, _ in bottled
+        ]
+    })
+
+    logger.info("Global inventory updated successfully via ledger entries.")
+    return {"message": "Inventory updated successfully via ledger"}
 
 
 
 @router.post("/plan")
+@db.endpoint
 def get_bottle_plan():
     """
-    Generate an optimal bottling plan using Integer Linear Programming to maximize profit and variety.
+    Generate a bottling plan that maximizes profit and variety (see src/bottling.py).
     """
-    print("Starting optimized bottling plan generation.")
+    logger.info("Starting optimized bottling plan generation.")
     try:
-        with db.engine.begin() as connection:
-            ml_result = connection.execute(sqlalchemy.text("""
-                SELECT 
-                    COALESCE(SUM(red_ml_change), 0) AS total_red_ml,
-                    COALESCE(SUM(green_ml_change), 0) AS total_green_ml,
-                    COALESCE(SUM(blue_ml_change), 0) AS total_blue_ml,
-                    COALESCE(SUM(dark_ml_change), 0) AS total_dark_ml
-                FROM ml_ledger_entries
-            """)).fetchone()
-
-            ml_inventory = {
-                "red": ml_result.total_red_ml or 0,
-                "green": ml_result.total_green_ml or 0,
-                "blue": ml_result.total_blue_ml or 0,
-                "dark": ml_result.total_dark_ml or 0
-            }
-
-            potion_recipes = connection.execute(sqlalchemy.text("""
-                SELECT 
-                    id, name, red_component, green_component, blue_component, dark_component, price
-                FROM potion_catalog
-            """)).fetchall()
-
-            potion_inventory_result = connection.execute(sqlalchemy.text("""
-                SELECT 
-                    potion_catalog_id, 
-                    COALESCE(SUM(change), 0) AS total_inventory
-                FROM potion_inventory_ledger_entries
-                GROUP BY potion_catalog_id
-            """)).fetchall()
-            current_potion_inventory = {row.potion_catalog_id: row.total_inventory for row in potion_inventory_result}
-
-            capacity_result = connection.execute(sqlalchemy.text("""
-                SELECT COALESCE(SUM(potion_capacity), 0) AS total_potion_capacity
-                FROM capacity_purchases
-            """)).fetchone()
-            total_potion_capacity_units = 1 + (capacity_result.total_potion_capacity or 0)
-            total_potion_capacity = total_potion_capacity_units * 50
-
-            total_potions_in_inventory = sum(current_potion_inventory.values())
-            available_capacity = total_potion_capacity - total_potions_in_inventory
-
-            if available_capacity <= 0:
-                print("No available capacity for new potions.")
-                return []
-
-            prob = LpProblem("Potion_Production", LpMaximize)
-
-            potion_vars = {}
-            for potion in potion_recipes:
-                current_inventory = current_potion_inventory.get(potion.id, 0)
-                max_possible = min(50 - current_inventory, available_capacity)
-                if max_possible <= 0:
-                    continue
-                var = LpVariable(f"x_{potion.id}", lowBound=0, upBound=max_possible, cat=LpInteger)
-                is_produced = LpVariable(f"y_{potion.id}", cat="Binary")
-                potion_vars[potion.id] = {
-                    "variable": var,
-                    "is_produced": is_produced,
-                    "data": potion
-                }
-
-            if not potion_vars:
-                print("No potions can be produced within capacity constraints.")
-                return []
-
-            # Objective function: Maximize profit and variety
-            profit_weight = 0.8
-            variety_weight = 0.2
-
-            prob += (
-                profit_weight * lpSum([potion_vars[potion_id]["data"].price * var["variable"]
-                                       for potion_id, var in potion_vars.items()]) +
-                variety_weight * lpSum([var["is_produced"] for var in potion_vars.values()])
-            ), "ProfitAndVariety"
-
-            # Constraints:
-            prob += lpSum([var["variable"] for var in potion_vars.values()]) <= available_capacity, "TotalCapacity"
-
-            # ML constraints
-            for ml_type in ['red', 'green', 'blue', 'dark']:
-                prob += lpSum([
-                    getattr(var["data"], f"{ml_type}_component") * var["variable"]
-                    for var in potion_vars.values()
-                ]) <= ml_inventory[ml_type], f"{ml_type.capitalize()}MLConstraint"
-
-            # Per-potion type limit
-            for potion_id, var in potion_vars.items():
-                current_inventory = current_potion_inventory.get(potion_id, 0)
-                prob += var["variable"] + current_inventory <= 50, f"PerPotionLimit_{potion_id}"
-
-            for potion_id, var in potion_vars.items():
-                max_possible = var["variable"].upBound
-                prob += var["variable"] >= var["is_produced"], f"Link_{potion_id}"
-                prob += var["variable"] <= var["is_produced"] * max_possible, f"LinkMax_{potion_id}"
-
-            prob.solve()
-
-            production_plan = []
-            for potion_id, var in potion_vars.items():
-                quantity = int(var["variable"].varValue) if var["variable"].varValue else 0
-                if quantity > 0:
-                    potion_data = var["data"]
-                    production_plan.append({
-                        "potion_type": [
-                            potion_data.red_component,
-                            potion_data.green_component,
-                            potion_data.blue_component,
-                            potion_data.dark_component
-                        ],
-                        "quantity": quantity
-                    })
-
-            print("Optimized Bottling Plan Complete.")
-            print("Production Plan:", production_plan)
-
-            return production_plan
+        with db.begin() as connection:
+            state = shop_state.load(connection)
+            index = catalog_index.current(connection)
+
+        # Plain values only: solver_pool.run pickles them into a worker. Past
+        # CATALOG_INDEX_MAX_POTIONS the plan only considers the indexed recipes.
+        potion_recipes = [bottling.Recipe.from_row(row) for row in index.by_id.values()]
+        ml_inventory = state.ml
+        current_potion_inventory = dict(state.potions)
+        available_capacity = state.potion_capacity - state.total_potions
+
+        if available_capacity <= 0:
+            logger.info("No available capacity for new potions.")
+            return []
+
+        plan_key = plan_cache.key(
+            tuple(ml_inventory[color] for color in ("red", "green", "blue", "dark")),
+            tuple(sorted(current_potion_inventory.items())),
+            available_capacity,
+            tuple(sorted(potion_recipes))
+        )
+        cached_plan = plan_cache.bottling_plans.get(plan_key)
+        if cached_plan is not None:
+            logger.info("Serving bottling plan from the plan cache.")
+            return cached_plan
+
+        try:
+            production_plan, optimal = db.run_blocking(
+                solver_pool.run, bottling.solve,
+                potion_recipes, ml_inventory, current_potion_inventory, available_capacity
+            )
+            # A plan cut short by the solver's time budget is not cached either.
+            if optimal:
+                plan_cache.bottling_plans.put(plan_key, production_plan)
+        except solver_pool.SolverTimeout:
+            # Not cached, so the next call gets another chance at the optimum.
+            logger.warning("Serving the greedy bottling plan.")
+            production_plan = bottling.plan(
+                potion_recipes, ml_inventory, current_potion_inventory, available_capacity, solver="greedy"
+            )
+        logger.info("Optimized Bottling Plan Complete.")
+        logger.debug("Production Plan", extra={"payload": production_plan})
+
+        return production_plan
 
     except Exception as e:
-        print(f"Error generating optimized bottling plan: {e}")
+        logger.exception("Error generating optimized bottling plan: %s", e)
         return {"status": "error", "message": "An error occurred while generating the bottling plan."}
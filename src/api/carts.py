@@ -1,15 +1,21 @@
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from pydantic import BaseModel
 from src.api import auth
 from typing import List
 from enum import Enum
+import logging
 import sqlalchemy
 from src import database as db
-from sqlalchemy import select, and_, or_, func, desc, asc,String
+from src import checkout as checkout_engine
+from src import catalog_cache
+from src import catalog_index
+from sqlalchemy import select, and_, or_, func, desc, asc,String,BigInteger
 import json
 import base64
 from datetime import datetime
-from src.database import engine, customer_info, potion_catalog, carts, carts_items
+from src.database import customer_info, potion_catalog, carts, carts_items
+
+logger = logging.getLogger(__name__)
 
 
 router = APIRouter(
@@ -28,40 +34,84 @@ class search_sort_order(str, Enum):
     asc = "asc"
     desc = "desc"   
 
-@router.get("/search/", tags=["search"])
-def search_orders(
-    customer_name: str = "",
-    potion_sku: str = "",
-    search_page: str = "",
-    sort_col: search_sort_options = search_sort_options.timestamp,
-    sort_order: search_sort_order = search_sort_order.desc,
-):
-    MAX_RESULTS = 5 
-
+def _encode_search_cursor(sort_col, sort_order, sort_key, line_item_id, direction):
+    if isinstance(sort_key, datetime):
+        sort_key = sort_key.isoformat()
+    payload = {
+        "col": sort_col.value,
+        "order": sort_order.value,
+        "key": sort_key,
+        "id": line_item_id,
+        "dir": direction
+    }
+    token = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+    return token.rstrip("=")
+
+# The JSON type of each sort column's cursor key; timestamps travel as ISO strings.
+_SEARCH_CURSOR_KEY_TYPES = {
+    search_sort_options.customer_name: str,
+    search_sort_options.item_sku: str,
+    search_sort_options.line_item_total: int,
+    search_sort_options.timestamp: str,
+}
+
+def _decode_search_cursor(token, sort_col, sort_order):
+    """
+    Decode a search_page token, or return None if it is empty, malformed or was
+    issued for a different sort. A token for this sort whose key or id has the
+    wrong type is rejected with a 400 rather than reaching the query.
+    """
+    if not token:
+        return None
     try:
-        page = int(search_page) if search_page else 1
-        if page < 1:
-            page = 1
-    except (ValueError, TypeError):
-        page = 1
-
-    offset = (page - 1) * MAX_RESULTS
+        payload = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        if payload["col"] != sort_col.value or payload["order"] != sort_order.value:
+            return None
+        if payload["dir"] not in ("next", "prev"):
+            return None
+        key, line_item_id = payload["key"], payload["id"]
+    except (ValueError, TypeError, KeyError):
+        return None
+
+    # bool is an int subclass, but never a valid key or id.
+    valid = (
+        type(key) is _SEARCH_CURSOR_KEY_TYPES[sort_col] and type(line_item_id) is int
+    )
+    if valid and sort_col == search_sort_options.timestamp:
+        try:
+            payload["key"] = datetime.fromisoformat(key)
+        except ValueError:
+            valid = False
+    if not valid:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid search_page cursor.")
+    return payload
+
+def _contains_pattern(text):
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+def build_search_query(customer_name, potion_sku, sort_col, sort_order, cursor, limit):
+    """
+    The line item search SELECT for the given filters, sort and decoded cursor.
+    """
+    backwards = cursor is not None and cursor["dir"] == "prev"
 
-    line_item_id_expr = (carts_items.c.cart_id * 100000 + carts_items.c.catalog_id).label('line_item_id')
+    # BIGINT: past cart 21474 the product no longer fits the INT columns.
+    line_item_id = carts_items.c.cart_id.cast(BigInteger) * 100000 + carts_items.c.catalog_id
 
-    item_sku_expr = func.concat(
+    item_sku = func.concat(
         carts_items.c.quantity.cast(String),
         ' x ',
         potion_catalog.c.name
-    ).label('item_sku')
+    )
 
-    line_item_total_expr = (carts_items.c.quantity * potion_catalog.c.price).label('line_item_total')
+    line_item_total = carts_items.c.quantity * potion_catalog.c.price
 
     query = select(
-        line_item_id_expr,
-        item_sku_expr,
+        line_item_id.label('line_item_id'),
+        item_sku.label('item_sku'),
         customer_info.c.customer_name,
-        line_item_total_expr,
+        line_item_total.label('line_item_total'),
         carts.c.created_at.label('timestamp')
     ).select_from(
         carts_items
@@ -70,36 +120,73 @@ def search_orders(
         .join(customer_info, carts.c.customer_id == customer_info.c.id)
     )
 
+    # Substring filters are served by the pg_trgm GIN indexes on these columns
+    # (migrations/0003_search_trigram_indexes.sql).
     if customer_name:
-        query = query.where(customer_info.c.customer_name.ilike(f"%{customer_name}%"))
+        query = query.where(customer_info.c.customer_name.ilike(_contains_pattern(customer_name), escape="\\"))
     if potion_sku:
-        query = query.where(potion_catalog.c.sku.ilike(f"%{potion_sku}%"))
+        query = query.where(potion_catalog.c.sku.ilike(_contains_pattern(potion_sku), escape="\\"))
 
     sort_col_mapping = {
         "customer_name": customer_info.c.customer_name,
-        "item_sku": item_sku_expr,
-        "line_item_total": line_item_total_expr,
+        "item_sku": item_sku,
+        "line_item_total": line_item_total,
         "timestamp": carts.c.created_at
     }
     sort_column = sort_col_mapping.get(sort_col.value, carts.c.created_at)
 
-    if sort_order == search_sort_order.asc:
-        query = query.order_by(asc(sort_column), asc(line_item_id_expr))
+    # Walking back to the previous page scans in the opposite direction and
+    # flips the rows afterwards.
+    scan_descending = (sort_order == search_sort_order.desc) != backwards
+
+    if cursor is not None:
+        position = sqlalchemy.tuple_(sort_column, line_item_id)
+        boundary = sqlalchemy.tuple_(sqlalchemy.literal(cursor["key"]), sqlalchemy.literal(cursor["id"]))
+        query = query.where(position < boundary if scan_descending else position > boundary)
+
+    if scan_descending:
+        query = query.order_by(desc(sort_column), desc(line_item_id))
     else:
-        query = query.order_by(desc(sort_column), desc(line_item_id_expr))
+        query = query.order_by(asc(sort_column), asc(line_item_id))
 
-    query = query.limit(MAX_RESULTS + 1).offset(offset)
+    return query.limit(limit)
 
-    with engine.connect() as conn:
+@router.get("/search/", tags=["search"])
+@db.endpoint
+def search_orders(
+    customer_name: str = "",
+    potion_sku: str = "",
+    search_page: str = "",
+    sort_col: search_sort_options = search_sort_options.timestamp,
+    sort_order: search_sort_order = search_sort_order.desc,
+):
+    """
+    Search line items with keyset pagination. search_page is an opaque cursor
+    taken from a previous response's next/previous link; it carries the sort key
+    and line_item_id of the row the page starts after, so every page costs the
+    same as the first.
+    """
+    MAX_RESULTS = 5
+
+    cursor = _decode_search_cursor(search_page, sort_col, sort_order)
+    backwards = cursor is not None and cursor["dir"] == "prev"
+
+    query = build_search_query(customer_name, potion_sku, sort_col, sort_order, cursor, MAX_RESULTS + 1)
+
+    with db.begin() as conn:
         rows = conn.execute(query).fetchall()
 
-    has_next = len(rows) > MAX_RESULTS
-    if has_next:
-        rows = rows[:MAX_RESULTS]
+    has_more = len(rows) > MAX_RESULTS
+    rows = rows[:MAX_RESULTS]
+    if backwards:
+        rows.reverse()
+        has_next, has_previous = True, has_more
+    else:
+        has_next, has_previous = has_more, cursor is not None
 
     results = []
     for row in rows:
-        timestamp_str = row.timestamp.strftime('%Y-%m-%dT%H:%M:%SZ')  
+        timestamp_str = row.timestamp.strftime('%Y-%m-%dT%H:%M:%SZ')
         result_item = {
             "line_item_id": row.line_item_id,
             "item_sku": row.item_sku,
@@ -114,14 +201,16 @@ def search_orders(
     query_params = f"customer_name={customer_name}&potion_sku={potion_sku}&sort_col={sort_col.value}&sort_order={sort_order.value}"
 
     next_link = ""
-    if has_next:
-        next_page = page + 1
-        next_link = f"{base_path}?{query_params}&search_page={next_page}"
+    if has_next and rows:
+        last = rows[-1]
+        next_cursor = _encode_search_cursor(sort_col, sort_order, getattr(last, sort_col.value), last.line_item_id, "next")
+        next_link = f"{base_path}?{query_params}&search_page={next_cursor}"
 
     previous_link = ""
-    if page > 1:
-        prev_page = page - 1
-        previous_link = f"{base_path}?{query_params}&search_page={prev_page}"
+    if has_previous and rows:
+        first = rows[0]
+        previous_cursor = _encode_search_cursor(sort_col, sort_order, getattr(first, sort_col.value), first.line_item_id, "prev")
+        previous_link = f"{base_path}?{query_params}&search_page={previous_cursor}"
 
     return {
         "previous": previous_link,
@@ -135,45 +224,43 @@ class Customer(BaseModel):
     level: int
 
 @router.post("/visits/{visit_id}")
+@db.endpoint
 def post_visits(visit_id: int, customers: List[Customer]):
     """
-    Log customer visits and save them to the customer_info table if they don't already exist.
+    Log customer visits, upserting the whole batch into customer_info in one statement.
     """
-    print(f"Visit ID: {visit_id}")
-    print(f"Customers visiting: {customers}")
-
-    with db.engine.begin() as connection:
-        for customer in customers:
-            existing_customer = connection.execute(sqlalchemy.text("""
-                SELECT id FROM customer_info
-                WHERE customer_name = :customer_name
-            """), {"customer_name": customer.customer_name}).fetchone()
-
-            if existing_customer:
-                connection.execute(sqlalchemy.text("""
-                    UPDATE customer_info
-                    SET customer_class = :customer_class, level = :level
-                    WHERE id = :customer_id
-                """), {
-                    "customer_class": customer.character_class,
-                    "level": customer.level,
-                    "customer_id": existing_customer.id
-                })
-                print(f"Updated customer {customer.customer_name} with new information.")
-            else:
-                result = connection.execute(sqlalchemy.text("""
-                    INSERT INTO customer_info (customer_name, customer_class, level)
-                    VALUES (:customer_name, :customer_class, :level)
-                    RETURNING id
-                """), {
-                    "customer_name": customer.customer_name,
-                    "customer_class": customer.character_class,
-                    "level": customer.level
-                })
-                new_customer_id = result.fetchone().id
-                print(f"Added new customer {customer.customer_name} with ID {new_customer_id}.")
+    logger.info("Visit ID: %s", visit_id)
+    logger.debug("Customers visiting", extra={"payload": customers})
+
+    # Later entries win for repeated names; ON CONFLICT can only touch a row once
+    # per statement. Sorting keeps row locks in a stable order across batches.
+    latest = {customer.customer_name: customer for customer in customers}
+    batch = [latest[name] for name in sorted(latest)]
+    if not batch:
+        return {"message": "Visit logged successfully", "customer_ids": {}}
+
+    with db.begin() as connection:
+        rows = connection.execute(sqlalchemy.text("""
+            INSERT INTO customer_info (customer_name, customer_class, level)
+            SELECT *
+            FROM unnest(
+                CAST(:customer_names AS TEXT[]),
+                CAST(:customer_classes AS TEXT[]),
+                CAST(:levels AS INT[])
+            )
+            ON CONFLICT (customer_name) DO UPDATE
+            SET customer_class = EXCLUDED.customer_class, level = EXCLUDED.level
+            RETURNING id, customer_name
+        """), {
+            "customer_names": [customer.customer_name for customer in batch],
+            "customer_classes": [customer.character_class for customer in batch],
+            "levels": [customer.level for customer in batch]
+        }).fetchall()
 
-    return {"message": "Visit logged successfully"}
+    customer_ids = {row.customer_name: row.id for row in rows}
+    logger.info("Upserted %s customers for visit %s.", len(customer_ids), visit_id)
+
+    return {"message": "Visit logged successfully", "customer_ids": customer_ids}
 
 
 class CartItem(BaseModel):
@@ -181,18 +268,19 @@ class CartItem(BaseModel):
 
 
 @router.post("/")
+@db.endpoint
 def create_cart():
     """
     Create a new cart and set the status to 'active', associating it with an existing customer_id.
     """
     try:
-        with db.engine.begin() as connection:
+        with db.begin() as connection:
             customer = connection.execute(
                 sqlalchemy.text("SELECT id FROM customer_info LIMIT 1")
             ).fetchone()
 
             if not customer:
-                print("No customers found. Please add a customer first.")
+                logger.info("No customers found. Please add a customer first.")
                 return {"error": "No customers available. Please add a customer first."}
 
             customer_id = customer.id
@@ -207,25 +295,24 @@ def create_cart():
             )
             fetched = result.fetchone()
             cart_id = fetched.id
-            print(f"Created cart with ID: {cart_id} for customer_id {customer_id}")
+            logger.info("Created cart with ID: %s for customer_id %s", cart_id, customer_id)
         return {"cart_id": cart_id}
     except Exception as e:
-        print(f"Error creating cart: {e}")
+        logger.exception("Error creating cart: %s", e)
         return {"error": "Failed to create cart."}
 
 @router.post("/{cart_id}/items/{item_sku}")
+@db.endpoint
 def set_item_quantity(cart_id: int, item_sku: str, cart_item: CartItem):
     try:
-        with db.engine.begin() as connection:
-            cart = connection.execute(sqlalchemy.text("""
-                SELECT id FROM carts WHERE id = :cart_id FOR UPDATE
-            """), {"cart_id": cart_id}).scalar_one()
-
-            catalog_item_id = connection.execute(sqlalchemy.text("""
-                SELECT id FROM potion_catalog WHERE sku = :item_sku FOR UPDATE
-            """), {"item_sku": item_sku}).scalar_one()
+        with db.begin() as connection:
+            catalog_item = catalog_index.row_for_sku(connection, item_sku)
+            if catalog_item is None:
+                logger.warning("Unknown SKU %s for cart %s", item_sku, cart_id)
+                return {"error": "Failed to set item quantity."}
+            catalog_item_id = catalog_item.id
 
-            print(f"Updating cart_id {cart_id} with item_sku {item_sku} (catalog_id {catalog_item_id}) to quantity {cart_item.quantity}")
+            logger.info("Updating cart_id %s with item_sku %s (catalog_id %s) to quantity %s", cart_id, item_sku, catalog_item_id, cart_item.quantity)
 
             connection.execute(sqlalchemy.text("""
                 INSERT INTO carts_items (cart_id, catalog_id, quantity, sku)
@@ -239,11 +326,11 @@ def set_item_quantity(cart_id: int, item_sku: str, cart_item: CartItem):
                 "item_sku": item_sku
             })
 
-            print(f"Set quantity for SKU {item_sku} in cart {cart_id} to {cart_item.quantity}")
+            logger.info("Set quantity for SKU %s in cart %s to %s", item_sku, cart_id, cart_item.quantity)
 
         return {"success": True}
     except Exception as e:
-        print(f"Error setting item quantity: {e}")
+        logger.exception("Error setting item quantity: %s", e)
         return {"error": "Failed to set item quantity."}
 
 
@@ -252,85 +339,17 @@ class CartCheckout(BaseModel):
     payment: str
 
 @router.post("/{cart_id}/checkout")
+@db.endpoint
 def checkout(cart_id: int, cart_checkout: CartCheckout):
     try:
-        with db.engine.begin() as connection:
-            cart_items = connection.execute(sqlalchemy.text("""
-                SELECT ci.quantity, c.id as catalog_id, c.sku, c.price
-                FROM carts_items ci
-                JOIN potion_catalog c ON ci.catalog_id = c.id
-                WHERE ci.cart_id = :cart_id
-                FOR UPDATE
-            """), {"cart_id": cart_id}).fetchall()
-
-            if not cart_items:
-                print(f"Cart {cart_id} is empty.")
-                return {"error": "Cart is empty"}
-
-            total_gold_paid = sum(item.price * item.quantity for item in cart_items)
-            total_potions_bought = sum(item.quantity for item in cart_items)
-
-            insufficient_inventory = []
-            for item in cart_items:
-                current_inventory = connection.execute(sqlalchemy.text("""
-                    SELECT COALESCE(SUM(change), 0) as total_inventory
-                    FROM potion_inventory_ledger_entries
-                    WHERE potion_catalog_id = :catalog_id
-                """), {"catalog_id": item.catalog_id}).scalar_one()
-
-                if current_inventory < item.quantity:
-                    insufficient_inventory.append(item.sku)
-
-            if insufficient_inventory:
-                print(f"Insufficient inventory for SKUs: {insufficient_inventory}")
-                return {"error": f"Insufficient inventory for potions: {', '.join(insufficient_inventory)}"}
-
-            transaction_id = connection.execute(sqlalchemy.text("""
-                INSERT INTO transactions (description) VALUES (:description) RETURNING id
-            """), {"description": f"Cart checkout {cart_id}"}).scalar_one()
-
-            for item in cart_items:
-                connection.execute(sqlalchemy.text("""
-                    INSERT INTO potion_inventory_ledger_entries (potion_catalog_id, transaction_id, change, description)
-                    VALUES (:catalog_id, :transaction_id, :change, :description)
-                """), {
-                    "catalog_id": item.catalog_id,
-                    "transaction_id": transaction_id,
-                    "change": -item.quantity,
-                    "description": f"Sold {item.quantity} units of SKU {item.sku} from cart {cart_id}"
-                })
+        with catalog_cache.invalidating(), db.begin() as connection:
+            result = checkout_engine.checkout_cart(connection, cart_id)
 
-            connection.execute(sqlalchemy.text("""
-                INSERT INTO gold_ledger_entries (transaction_id, change, description)
-                VALUES (:transaction_id, :change, :description)
-            """), {
-                "transaction_id": transaction_id,
-                "change": total_gold_paid,
-                "description": f"Revenue from cart checkout {cart_id}"
-            })
+        if "error" not in result:
+            logger.info("Checkout successful")
+            logger.info("The total gold paid is: %s", result['total_gold_paid'])
 
-            connection.execute(sqlalchemy.text("""
-                UPDATE carts 
-                SET status = 'checked_out', updated_at = CURRENT_TIMESTAMP 
-                WHERE id = :cart_id
-            """), {"cart_id": cart_id})
-
-            #connection.execute(sqlalchemy.text("""
-            #    DELETE FROM carts_items WHERE cart_id = :cart_id
-           # """), {"cart_id": cart_id})
-
-            new_gold = connection.execute(sqlalchemy.text("""
-                SELECT COALESCE(SUM(change), 0) as gold_total FROM gold_ledger_entries
-            """)).scalar()
-
-        print("Checkout successful")
-        print(f"The total gold paid is: {total_gold_paid}")
-        print(f"The remaining gold is: {new_gold}")
-
-        return {
-            "total_gold_paid": total_gold_paid,
-            "total_potions_bought": total_potions_bought
-        }
+        return result
     except Exception as e:
-        print(f"Error during checkout: {e}")
+        logger.exception("Error during checkout: %s", e)
         return {"error": "Checkout failed due to an internal error."}
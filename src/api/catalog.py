@@ -1,52 +1,51 @@
 from fastapi import APIRouter
+import logging
 import sqlalchemy
 from typing import List
 from src import database as db
+from src import catalog_cache
+from src import catalog_index
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 
 @router.get("/catalog/", tags=["catalog"])
+@db.endpoint
 def get_catalog():
-    print("Starting to fetch potion catalog.")
-    catalog = []
-    catalog_limit = 6  
-    with db.engine.begin() as connection:
-        result = connection.execute(sqlalchemy.text("""
-            SELECT id, sku, name, price, red_component, green_component, blue_component, dark_component
-            FROM potion_catalog
-            ORDER BY price DESC
-        """))
-        rows = result.fetchall()
-        print(f"Fetched {len(rows)} potions from the database.")
-        
-        for row in rows:
-            if len(catalog) >= catalog_limit:
-                print("Reached catalog SKU limit.")
-                break  
-
-            ledger_result = connection.execute(sqlalchemy.text("""
-                SELECT COALESCE(SUM(change), 0) as total_inventory
-                FROM potion_inventory_ledger_entries
-                WHERE potion_catalog_id = :catalog_id
-            """), {"catalog_id": row.id})
-            total_inventory = ledger_result.fetchone().total_inventory or 0
-
-            if total_inventory < 1:
-                print(f"Skipping SKU: {row.sku} due to insufficient inventory.")
-                continue
-
-            potion_type = [row.red_component, row.green_component, row.blue_component, row.dark_component]
-            catalog.append({
-                "sku": row.sku,
-                "name": row.name,
-                "quantity": total_inventory,
-                "price": row.price,
-                "potion_type": potion_type 
-            })
-            print(f"Added Potion to Catalog: SKU {row.sku}, Quantity {total_inventory}, Price {row.price}")
-
-        print(f"Added {len(catalog)} potions to the catalog.")
-    
-    print("Completed fetching potion catalog.")
-    return catalog if catalog else []
\ No newline at end of file
+    catalog, generation = catalog_cache.get()
+    if catalog is not None:
+        logger.info("Serving %s potions from the catalog cache.", len(catalog))
+        return catalog
+
+    logger.info("Starting to fetch potion catalog.")
+    catalog_limit = 6
+    with db.begin() as connection:
+        in_stock = connection.execute(sqlalchemy.text("""
+            SELECT potion_catalog_id, quantity
+            FROM potion_balances
+            WHERE quantity > 0
+        """)).fetchall()
+        catalog_rows = catalog_index.rows_for_ids(connection, [potion_id for potion_id, _ in in_stock])
+
+    rows = sorted(
+        ((catalog_rows[potion_id], quantity) for potion_id, quantity in in_stock if potion_id in catalog_rows),
+        key=lambda item: item[0].price,
+        reverse=True
+    )[:catalog_limit]
+
+    catalog = [
+        {
+            "sku": row.sku,
+            "name": row.name,
+            "quantity": quantity,
+            "price": row.price,
+            "potion_type": [row.red_component, row.green_component, row.blue_component, row.dark_component]
+        }
+        for row, quantity in rows
+    ]
+    catalog_cache.store(catalog, generation)
+
+    logger.info("Added %s potions to the catalog.", len(catalog))
+    return catalog
@@ -1,6 +1,13 @@
-from fastapi import APIRouter, Depends, Request
+import logging
+from fastapi import APIRouter, BackgroundTasks, Depends, Request
 from pydantic import BaseModel
 from src.api import auth
+from src import database as db
+from src import balances
+from src import ledgers
+from src import catalog_cache
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(
     prefix="/info",
@@ -13,9 +20,34 @@ class Timestamp(BaseModel):
     hour: int
 
 @router.post("/current_time")
-def post_time(timestamp: Timestamp):
+@db.endpoint
+def post_time(timestamp: Timestamp, background_tasks: BackgroundTasks):
     """
-    Share current time.
+    Share current time. After the response goes out, each tick also makes
+    sure the upcoming ledger partitions exist and checkpoints the running
+    balances (see maintain_ledgers).
     """
+    background_tasks.add_task(maintain_ledgers, timestamp.day, timestamp.hour)
     return "OK"
 
+
+@db.endpoint
+def maintain_ledgers(day, hour):
+    """
+    Tick housekeeping, run as a background task so it never fails or delays
+    the tick itself. Each step is retried on the next tick if it fails.
+    """
+    try:
+        with db.begin(statement_timeout_ms=balances.STATEMENT_TIMEOUT_MS) as connection:
+            ledgers.ensure_partitions(connection)
+    except Exception:
+        logger.exception("Creating ledger partitions failed at %s %s.", day, hour)
+
+    try:
+        with catalog_cache.invalidating():
+            result = balances.take_checkpoint()
+    except Exception:
+        logger.exception("Balance checkpoint failed at %s %s.", day, hour)
+        return
+    if not result["consistent"]:
+        logger.warning("Balance checkpoint at %s %s: %s", day, hour, result)
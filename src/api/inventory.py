@@ -1,8 +1,18 @@
 from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from enum import Enum
+from typing import Optional
+import json
 from src.api import auth
+import logging
 import sqlalchemy
 from src import database as db
+from src import balances
+from src import deliveries
+from src import shop_state
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(
     prefix="/inventory",
@@ -10,71 +20,75 @@ router = APIRouter(
     dependencies=[Depends(auth.get_api_key)],
 )
 
-@router.get("/audit")
-def audit_inventory():
-    print("Starting inventory audit.")
-    with db.engine.begin() as connection:
-        gold_result = connection.execute(sqlalchemy.text("""
-            SELECT COALESCE(SUM(change), 0) as gold_total FROM gold_ledger_entries
-        """))
-        total_gold = gold_result.fetchone().gold_total or 0
-
-        ml_result = connection.execute(sqlalchemy.text("""
-            SELECT 
-                COALESCE(SUM(red_ml_change), 0) as total_red_ml,
-                COALESCE(SUM(green_ml_change), 0) as total_green_ml,
-                COALESCE(SUM(blue_ml_change), 0) as total_blue_ml,
-                COALESCE(SUM(dark_ml_change), 0) as total_dark_ml
-            FROM ml_ledger_entries
-        """)).fetchone()
-
-        total_red_ml = ml_result.total_red_ml
-        total_green_ml = ml_result.total_green_ml
-        total_blue_ml = ml_result.total_blue_ml
-        total_dark_ml = ml_result.total_dark_ml
-
-        potion_catalog_res = connection.execute(sqlalchemy.text("""
-            SELECT 
-                id, name, red_component, green_component, blue_component, dark_component
-            FROM potion_catalog
-        """)).fetchall()
-
-        potion_inventory = []
-
-        for row in potion_catalog_res:
-            ledger_result = connection.execute(sqlalchemy.text("""
-                SELECT COALESCE(SUM(change), 0) as total_inventory
-                FROM potion_inventory_ledger_entries
-                WHERE potion_catalog_id = :catalog_id
-            """), {"catalog_id": row.id})
-            total_inventory = ledger_result.fetchone().total_inventory or 0
-
-            custom_potion = {
-                "name": row.name,
-                "red_component": row.red_component,
-                "green_component": row.green_component,
-                "blue_component": row.blue_component,
-                "dark_component": row.dark_component,
-                "inventory": total_inventory
-            }
-            potion_inventory.append(custom_potion)
-            print(f"Custom Potion: {custom_potion}")
-
-        audit_data = {
-            "gold": total_gold,
-            "ml_inventory": {
-                "red_ml": total_red_ml,
-                "green_ml": total_green_ml,
-                "blue_ml": total_blue_ml,
-                "dark_ml": total_dark_ml
-            },
-            "potion_inventory": {
-                "custom_potions": potion_inventory
-            }
-        }
+class audit_sections(str, Enum):
+    gold = "gold"
+    ml = "ml"
+    potions = "potions"
 
-    print(f"Audit Data: {audit_data}")
-    return audit_data
+AUDIT_BATCH_SIZE = 100
+AUDIT_STATEMENT_TIMEOUT_MS = 30000
+
+def _stream_audit(section):
+    """
+    Yield the audit JSON piece by piece; potion rows are fetched in batches
+    through a server-side cursor and written out as they arrive.
+    """
+    with db.begin(statement_timeout_ms=AUDIT_STATEMENT_TIMEOUT_MS) as connection:
+        yield "{"
+        separator = ""
+
+        if section in (None, audit_sections.gold):
+            total_gold = balances.get_gold(connection)
+            yield f'"gold": {json.dumps(total_gold)}'
+            separator = ", "
+            logger.info("Audit gold: %s", total_gold)
+
+        if section in (None, audit_sections.ml):
+            ml_inventory = balances.get_ml(connection)
+            yield separator + '"ml_inventory": ' + json.dumps({
+                "red_ml": ml_inventory["red"],
+                "green_ml": ml_inventory["green"],
+                "blue_ml": ml_inventory["blue"],
+                "dark_ml": ml_inventory["dark"]
+            })
+            separator = ", "
+            logger.info("Audit ml: %s", ml_inventory)
+
+        if section in (None, audit_sections.potions):
+            yield separator + '"potion_inventory": {"custom_potions": ['
+            potion_rows = connection.execute(sqlalchemy.text("""
+                SELECT
+                    pc.name, pc.red_component, pc.green_component, pc.blue_component, pc.dark_component,
+                    COALESCE(pb.quantity, 0) AS inventory
+                FROM potion_catalog pc
+                LEFT JOIN potion_balances pb ON pb.potion_catalog_id = pc.id
+                ORDER BY pc.id
+            """), execution_options={"yield_per": AUDIT_BATCH_SIZE})
+
+            potion_count = 0
+            for row in potion_rows:
+                yield ("," if potion_count else "") + json.dumps({
+                    "name": row.name,
+                    "red_component": row.red_component,
+                    "green_component": row.green_component,
+                    "blue_component": row.blue_component,
+                    "dark_component": row.dark_component,
+                    "inventory": row.inventory
+                })
+                potion_count += 1
+            yield "]}"
+            logger.info("Audit potions: %s recipes", potion_count)
+
+        yield "}"
+
+@router.get("/audit")
+@db.endpoint
+def audit_inventory(section: Optional[audit_sections] = None):
+    """
+    Audit gold, ml and per-recipe potion inventory, or only the requested section.
+    """
+    logger.info("Starting inventory audit (section: %s).", section.value if section else 'all')
+    return StreamingResponse(db.stream(_stream_audit(section)), media_type="application/json")
 
 
 class CapacityPurchase(BaseModel):
@@ -82,57 +96,35 @@ class CapacityPurchase(BaseModel):
     ml_capacity: int
 
 @router.post("/plan")
+@db.endpoint
 def get_capacity_plan():
     """
     Get the current capacity plan based on available gold. Each additional capacity 
     for potions (50 potions) and ml (10,000 ml) costs 1000 gold.
     """
-    print("Calculating capacity plan.")
-    with db.engine.begin() as connection:
-        capacity_result = connection.execute(sqlalchemy.text("""
-            SELECT 
-                COALESCE(SUM(potion_capacity), 0) as total_potion_capacity,
-                COALESCE(SUM(ml_capacity), 0) as total_ml_capacity
-            FROM capacity_purchases
-        """)).fetchone()
-        total_potion_capacity_units = 1 + capacity_result.total_potion_capacity
-        total_ml_capacity_units = 1 + capacity_result.total_ml_capacity
-
-        total_potion_capacity = total_potion_capacity_units * 50
-        total_ml_capacity = total_ml_capacity_units * 10000
-
-        print(f"Total potion capacity units: {total_potion_capacity_units}, Total ml capacity units: {total_ml_capacity_units}")
-        print(f"Total potion capacity: {total_potion_capacity}, Total ml capacity: {total_ml_capacity}")
-
-        potion_inventory_result = connection.execute(sqlalchemy.text("""
-            SELECT COALESCE(SUM(change), 0) as total_potions
-            FROM potion_inventory_ledger_entries
-        """)).fetchone()
-        total_potions = potion_inventory_result.total_potions or 0
-
-        ml_result = connection.execute(sqlalchemy.text("""
-            SELECT 
-                COALESCE(SUM(red_ml_change), 0) as total_red_ml,
-                COALESCE(SUM(green_ml_change), 0) as total_green_ml,
-                COALESCE(SUM(blue_ml_change), 0) as total_blue_ml,
-                COALESCE(SUM(dark_ml_change), 0) as total_dark_ml
-            FROM ml_ledger_entries
-        """)).fetchone()
-        total_ml_inventory = (
-            ml_result.total_red_ml +
-            ml_result.total_green_ml +
-            ml_result.total_blue_ml +
-            ml_result.total_dark_ml
-        )
-
-        print(f"Total potions in inventory: {total_potions}")
-        print(f"Total ml in inventory: {total_ml_inventory}")
+    logger.info("Calculating capacity plan.")
+    with db.begin() as connection:
+        state = shop_state.load(connection)
+        total_potion_capacity_units = state.potion_capacity_units
+        total_ml_capacity_units = state.ml_capacity_units
+
+        total_potion_capacity = state.potion_capacity
+        total_ml_capacity = state.ml_capacity
+
+        logger.info("Total potion capacity units: %s, Total ml capacity units: %s", total_potion_capacity_units, total_ml_capacity_units)
+        logger.info("Total potion capacity: %s, Total ml capacity: %s", total_potion_capacity, total_ml_capacity)
+
+        total_potions = state.total_potions
+        total_ml_inventory = state.total_ml
+
+        logger.info("Total potions in inventory: %s", total_potions)
+        logger.info("Total ml in inventory: %s", total_ml_inventory)
 
         potion_capacity_usage = total_potions / total_potion_capacity
         ml_capacity_usage = total_ml_inventory / total_ml_capacity
 
-        print(f"Potion capacity usage: {potion_capacity_usage * 100:.2f}%")
-        print(f"ML capacity usage: {ml_capacity_usage * 100:.2f}%")
+        logger.info("Potion capacity usage: %.2f%%", potion_capacity_usage * 100)
+        logger.info("ML capacity usage: %.2f%%", ml_capacity_usage * 100)
 
         potion_capacity_to_buy = 0
         ml_capacity_to_buy = 0
@@ -140,33 +132,35 @@ def get_capacity_plan():
         threshold = 0.8 
         UNIT_COST = 1000
 
-        gold_result = connection.execute(sqlalchemy.text("""
-            SELECT COALESCE(SUM(change), 0) as gold_total FROM gold_ledger_entries
-        """))
-        total_gold = gold_result.fetchone().gold_total or 0
-        print(f"Total gold available: {total_gold}")
+        total_gold = state.gold
+        logger.info("Total gold available: %s", total_gold)
 
         if potion_capacity_usage > threshold and total_gold >= UNIT_COST:
             potion_capacity_to_buy = 1
-            print("Potion capacity exceeds 80%, planning to buy 1 more capacity unit.")
+            logger.info("Potion capacity exceeds 80%%, planning to buy 1 more capacity unit.")
 
         if ml_capacity_usage > threshold and total_gold >= UNIT_COST:
             ml_capacity_to_buy = 1
-            print("ML capacity exceeds 80%, planning to buy 1 more capacity unit.")
+            logger.info("ML capacity exceeds 80%%, planning to buy 1 more capacity unit.")
 
         response = {
             "potion_capacity": potion_capacity_to_buy,
             "ml_capacity": ml_capacity_to_buy
         }
 
-    print(f"Capacity plan response: {response}")
+    logger.debug("Capacity plan response", extra={"payload": response})
     return response
 
 
 @router.post("/deliver")
-def deliver_capacity_plan(capacity_purchase: CapacityPurchase):
+@router.post("/deliver/{order_id}")
+@db.endpoint
+def deliver_capacity_plan(capacity_purchase: CapacityPurchase, order_id: Optional[int] = None):
     """
     Deduct gold for the purchased capacity. Each additional capacity unit costs 1000 gold.
+    A retried delivery returns the first response instead of buying the
+    capacity again. Without an order_id the delivery is keyed by its body, and
+    only a retry within deliveries.UNKEYED_REPLAY_SECONDS counts as one.
     """
     potion_capacity = capacity_purchase.potion_capacity
     ml_capacity = capacity_purchase.ml_capacity
@@ -180,22 +174,29 @@ def deliver_capacity_plan(capacity_purchase: CapacityPurchase):
     total_units = potion_capacity + ml_capacity
     total_cost = total_units * 1000
 
-    print(f"Delivering capacity plan.")
-    print(f"Potion capacity to add: {potion_capacity}, ML capacity to add: {ml_capacity}")
-    print(f"Total capacity units: {total_units}, Total cost: {total_cost}")
+    logger.info("Delivering capacity plan.")
+    logger.info("Potion capacity to add: %s, ML capacity to add: %s", potion_capacity, ml_capacity)
+    logger.info("Total capacity units: %s, Total cost: %s", total_units, total_cost)
+
+    if order_id is not None:
+        endpoint, delivery_id, replay_seconds = "inventory", order_id, None
+    else:
+        endpoint, delivery_id = "inventory/unkeyed", deliveries.body_order_id(capacity_purchase.dict())
+        replay_seconds = deliveries.UNKEYED_REPLAY_SECONDS
 
     try:
-        with db.engine.begin() as connection:
-            gold_result = connection.execute(sqlalchemy.text("""
-                SELECT COALESCE(SUM(change), 0) as gold_total FROM gold_ledger_entries
-                FOR UPDATE
-            """)).fetchone()
-            total_gold = gold_result.gold_total or 0
+        with db.begin() as connection:
+            replayed = deliveries.claim(connection, endpoint, delivery_id, replay_seconds)
+            if replayed is not None:
+                logger.info("Capacity order %s was already delivered.", order_id or "without an order id")
+                return replayed
 
-            print(f"Total gold before deduction: {total_gold}")
+            total_gold = balances.get_gold(connection, for_update=True)
+
+            logger.info("Total gold before deduction: %s", total_gold)
 
             if total_gold < total_cost:
-                print("Not enough gold to purchase capacity.")
+                logger.warning("Not enough gold to purchase capacity.")
                 raise Exception("Insufficient gold to complete the purchase.")
 
             transaction_result = connection.execute(sqlalchemy.text("""
@@ -212,7 +213,7 @@ def deliver_capacity_plan(capacity_purchase: CapacityPurchase):
                 "description": "Capacity purchase"
             })
 
-            print(f"Deducted {total_cost} gold for capacity purchase.")
+            logger.info("Deducted %s gold for capacity purchase.", total_cost)
 
             connection.execute(sqlalchemy.text("""
                 INSERT INTO capacity_purchases (transaction_id, potion_capacity, ml_capacity)
@@ -223,10 +224,13 @@ def deliver_capacity_plan(capacity_purchase: CapacityPurchase):
                 "ml_capacity": ml_capacity
             })
 
-            print(f"Recorded capacity purchase: Potion capacity {potion_capacity}, ML capacity {ml_capacity}")
+            logger.info("Recorded capacity purchase: Potion capacity %s, ML capacity %s", potion_capacity, ml_capacity)
+
+            response = {"status": "success", "message": "Capacity purchase delivered successfully."}
+            deliveries.record(connection, endpoint, delivery_id, response)
 
-        return {"status": "success", "message": "Capacity purchase delivered successfully."}
+        return response
 
     except Exception as e:
-        print(f"Error during capacity purchase delivery: {e}")
+        logger.exception("Error during capacity purchase delivery: %s", e)
         raise Exception("An error occurred while processing the capacity purchase.")
\ No newline at end of file
@@ -0,0 +1,19 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from src.api import auth
+from src import database as db
+from src import metrics
+
+router = APIRouter(
+    tags=["metrics"],
+    dependencies=[Depends(auth.get_api_key)],
+)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """
+    Request latency histograms, in-flight requests, status codes and
+    connection pool stats in the Prometheus text format.
+    """
+    return PlainTextResponse(metrics.render(db.pool_status()), media_type="text/plain; version=0.0.4")
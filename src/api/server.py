@@ -1,12 +1,17 @@
 from fastapi import FastAPI, exceptions
 from fastapi.responses import JSONResponse
 from pydantic import ValidationError
-from src.api import carts, catalog, bottler, barrels, admin, info, inventory
+from src.api import carts, catalog, bottler, barrels, admin, info, inventory, metrics
+from src.metrics import MetricsMiddleware
+from src import logs
+from src import solver_pool
 import json
 import logging
 import sys
 from starlette.middleware.cors import CORSMiddleware
 
+logs.configure()
+
 description = """
 Central Coast Cauldrons is the premier ecommerce site for all your alchemical desires.
 """
@@ -39,6 +44,14 @@ app.include_router(bottler.router)
 app.include_router(barrels.router)
 app.include_router(admin.router)
 app.include_router(info.router)
+app.include_router(metrics.router)
+
+# Added last so it wraps everything else, including CORS preflights.
+app.add_middleware(MetricsMiddleware, routes=app.routes)
+
+@app.on_event("startup")
+def start_solver_pool():
+    solver_pool.start()
 
 @app.exception_handler(exceptions.RequestValidationError)
 @app.exception_handler(ValidationError)
@@ -0,0 +1,422 @@
+import hashlib
+import os
+import logging
+from contextlib import contextmanager
+import sqlalchemy
+from src import database as db
+
+logger = logging.getLogger(__name__)
+
+# The gold_balance, ml_balance and potion_balances tables are running totals
+# kept up to date by triggers on the ledger tables (see schema.sql), so every
+# ledger insert updates them in the same transaction. balance_checkpoints
+# records those totals together with the last ledger ids they cover, which
+# lets a consistency check sum only the ledger tail since the last checkpoint.
+#
+# Checkpoints and checks only read, so they run in a REPEATABLE READ snapshot
+# (see snapshot()) while writers carry on. A repair corrects drifted totals
+# without stopping writers either: every ledger write moves a running total
+# and its ledger together, so the difference between the two seen in a
+# snapshot still holds after it and can be added on. Only rebuild(), for an
+# admin reset, blocks ledger writes.
+
+CHECKPOINT_RETENTION = 84  # one week of ticks
+
+ML_COLORS = ["red", "green", "blue", "dark"]
+
+# Rebuilds, repairs and checks scan whole ledgers, so their transactions get a longer
+# statement_timeout than the pool default.
+STATEMENT_TIMEOUT_MS = int(os.environ.get("BALANCES_STATEMENT_TIMEOUT_MS", "60000"))
+# How long snapshot() waits for in-flight ledger writers before trying again.
+# Writers queue behind the waiting barrier, so this bounds their stall, and
+# it is kept under the server's deadlock_timeout (1 s by default) so a barrier
+# caught in a lock cycle with writers gives up before Postgres has to abort one.
+SNAPSHOT_LOCK_TIMEOUT_MS = int(os.environ.get("BALANCES_SNAPSHOT_LOCK_TIMEOUT_MS", "200"))
+SNAPSHOT_ATTEMPTS = 5
+LOCK_NOT_AVAILABLE = "55P03"
+# Key of the advisory lock that runs checkpoints and repairs one at a time, so
+# two repairs never add the same correction.
+LOCK_KEY = int.from_bytes(hashlib.blake2b(b"balance_checkpoints", digest_size=8).digest(), "big", signed=True)
+
+
+def get_gold(connection, for_update=False):
+    """
+    Current gold balance. With for_update the balance row stays locked until the
+    transaction ends, serializing concurrent spenders.
+    """
+    query = "SELECT balance FROM gold_balance"
+    if for_update:
+        query += " FOR UPDATE"
+    return connection.execute(sqlalchemy.text(query)).scalar_one()
+
+
+def get_ml(connection, for_update=False):
+    """
+    Current ml balance per color, keyed by red/green/blue/dark. for_update locks
+    the balance row like get_gold does.
+    """
+    query = "SELECT red_ml, green_ml, blue_ml, dark_ml FROM ml_balance"
+    if for_update:
+        query += " FOR UPDATE"
+    row = connection.execute(sqlalchemy.text(query)).one()
+    return {
+        "red": row.red_ml,
+        "green": row.green_ml,
+        "blue": row.blue_ml,
+        "dark": row.dark_ml
+    }
+
+
+def get_potion_inventory(connection):
+    """
+    Current potion counts keyed by potion_catalog_id.
+    """
+    rows = connection.execute(sqlalchemy.text("""
+        SELECT potion_catalog_id, quantity FROM potion_balances
+    """)).fetchall()
+    return {row.potion_catalog_id: row.quantity for row in rows}
+
+
+def lock_ledgers(connection, mode="SHARE"):
+    """
+    Lock the ledger tables until the transaction ends, in the order writers
+    insert into them (gold, ml, potion; see src/checkout.py). SHARE mode waits
+    for in-flight writers and blocks new ones.
+    """
+    connection.execute(sqlalchemy.text(f"""
+        LOCK TABLE gold_ledger_entries, ml_ledger_entries, potion_inventory_ledger_entries
+        IN {mode} MODE
+    """))
+
+
+@contextmanager
+def snapshot():
+    """
+    A REPEATABLE READ transaction for checkpoint() and check(). Its snapshot
+    is taken while a second, momentary transaction holds the ledgers in SHARE
+    mode: ledger ids are drawn before their transaction commits, so a snapshot
+    taken next to an in-flight writer could see a later id without an earlier
+    one, and the checkpoint's MAX(id) watermarks would skip the earlier entry.
+    The SHARE lock is released as soon as the snapshot exists; the reads that
+    follow hold no locks.
+    """
+    with db.begin(statement_timeout_ms=STATEMENT_TIMEOUT_MS, isolation_level="REPEATABLE READ") as connection:
+        for attempt in range(1, SNAPSHOT_ATTEMPTS + 1):
+            try:
+                with db.begin() as barrier:
+                    barrier.execute(sqlalchemy.text(f"SET LOCAL lock_timeout = {SNAPSHOT_LOCK_TIMEOUT_MS}"))
+                    lock_ledgers(barrier)
+                    connection.execute(sqlalchemy.text("SELECT 1"))
+                break
+            except sqlalchemy.exc.OperationalError as error:
+                if getattr(error.orig, "pgcode", None) != LOCK_NOT_AVAILABLE or attempt == SNAPSHOT_ATTEMPTS:
+                    raise
+                logger.info("Ledger writers held the snapshot barrier off, retrying (attempt %s).", attempt)
+        yield connection
+
+
+def _ledger_totals(connection, since=None):
+    """
+    Sum the ledgers: the compacted summaries plus the live partitions (see
+    src/ledgers.py), or only the live entries after the ids in since.
+    """
+    totals = _summary_totals(connection) if since is None else None
+    since = since or {"gold": 0, "ml": 0, "potion": 0}
+
+    gold = connection.execute(sqlalchemy.text("""
+        SELECT COALESCE(SUM(change), 0) AS total
+        FROM gold_ledger_entries
+        WHERE id > :since
+    """), {"since": since["gold"]}).scalar_one()
+
+    ml_result = connection.execute(sqlalchemy.text("""
+        SELECT
+            COALESCE(SUM(red_ml_change), 0) AS red_ml_total,
+            COALESCE(SUM(green_ml_change), 0) AS green_ml_total,
+            COALESCE(SUM(blue_ml_change), 0) AS blue_ml_total,
+            COALESCE(SUM(dark_ml_change), 0) AS dark_ml_total
+        FROM ml_ledger_entries
+        WHERE id > :since
+    """), {"since": since["ml"]}).one()
+
+    potion_result = connection.execute(sqlalchemy.text("""
+        SELECT potion_catalog_id, SUM(change) AS total_inventory
+        FROM potion_inventory_ledger_entries
+        WHERE id > :since
+        GROUP BY potion_catalog_id
+    """), {"since": since["potion"]}).fetchall()
+
+    live = {
+        "gold": gold,
+        "ml": {
+            "red": ml_result.red_ml_total,
+            "green": ml_result.green_ml_total,
+            "blue": ml_result.blue_ml_total,
+            "dark": ml_result.dark_ml_total
+        },
+        "potions": {row.potion_catalog_id: row.total_inventory for row in potion_result}
+    }
+    if totals is None:
+        return live
+
+    totals["gold"] += live["gold"]
+    for color in ML_COLORS:
+        totals["ml"][color] += live["ml"][color]
+    for potion_id, change in live["potions"].items():
+        totals["potions"][potion_id] = totals["potions"].get(potion_id, 0) + change
+    return totals
+
+
+def _summary_totals(connection):
+    """
+    Totals of the ledger entries already compacted away.
+    """
+    gold = connection.execute(sqlalchemy.text("""
+        SELECT change FROM gold_ledger_summary
+    """)).scalar_one_or_none() or 0
+
+    ml_result = connection.execute(sqlalchemy.text("""
+        SELECT red_ml_change, green_ml_change, blue_ml_change, dark_ml_change
+        FROM ml_ledger_summary
+    """)).one_or_none()
+
+    potion_result = connection.execute(sqlalchemy.text("""
+        SELECT potion_catalog_id, change FROM potion_ledger_summaries
+    """)).fetchall()
+
+    return {
+        "gold": gold,
+        "ml": {color: getattr(ml_result, f"{color}_ml_change") if ml_result else 0 for color in ML_COLORS},
+        "potions": {row.potion_catalog_id: row.change for row in potion_result}
+    }
+
+
+def _snapshot(connection):
+    return {
+        "gold": get_gold(connection),
+        "ml": get_ml(connection),
+        "potions": get_potion_inventory(connection)
+    }
+
+
+def _mismatches(expected, actual):
+    mismatches = []
+    if expected["gold"] != actual["gold"]:
+        mismatches.append(f"gold: ledger {expected['gold']}, snapshot {actual['gold']}")
+    for color in ML_COLORS:
+        if expected["ml"][color] != actual["ml"][color]:
+            mismatches.append(f"{color}_ml: ledger {expected['ml'][color]}, snapshot {actual['ml'][color]}")
+    for potion_id in set(expected["potions"]) | set(actual["potions"]):
+        expected_quantity = expected["potions"].get(potion_id, 0)
+        actual_quantity = actual["potions"].get(potion_id, 0)
+        if expected_quantity != actual_quantity:
+            mismatches.append(f"potion {potion_id}: ledger {expected_quantity}, snapshot {actual_quantity}")
+    return mismatches
+
+
+def _write_snapshot(connection, totals):
+    connection.execute(sqlalchemy.text("""
+        UPDATE gold_balance SET balance = :gold, updated_at = CURRENT_TIMESTAMP
+    """), {"gold": totals["gold"]})
+
+    connection.execute(sqlalchemy.text("""
+        UPDATE ml_balance
+        SET red_ml = :red, green_ml = :green, blue_ml = :blue, dark_ml = :dark,
+            updated_at = CURRENT_TIMESTAMP
+    """), totals["ml"])
+
+    connection.execute(sqlalchemy.text("DELETE FROM potion_balances"))
+    if totals["potions"]:
+        connection.execute(sqlalchemy.text("""
+            INSERT INTO potion_balances (potion_catalog_id, quantity)
+            VALUES (:potion_catalog_id, :quantity)
+        """), [
+            {"potion_catalog_id": potion_id, "quantity": quantity}
+            for potion_id, quantity in totals["potions"].items()
+        ])
+
+
+def _write_checkpoint(connection):
+    checkpoint_id = connection.execute(sqlalchemy.text("""
+        INSERT INTO balance_checkpoints (
+            gold_entry_id, ml_entry_id, potion_entry_id,
+            gold, red_ml, green_ml, blue_ml, dark_ml
+        )
+        SELECT
+            (SELECT COALESCE(MAX(id), 0) FROM gold_ledger_entries),
+            (SELECT COALESCE(MAX(id), 0) FROM ml_ledger_entries),
+            (SELECT COALESCE(MAX(id), 0) FROM potion_inventory_ledger_entries),
+            g.balance, m.red_ml, m.green_ml, m.blue_ml, m.dark_ml
+        FROM gold_balance g
+        CROSS JOIN ml_balance m
+        RETURNING id
+    """)).scalar_one()
+
+    connection.execute(sqlalchemy.text("""
+        INSERT INTO balance_checkpoint_potions (checkpoint_id, potion_catalog_id, quantity)
+        SELECT :checkpoint_id, potion_catalog_id, quantity
+        FROM potion_balances
+        WHERE quantity <> 0
+    """), {"checkpoint_id": checkpoint_id})
+
+    connection.execute(sqlalchemy.text("""
+        DELETE FROM balance_checkpoints
+        WHERE id <= :checkpoint_id - :retention
+    """), {"checkpoint_id": checkpoint_id, "retention": CHECKPOINT_RETENTION})
+
+    return checkpoint_id
+
+
+def rebuild(connection):
+    """
+    Recompute every running balance from the raw ledgers and start a fresh
+    checkpoint history. Blocks ledger writes for the rest of the transaction,
+    so it is only for admin reset, which deletes the ledgers; run_check() and
+    take_checkpoint() repair drift on a trading shop.
+    """
+    lock_ledgers(connection)
+    _write_snapshot(connection, _ledger_totals(connection))
+    connection.execute(sqlalchemy.text("DELETE FROM balance_checkpoints"))
+    return _write_checkpoint(connection)
+
+
+def check(connection):
+    """
+    Compare the running balances against a full aggregation of the raw
+    ledgers. Takes no locks; run it in snapshot() or with the ledgers locked.
+    """
+    mismatches = _mismatches(_ledger_totals(connection), _snapshot(connection))
+    return {"consistent": not mismatches, "mismatches": mismatches}
+
+
+def checkpoint(connection):
+    """
+    Verify the running balances against the last checkpoint plus the ledger
+    tail written since (the full ledgers if there is no checkpoint yet), and
+    record a new checkpoint if they agree. Takes no locks; run it in
+    snapshot() or with the ledgers locked. checkpoint_id is None when they
+    disagree and the balances need repairing (see take_checkpoint()).
+    """
+    last = connection.execute(sqlalchemy.text("""
+        SELECT id, gold_entry_id, ml_entry_id, potion_entry_id,
+               gold, red_ml, green_ml, blue_ml, dark_ml
+        FROM balance_checkpoints
+        ORDER BY id DESC
+        LIMIT 1
+    """)).fetchone()
+
+    if last:
+        tail = _ledger_totals(connection, since={
+            "gold": last.gold_entry_id,
+            "ml": last.ml_entry_id,
+            "potion": last.potion_entry_id
+        })
+
+        base_potions = connection.execute(sqlalchemy.text("""
+            SELECT potion_catalog_id, quantity
+            FROM balance_checkpoint_potions
+            WHERE checkpoint_id = :checkpoint_id
+        """), {"checkpoint_id": last.id}).fetchall()
+        expected_potions = {row.potion_catalog_id: row.quantity for row in base_potions}
+        for potion_id, change in tail["potions"].items():
+            expected_potions[potion_id] = expected_potions.get(potion_id, 0) + change
+
+        expected = {
+            "gold": last.gold + tail["gold"],
+            "ml": {color: getattr(last, f"{color}_ml") + tail["ml"][color] for color in ML_COLORS},
+            "potions": expected_potions
+        }
+    else:
+        logger.info("No balance checkpoint found, checking the balances against the full ledgers.")
+        expected = _ledger_totals(connection)
+    mismatches = _mismatches(expected, _snapshot(connection))
+
+    if mismatches:
+        logger.warning("Balance snapshot drifted from the ledgers: %s", mismatches)
+        return {"checkpoint_id": None, "consistent": False, "mismatches": mismatches}
+
+    return {"checkpoint_id": _write_checkpoint(connection), "consistent": True, "mismatches": []}
+
+
+@contextmanager
+def _one_at_a_time():
+    with db.begin() as guard:
+        guard.execute(sqlalchemy.text("SELECT pg_advisory_xact_lock(:key)"), {"key": LOCK_KEY})
+        yield
+
+
+def _repair():
+    """
+    Bring the running balances back in line with the ledgers while writers
+    carry on: take the difference between them in a snapshot() and add it to
+    the balances. Clears the checkpoint history, since the checkpoints hold the
+    drifted values; the next checkpoint() checks the full ledgers. Returns the
+    mismatches corrected.
+    """
+    with snapshot() as connection:
+        expected = _ledger_totals(connection)
+        actual = _snapshot(connection)
+    mismatches = _mismatches(expected, actual)
+    potion_changes = sorted(
+        (potion_id, expected["potions"].get(potion_id, 0) - actual["potions"].get(potion_id, 0))
+        for potion_id in set(expected["potions"]) | set(actual["potions"])
+    )
+
+    # Balance rows in the order writers lock them (see src/checkout.py).
+    with db.begin() as connection:
+        connection.execute(sqlalchemy.text("""
+            UPDATE ml_balance
+            SET red_ml = red_ml + :red, green_ml = green_ml + :green,
+                blue_ml = blue_ml + :blue, dark_ml = dark_ml + :dark,
+                updated_at = CURRENT_TIMESTAMP
+        """), {color: expected["ml"][color] - actual["ml"][color] for color in ML_COLORS})
+        connection.execute(sqlalchemy.text("""
+            INSERT INTO potion_balances (potion_catalog_id, quantity)
+            SELECT potion_catalog_id, change
+            FROM unnest(CAST(:potion_catalog_ids AS INT[]), CAST(:changes AS INT[]))
+                AS changes(potion_catalog_id, change)
+            WHERE change <> 0
+            ORDER BY potion_catalog_id
+            ON CONFLICT (potion_catalog_id) DO UPDATE
+            SET quantity = potion_balances.quantity + EXCLUDED.quantity
+        """), {
+            "potion_catalog_ids": [potion_id for potion_id, _ in potion_changes],
+            "changes": [change for _, change in potion_changes]
+        })
+        connection.execute(sqlalchemy.text("""
+            UPDATE gold_balance SET balance = balance + :gold, updated_at = CURRENT_TIMESTAMP
+        """), {"gold": expected["gold"] - actual["gold"]})
+        connection.execute(sqlalchemy.text("DELETE FROM balance_checkpoints"))
+
+    if mismatches:
+        logger.warning("Repaired balances that drifted from the ledgers: %s", mismatches)
+    return mismatches
+
+
+def take_checkpoint():
+    """
+    checkpoint() in its own snapshot. If the balances disagree with the
+    ledgers, repair them and checkpoint again.
+    """
+    with _one_at_a_time():
+        with snapshot() as connection:
+            result = checkpoint(connection)
+        if result["checkpoint_id"] is None:
+            _repair()
+            with snapshot() as connection:
+                result["checkpoint_id"] = checkpoint(connection)["checkpoint_id"]
+    return result
+
+
+def run_check(repair=False):
+    """
+    check() in its own snapshot, bringing the balances back in line with the
+    ledgers when repair is set and they disagree.
+    """
+    with _one_at_a_time():
+        with snapshot() as connection:
+            result = check(connection)
+        repaired = bool(result["mismatches"] and repair)
+        if repaired:
+            _repair()
+    return dict(result, repaired=repaired)
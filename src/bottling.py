@@ -0,0 +1,399 @@
+import logging
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# Bottling plan solvers. Each recipe gets an integer quantity, bounded by the
+# per-potion cap and by free potion capacity, so that the plan fits the shop's
+# capacity and ml per color. The plan maximizes
+#     PROFIT_WEIGHT * sum(price * quantity) + VARIETY_WEIGHT * (recipes bottled)
+#
+# "native" (the default) solves this in-process: a greedy plan seeds a
+# depth-first branch and bound that stops after BOTTLING_TIME_BUDGET_MS and
+# returns the best plan found so far. "pulp" builds the same model as a
+# mixed-integer program for CBC. The native solver also falls back to pulp if
+# it fails. "greedy" is only the seed plan, for when there is no time to solve.
+BOTTLING_SOLVER = os.environ.get("BOTTLING_SOLVER", "native").lower()
+BOTTLING_TIME_BUDGET_MS = float(os.environ.get("BOTTLING_TIME_BUDGET_MS", "200"))
+
+MAX_PER_POTION = 50
+PROFIT_WEIGHT = 0.8
+VARIETY_WEIGHT = 0.2
+ML_COLORS = ["red", "green", "blue", "dark"]
+
+# With weights 0.8 and 0.2 the objective times 5 is the integer
+# 4 * profit + variety, so the native solver compares plans exactly.
+_PROFIT_SCORE = 4
+_VARIETY_SCORE = 1
+_SCORE_SCALE = 5
+
+
+class Recipe(NamedTuple):
+    """
+    The potion_catalog fields the solvers read, as a plain tuple, so a solve's
+    arguments pickle into a solver pool worker.
+    """
+    id: int
+    price: int
+    red_component: int
+    green_component: int
+    blue_component: int
+    dark_component: int
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row.id, row.price, row.red_component, row.green_component, row.blue_component, row.dark_component)
+
+
+@dataclass(frozen=True)
+class Candidate:
+    recipe: object
+    components: tuple
+    upper_bound: int
+
+
+@dataclass(frozen=True)
+class Solution:
+    quantities: Dict[int, int]
+    objective: float
+    optimal: bool
+    solver: str
+
+
+def candidates(recipes, inventory, capacity):
+    """
+    Recipes that can be bottled at all, each with the most units the per-potion
+    cap and free capacity allow.
+    """
+    result = []
+    for recipe in recipes:
+        upper_bound = min(MAX_PER_POTION - inventory.get(recipe.id, 0), capacity)
+        if upper_bound <= 0:
+            continue
+        components = (recipe.red_component, recipe.green_component, recipe.blue_component, recipe.dark_component)
+        result.append(Candidate(recipe, components, upper_bound))
+    return result
+
+
+def objective(candidate_list, quantities):
+    profit = sum(candidate.recipe.price * quantities.get(candidate.recipe.id, 0) for candidate in candidate_list)
+    variety = sum(1 for candidate in candidate_list if quantities.get(candidate.recipe.id, 0) > 0)
+    return PROFIT_WEIGHT * profit + VARIETY_WEIGHT * variety
+
+
+def solve_pulp(candidate_list, ml, capacity):
+    """
+    Solve the bottling model with CBC through pulp.
+    """
+    # pulp is slow to import; load it on the first solve, not at app start.
+    from pulp import LpMaximize, LpProblem, LpVariable, lpSum, LpInteger, PULP_CBC_CMD, LpStatusOptimal
+
+    prob = LpProblem("Potion_Production", LpMaximize)
+
+    potion_vars = {}
+    for candidate in candidate_list:
+        potion_id = candidate.recipe.id
+        var = LpVariable(f"x_{potion_id}", lowBound=0, upBound=candidate.upper_bound, cat=LpInteger)
+        is_produced = LpVariable(f"y_{potion_id}", cat="Binary")
+        potion_vars[potion_id] = {"variable": var, "is_produced": is_produced, "candidate": candidate}
+
+    prob += (
+        PROFIT_WEIGHT * lpSum([var["candidate"].recipe.price * var["variable"] for var in potion_vars.values()]) +
+        VARIETY_WEIGHT * lpSum([var["is_produced"] for var in potion_vars.values()])
+    ), "ProfitAndVariety"
+
+    prob += lpSum([var["variable"] for var in potion_vars.values()]) <= capacity, "TotalCapacity"
+
+    for color_index, ml_type in enumerate(ML_COLORS):
+        prob += lpSum([
+            var["candidate"].components[color_index] * var["variable"]
+            for var in potion_vars.values()
+        ]) <= ml[ml_type], f"{ml_type.capitalize()}MLConstraint"
+
+    for potion_id, var in potion_vars.items():
+        prob += var["variable"] >= var["is_produced"], f"Link_{potion_id}"
+        prob += var["variable"] <= var["is_produced"] * var["candidate"].upper_bound, f"LinkMax_{potion_id}"
+
+    status = prob.solve(PULP_CBC_CMD(msg=False))
+
+    quantities = {}
+    for potion_id, var in potion_vars.items():
+        quantity = int(round(var["variable"].varValue)) if var["variable"].varValue else 0
+        if quantity > 0:
+            quantities[potion_id] = quantity
+    return Solution(quantities, objective(candidate_list, quantities), status == LpStatusOptimal, "pulp")
+
+
+_EPSILON = 1e-9
+_MAX_PIVOTS_PER_COLUMN = 50
+
+
+def _solve_lp(prices, rows, limits, lower, upper):
+    """
+    LP relaxation of the bottling model: maximize sum(price * x) subject to
+    sum(row * x) <= limits and lower <= x <= upper, by a bounded-variable
+    primal simplex. All rows are non-negative, so after shifting x by its
+    lower bounds, x = 0 is a feasible start, and the LP is infeasible exactly
+    when the lower bounds alone break a limit.
+    Returns (objective, x), or None if infeasible.
+    """
+    count, height = len(prices), len(limits)
+    rhs = [limit - sum(row[k] * low for row, low in zip(rows, lower)) for k, limit in enumerate(limits)]
+    if any(value < -_EPSILON for value in rhs):
+        return None
+
+    width = count + height
+    span = [up - low for low, up in zip(lower, upper)] + [float("inf")] * height
+    tableau = [[rows[j][k] for j in range(count)] + [1 if i == k else 0 for i in range(height)] for k in range(height)]
+    reduced = list(prices) + [0] * height
+    basis = list(range(count, width))
+    values = rhs
+    at_upper = [False] * width
+
+    in_basis = [False] * count + [True] * height
+    degenerate_steps = 0
+    for _ in range(_MAX_PIVOTS_PER_COLUMN * width):
+        # Dantzig's rule (largest improvement rate), switching to Bland's
+        # (lowest index) after degenerate pivots so the simplex cannot cycle.
+        entering, best_rate = None, _EPSILON
+        for j in range(width):
+            if in_basis[j]:
+                continue
+            rate = -reduced[j] if at_upper[j] else reduced[j]
+            if rate > best_rate:
+                entering, best_rate = j, rate
+                if degenerate_steps > height:
+                    break
+        if entering is None:
+            break
+        direction = 1 if not at_upper[entering] else -1
+
+        step, leaving, leaves_at_upper = span[entering], None, False
+        for r in range(height):
+            change = direction * tableau[r][entering]
+            if change > _EPSILON:
+                limit = values[r] / change
+                to_upper = False
+            elif change < -_EPSILON and span[basis[r]] != float("inf"):
+                limit = (span[basis[r]] - values[r]) / -change
+                to_upper = True
+            else:
+                continue
+            if limit < step - _EPSILON or (abs(limit - step) <= _EPSILON and leaving is not None and basis[r] < basis[leaving]):
+                step, leaving, leaves_at_upper = limit, r, to_upper
+
+        degenerate_steps = degenerate_steps + 1 if step <= _EPSILON else 0
+        for r in range(height):
+            values[r] -= direction * tableau[r][entering] * step
+        if leaving is None:
+            at_upper[entering] = not at_upper[entering]
+            continue
+
+        entering_value = step if direction == 1 else span[entering] - step
+        pivot_row = tableau[leaving]
+        pivot = pivot_row[entering]
+        pivot_row[:] = [value / pivot for value in pivot_row]
+        for r in range(height):
+            if r != leaving and tableau[r][entering] != 0:
+                factor = tableau[r][entering]
+                tableau[r] = [value - factor * pivot_value for value, pivot_value in zip(tableau[r], pivot_row)]
+        factor = reduced[entering]
+        reduced = [value - factor * pivot_value for value, pivot_value in zip(reduced, pivot_row)]
+        at_upper[basis[leaving]] = leaves_at_upper
+        in_basis[basis[leaving]] = False
+        at_upper[entering] = False
+        in_basis[entering] = True
+        basis[leaving] = entering
+        values[leaving] = entering_value
+    else:
+        raise RuntimeError("Bottling LP did not converge.")
+
+    x = [lower[j] + (span[j] if at_upper[j] else 0) for j in range(count)]
+    for r, j in enumerate(basis):
+        if j < count:
+            x[j] = lower[j] + values[r]
+    return sum(price * value for price, value in zip(prices, x)), x
+
+
+def solve_greedy(candidate_list, ml, capacity):
+    """
+    A quick feasible plan: one unit of each recipe that fits, most valuable
+    first, then as many more as fit in the same order. Not optimal.
+    """
+    ml_left = dict(ml)
+    capacity_left = capacity
+    quantities = {}
+    by_price = sorted(candidate_list, key=lambda candidate: -candidate.recipe.price)
+    for first_pass in (True, False):
+        for candidate in by_price:
+            have = quantities.get(candidate.recipe.id, 0)
+            if first_pass and have:
+                continue
+            take = min(
+                candidate.upper_bound - have, capacity_left,
+                *(ml_left[color] // need for color, need in zip(ML_COLORS, candidate.components) if need > 0)
+            )
+            if first_pass:
+                take = min(take, 1)
+            if take <= 0:
+                continue
+            quantities[candidate.recipe.id] = have + take
+            capacity_left -= take
+            for color, need in zip(ML_COLORS, candidate.components):
+                ml_left[color] -= need * take
+    return Solution(quantities, objective(candidate_list, quantities), False, "greedy")
+
+
+def solve_native(candidate_list, ml, capacity, time_budget_ms=None):
+    """
+    Solve the bottling model in-process with LP-based branch and bound.
+    Returns the optimum, or the best plan found when the time budget runs out
+    (optimal=False).
+    """
+    budget = (BOTTLING_TIME_BUDGET_MS if time_budget_ms is None else time_budget_ms) / 1000
+    deadline = time.perf_counter() + budget
+
+    ids = [candidate.recipe.id for candidate in candidate_list]
+    prices = [candidate.recipe.price for candidate in candidate_list]
+    rows = [(1,) + tuple(candidate.components) for candidate in candidate_list]
+    count = len(ids)
+    # Constraint rows: units of capacity, then ml of each color. Only whole
+    # multiples of a color's component gcd can be used, so rounding the ml
+    # down to one tightens the LP without cutting off any plan.
+    limits = [capacity]
+    for color_index, color in enumerate(ML_COLORS):
+        step = 0
+        for row in rows:
+            step = math.gcd(step, row[color_index + 1])
+        limits.append(ml[color] - ml[color] % step if step else ml[color])
+
+    def fits(j, limits_left, cap):
+        return min(cap, *(limit // weight for limit, weight in zip(limits_left, rows[j]) if weight > 0))
+
+    def score(quantities):
+        return sum(
+            _PROFIT_SCORE * price * quantity + (_VARIETY_SCORE if quantity > 0 else 0)
+            for price, quantity in zip(prices, quantities)
+        )
+
+    def complete(quantities, upper):
+        # Round an LP point down, then top it up greedily, most valuable first,
+        # adding one unit of each unused recipe before filling for profit.
+        quantities = [int(quantity + _EPSILON) for quantity in quantities]
+        limits_left = [limit - sum(row[k] * q for row, q in zip(rows, quantities)) for k, limit in enumerate(limits)]
+        by_price = sorted(range(count), key=lambda j: -prices[j])
+        for j in by_price:
+            if quantities[j] == 0 and fits(j, limits_left, upper[j]) >= 1:
+                quantities[j] = 1
+                limits_left = [limit - weight for limit, weight in zip(limits_left, rows[j])]
+        for j in by_price:
+            take = fits(j, limits_left, upper[j] - quantities[j])
+            if take > 0:
+                quantities[j] += take
+                limits_left = [limit - weight * take for limit, weight in zip(limits_left, rows[j])]
+        return quantities
+
+    # The LP works on scores. Each recipe is split into its first unit, which
+    # also earns the variety point, and the rest; the first unit is worth more
+    # for the same ml, so the LP always fills it first and its optimum bounds
+    # the best score.
+    column_scores = [_PROFIT_SCORE * price + _VARIETY_SCORE for price in prices] + \
+        [_PROFIT_SCORE * price for price in prices]
+    column_rows = rows + rows
+
+    def relax(lower, upper):
+        solved = _solve_lp(
+            column_scores, column_rows, limits,
+            [min(low, 1) for low in lower] + [max(low - 1, 0) for low in lower],
+            [min(up, 1) for up in upper] + [max(up - 1, 0) for up in upper]
+        )
+        if solved is None:
+            return None
+        bound, x = solved
+        return bound, [first + rest for first, rest in zip(x[:count], x[count:])]
+
+    initial_upper = [candidate.upper_bound for candidate in candidate_list]
+    best_plan = complete([0] * count, initial_upper)
+    best_score = score(best_plan)
+    nodes = 0
+    timed_out = False
+
+    stack = [([0] * count, initial_upper)]
+    while stack:
+        nodes += 1
+        if time.perf_counter() > deadline:
+            timed_out = True
+            break
+        lower, upper = stack.pop()
+        solved = relax(lower, upper)
+        # Scores are integers, so a node must be able to gain at least one.
+        if solved is None or solved[0] < best_score + 1 - 1e-6:
+            continue
+        bound, x = solved
+
+        candidate_plan = complete(x, upper)
+        if score(candidate_plan) > best_score:
+            best_plan, best_score = candidate_plan, score(candidate_plan)
+
+        fractional = next((j for j in range(count) if abs(x[j] - round(x[j])) > 1e-6), None)
+        if fractional is None:
+            continue
+        split = int(x[fractional])
+        down_upper = list(upper)
+        down_upper[fractional] = split
+        up_lower = list(lower)
+        up_lower[fractional] = split + 1
+        stack.append((lower, down_upper))
+        stack.append((up_lower, upper))
+
+    quantities = {ids[j]: quantity for j, quantity in enumerate(best_plan) if quantity > 0}
+    if timed_out:
+        logger.warning("Native bottling solver hit its %.0f ms budget after %s nodes.", budget * 1000, nodes)
+    return Solution(quantities, best_score / _SCORE_SCALE, not timed_out, "native")
+
+
+def solve(recipes, ml, inventory, capacity, solver=None):
+    """
+    The bottling plan for the shop state, as the bottler plan response (one
+    {"potion_type", "quantity"} entry per recipe to bottle), and whether the
+    solver proved it optimal.
+    """
+    solver = solver or BOTTLING_SOLVER
+    candidate_list = candidates(recipes, inventory, capacity)
+    if not candidate_list:
+        logger.info("No potions can be produced within capacity constraints.")
+        return [], True
+
+    solution = None
+    if solver == "greedy":
+        solution = solve_greedy(candidate_list, ml, capacity)
+    if solver == "native":
+        try:
+            solution = solve_native(candidate_list, ml, capacity)
+        except Exception:
+            logger.exception("Native bottling solver failed, falling back to pulp.")
+    if solution is None:
+        solution = solve_pulp(candidate_list, ml, capacity)
+    logger.info("Bottling plan from %s solver: objective %.1f, optimal %s.",
+                solution.solver, solution.objective, solution.optimal)
+
+    production_plan = [
+        {
+            "potion_type": list(candidate.components),
+            "quantity": solution.quantities[candidate.recipe.id]
+        }
+        for candidate in candidate_list
+        if solution.quantities.get(candidate.recipe.id, 0) > 0
+    ]
+    return production_plan, solution.optimal
+
+
+def plan(recipes, ml, inventory, capacity, solver=None):
+    """
+    The bottling plan for the shop state, as the bottler plan response.
+    """
+    return solve(recipes, ml, inventory, capacity, solver)[0]
@@ -0,0 +1,57 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# In-process cache of the final GET /catalog/ response. Anything that writes to
+# the potion ledger runs inside invalidating(), which clears the cache once the
+# write has committed. Every read records the generation it started under and a
+# result is only stored if no invalidation happened in between, so a read that
+# raced a write can never repopulate the cache with stale inventory.
+#
+# The cache is per process: writes committed by another worker (or straight to
+# the database) are only picked up once an entry is older than the TTL.
+CATALOG_CACHE_TTL = float(os.environ.get("CATALOG_CACHE_TTL", "60"))
+
+_lock = threading.Lock()
+_generation = 0
+_catalog = None
+_stored_at = 0.0
+
+
+def get():
+    """
+    Return (catalog, generation). catalog is None when nothing fresh is cached;
+    pass the generation back to store().
+    """
+    with _lock:
+        if _catalog is not None and time.monotonic() - _stored_at < CATALOG_CACHE_TTL:
+            return _catalog, _generation
+        return None, _generation
+
+
+def store(catalog, generation):
+    global _catalog, _stored_at
+    with _lock:
+        if generation == _generation:
+            _catalog = catalog
+            _stored_at = time.monotonic()
+
+
+def invalidate():
+    global _catalog, _generation
+    with _lock:
+        _generation += 1
+        _catalog = None
+
+
+@contextmanager
+def invalidating():
+    """
+    Wrap around a transaction that writes potion ledger entries. Listed before
+    db.begin() in the same with statement, it exits after the commit.
+    """
+    try:
+        yield
+    finally:
+        invalidate()
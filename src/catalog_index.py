@@ -0,0 +1,204 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Mapping, Tuple
+import logging
+import sqlalchemy
+
+logger = logging.getLogger(__name__)
+
+# Process-wide, read-only index of potion_catalog: SKU -> id, id -> row and
+# potion type -> id. Routers resolve catalog rows through it instead of querying
+# potion_catalog on every request.
+#
+# The index is replaced wholesale, never mutated, and every load gets a new
+# version number. It is reloaded when it is older than CATALOG_INDEX_TTL,
+# after invalidate(), or when a lookup misses. Reloads caused by misses are
+# limited to one per CATALOG_INDEX_MISS_INTERVAL, so requests for unknown SKUs
+# cannot turn into a query per request.
+#
+# Code that writes potion_catalog runs inside invalidating(), which drops the
+# index once the write has committed; a load that raced the write is handed
+# to its caller but not kept. Edits made straight in the database show up
+# within CATALOG_INDEX_TTL, the same bound as the /catalog/ response cache
+# (see catalog_cache). Checkout reads prices from potion_catalog itself. At most
+# CATALOG_INDEX_MAX_POTIONS potions (lowest ids first) are indexed. A catalog
+# larger than that loads an incomplete index, and lookups it cannot answer go
+# to potion_catalog directly.
+CATALOG_INDEX_TTL = float(os.environ.get("CATALOG_INDEX_TTL", "60"))
+CATALOG_INDEX_MISS_INTERVAL = float(os.environ.get("CATALOG_INDEX_MISS_INTERVAL", "1"))
+CATALOG_INDEX_MAX_POTIONS = int(os.environ.get("CATALOG_INDEX_MAX_POTIONS", "10000"))
+
+_COLUMNS = "id, sku, name, price, red_component, green_component, blue_component, dark_component"
+
+
+@dataclass(frozen=True)
+class CatalogIndex:
+    version: int
+    loaded_at: float
+    by_id: Mapping[int, Any]
+    by_sku: Mapping[str, int]
+    by_potion_type: Mapping[Tuple[int, int, int, int], int]
+    complete: bool = True
+
+    def row_for_sku(self, sku):
+        potion_id = self.by_sku.get(sku)
+        return self.by_id[potion_id] if potion_id is not None else None
+
+    def row_for_potion_type(self, potion_type):
+        potion_id = self.by_potion_type.get(tuple(potion_type))
+        return self.by_id[potion_id] if potion_id is not None else None
+
+
+# Guards only the swap of _index, never a query: under DATABASE_ASYNC a query
+# yields to the event loop, and a request waiting on a held threading lock
+# would block the loop itself.
+_lock = threading.Lock()
+_index = None
+_version = 0
+_invalidations = 0
+
+
+def _load(connection, stale):
+    global _index, _version
+    invalidations = _invalidations
+    rows = connection.execute(sqlalchemy.text(f"""
+        SELECT {_COLUMNS}
+        FROM potion_catalog
+        ORDER BY id
+        LIMIT :limit
+    """), {"limit": CATALOG_INDEX_MAX_POTIONS + 1}).fetchall()
+    complete = len(rows) <= CATALOG_INDEX_MAX_POTIONS
+    if not complete:
+        rows = rows[:CATALOG_INDEX_MAX_POTIONS]
+        logger.warning(
+            "potion_catalog has more than %s potions; the rest are looked up in the database.",
+            CATALOG_INDEX_MAX_POTIONS
+        )
+    with _lock:
+        if _index is not stale and _index is not None:
+            return _index
+        _version += 1
+        index = CatalogIndex(
+            version=_version,
+            loaded_at=time.monotonic(),
+            by_id=MappingProxyType({row.id: row for row in rows}),
+            by_sku=MappingProxyType({row.sku: row.id for row in rows}),
+            by_potion_type=MappingProxyType({
+                (row.red_component, row.green_component, row.blue_component, row.dark_component): row.id
+                for row in rows
+            }),
+            complete=complete
+        )
+        if invalidations != _invalidations:
+            # potion_catalog changed while these rows were read.
+            return index
+        _index = index
+    logger.info("Loaded catalog index version %s with %s potions.", index.version, len(rows))
+    return index
+
+
+def current(connection):
+    """
+    The current CatalogIndex, loading it with connection if it is missing or stale.
+    """
+    index = _index
+    if index is None or time.monotonic() - index.loaded_at >= CATALOG_INDEX_TTL:
+        return _load(connection, index)
+    return index
+
+
+def _reload_after_miss(connection, index):
+    latest = _index
+    if latest is not index:
+        return latest if latest is not None else _load(connection, None)
+    if time.monotonic() - index.loaded_at < CATALOG_INDEX_MISS_INTERVAL:
+        return index
+    return _load(connection, index)
+
+
+def invalidate():
+    """
+    Drop the index; call after changing potion_catalog.
+    """
+    global _index, _invalidations
+    with _lock:
+        _invalidations += 1
+        _index = None
+
+
+@contextmanager
+def invalidating():
+    """
+    Wrap around a transaction that writes potion_catalog. Listed before
+    db.begin() in the same with statement, it exits after the commit.
+    """
+    try:
+        yield
+    finally:
+        invalidate()
+
+
+def row_for_sku(connection, sku):
+    """
+    The potion_catalog row for sku, or None if the catalog has no such SKU.
+    """
+    index = current(connection)
+    row = index.row_for_sku(sku)
+    if row is None and not index.complete:
+        return connection.execute(sqlalchemy.text(f"""
+            SELECT {_COLUMNS} FROM potion_catalog WHERE sku = :sku
+        """), {"sku": sku}).first()
+    if row is None:
+        row = _reload_after_miss(connection, index).row_for_sku(sku)
+    return row
+
+
+def rows_for_ids(connection, potion_ids):
+    """
+    Map each potion_catalog id to its row, leaving out ids the catalog lacks.
+    """
+    index = current(connection)
+    rows = {potion_id: index.by_id[potion_id] for potion_id in potion_ids if potion_id in index.by_id}
+    missing = [potion_id for potion_id in potion_ids if potion_id not in rows]
+    if missing and not index.complete:
+        rows.update((row.id, row) for row in connection.execute(sqlalchemy.text(f"""
+            SELECT {_COLUMNS} FROM potion_catalog WHERE id = ANY(:potion_ids)
+        """), {"potion_ids": missing}))
+    return rows
+
+
+def resolve_potion_types(connection, potion_types):
+    """
+    Map each potion type to its potion_catalog row, or None if no recipe makes it.
+    """
+    keys = [tuple(potion_type) for potion_type in potion_types]
+    index = current(connection)
+    if index.complete and any(key not in index.by_potion_type for key in keys):
+        index = _reload_after_miss(connection, index)
+    rows = {key: index.row_for_potion_type(key) for key in keys}
+    missing = [key for key, row in rows.items() if row is None]
+    if missing and not index.complete:
+        found = connection.execute(sqlalchemy.text(f"""
+            SELECT {_COLUMNS}
+            FROM potion_catalog
+            WHERE (red_component, green_component, blue_component, dark_component) IN (
+                SELECT * FROM unnest(
+                    CAST(:reds AS INT[]), CAST(:greens AS INT[]),
+                    CAST(:blues AS INT[]), CAST(:darks AS INT[])
+                )
+            )
+        """), {
+            "reds": [key[0] for key in missing],
+            "greens": [key[1] for key in missing],
+            "blues": [key[2] for key in missing],
+            "darks": [key[3] for key in missing],
+        }).fetchall()
+        rows.update(
+            ((row.red_component, row.green_component, row.blue_component, row.dark_component), row)
+            for row in found
+        )
+    return rows
@@ -0,0 +1,100 @@
+import logging
+import sqlalchemy
+
+logger = logging.getLogger(__name__)
+
+# Checkout locks balance rows in the shop-wide order ml_balance ->
+# potion_balances (by potion_catalog_id) -> gold_balance; two checkouts of the
+# same SKU queue on its potion_balances row. Ledger entries are written in the
+# shop-wide order gold -> ml -> potion, the order src/balances.py takes the
+# ledger table locks in, so a checkout never holds the potion ledger while
+# waiting on the gold ledger behind a checkpoint or rebuild.
+
+
+def checkout_cart(connection, cart_id):
+    """
+    Check out a cart inside the caller's transaction: one query for the cart lines,
+    one that locks and reads every line's inventory and current price, then
+    set-based ledger writes. Prices are read here rather than from the shared
+    catalog index, so a price change is charged from the moment it commits.
+    Returns the checkout totals, or an error dict if the cart cannot be fulfilled.
+    """
+    cart_items = connection.execute(sqlalchemy.text("""
+        SELECT catalog_id, quantity, sku
+        FROM carts_items
+        WHERE cart_id = :cart_id
+        ORDER BY catalog_id
+        FOR UPDATE
+    """), {"cart_id": cart_id}).fetchall()
+
+    if not cart_items:
+        logger.warning("Cart %s is empty.", cart_id)
+        return {"error": "Cart is empty"}
+
+    stock = connection.execute(sqlalchemy.text("""
+        SELECT pb.potion_catalog_id, pb.quantity, pc.price
+        FROM potion_balances pb
+        JOIN potion_catalog pc ON pc.id = pb.potion_catalog_id
+        WHERE pb.potion_catalog_id = ANY(:potion_catalog_ids)
+        ORDER BY pb.potion_catalog_id
+        FOR UPDATE OF pb
+    """), {"potion_catalog_ids": [item.catalog_id for item in cart_items]}).fetchall()
+    inventory = {row.potion_catalog_id: row.quantity for row in stock}
+    prices = {row.potion_catalog_id: row.price for row in stock}
+
+    insufficient_inventory = [
+        item.sku for item in cart_items
+        if inventory.get(item.catalog_id, 0) < item.quantity
+    ]
+    if insufficient_inventory:
+        logger.warning("Insufficient inventory for SKUs: %s", insufficient_inventory)
+        return {"error": f"Insufficient inventory for potions: {', '.join(insufficient_inventory)}"}
+
+    # Only empty lines can lack a balance row once the inventory check passed.
+    total_gold_paid = sum(prices.get(item.catalog_id, 0) * item.quantity for item in cart_items)
+    total_potions_bought = sum(item.quantity for item in cart_items)
+
+    transaction_id = connection.execute(sqlalchemy.text("""
+        INSERT INTO transactions (description) VALUES (:description) RETURNING id
+    """), {"description": f"Cart checkout {cart_id}"}).scalar_one()
+
+    connection.execute(sqlalchemy.text("""
+        INSERT INTO gold_ledger_entries (transaction_id, change, description)
+        VALUES (:transaction_id, :change, :description)
+    """), {
+        "transaction_id": transaction_id,
+        "change": total_gold_paid,
+        "description": f"Revenue from cart checkout {cart_id}"
+    })
+
+    # Written from the lines checked above rather than re-read from carts_items,
+    # so an item added mid-checkout can never be sold unchecked.
+    connection.execute(sqlalchemy.text("""
+        INSERT INTO potion_inventory_ledger_entries (potion_catalog_id, transaction_id, change, description)
+        SELECT potion_catalog_id, :transaction_id, change, description
+        FROM unnest(
+            CAST(:potion_catalog_ids AS INT[]),
+            CAST(:changes AS INT[]),
+            CAST(:descriptions AS TEXT[])
+        ) WITH ORDINALITY AS entries(potion_catalog_id, change, description, position)
+        ORDER BY position
+    """), {
+        "transaction_id": transaction_id,
+        "potion_catalog_ids": [item.catalog_id for item in cart_items],
+        "changes": [-item.quantity for item in cart_items],
+        "descriptions": [
+            f"Sold {item.quantity} units of SKU {item.sku} from cart {cart_id}"
+            for item in cart_items
+        ]
+    })
+
+    connection.execute(sqlalchemy.text("""
+        UPDATE carts
+        SET status = 'checked_out', updated_at = CURRENT_TIMESTAMP
+        WHERE id = :cart_id
+    """), {"cart_id": cart_id})
+
+    return {
+        "total_gold_paid": total_gold_paid,
+        "total_potions_bought": total_potions_bought
+    }
@@ -1,14 +1,271 @@
+import asyncio
+import functools
 import os
+import threading
+import time
+from contextlib import contextmanager
 import dotenv
-from sqlalchemy import create_engine,MetaData,Table,Column,Integer,String,Text,ForeignKey,DateTime,func,Index
+from src import query_stats
+from sqlalchemy import event, exc, text
+from sqlalchemy import create_engine,MetaData,Table,Column,Integer,Text,ForeignKey,DateTime,func
+# Not part of SQLAlchemy's documented API, but the functions its own asyncio
+# extension is built on (see DATABASE_ASYNC below); requirements.txt pins
+# sqlalchemy and greenlet so they cannot change under us unnoticed.
+from sqlalchemy.util import await_only, greenlet_spawn
 
 def database_connection_url():
     dotenv.load_dotenv()
     return os.environ.get("POSTGRES_URI")
-engine = create_engine(database_connection_url(), pool_pre_ping=True)
+
+def async_database_connection_url():
+    """
+    POSTGRES_URI with its driver switched to asyncpg, unless ASYNC_POSTGRES_URI
+    is set explicitly.
+    """
+    dotenv.load_dotenv()
+    url = os.environ.get("ASYNC_POSTGRES_URI")
+    if url:
+        return url
+    scheme, rest = database_connection_url().split("://", 1)
+    return f"postgresql+asyncpg://{rest}" if scheme.split("+")[0] in ("postgres", "postgresql") else f"{scheme}://{rest}"
+
+# DATABASE_ASYNC=1 serves requests from an asyncpg engine on the event loop
+# instead of psycopg2 connections pinned to threadpool workers. Handlers keep
+# their blocking-style bodies either way: under async mode @endpoint runs them
+# in a greenlet, where every db.engine call awaits the async driver underneath.
+#
+# This is how SQLAlchemy's AsyncConnection works internally: it calls the sync
+# Connection through greenlet_spawn, and the asyncpg dialect awaits each
+# driver call with await_only. @endpoint only moves greenlet_spawn out to the
+# whole handler, so one copy of every handler serves both modes instead of an
+# await-style duplicate per route. Outside a greenlet_spawn (a handler missing
+# @endpoint, or a thread) await_only raises MissingGreenlet rather than
+# blocking the loop. test/test_async_mode.py serves requests in both modes.
+DATABASE_ASYNC = os.environ.get("DATABASE_ASYNC", "").lower() in ("1", "true", "yes")
+
+# Pool sizing. Every uvicorn worker has its own pool, so the database sees up
+# to workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections. Pre-ping costs a
+# round trip per checkout and is off by default; DB_POOL_RECYCLE retires
+# connections before the server or a proxy drops them as idle.
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "").lower() in ("1", "true", "yes")
+# Default statement_timeout for every pooled connection; 0 disables it. A
+# transaction can raise or lower it with begin(statement_timeout_ms=...).
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", "5000"))
+
+pool_options = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+}
+
+# The engine is created on first use of db.engine rather than at import, so
+# importing the app never touches the database.
+_engine_lock = threading.Lock()
+_engine = None
+_async_engine = None
+
+
+def _create_engines():
+    global _engine, _async_engine
+    with _engine_lock:
+        if _engine is not None:
+            return
+        if DATABASE_ASYNC:
+            from sqlalchemy.ext.asyncio import create_async_engine
+            _async_engine = create_async_engine(async_database_connection_url(), **pool_options)
+            sync_engine = _async_engine.sync_engine
+        else:
+            sync_engine = create_engine(database_connection_url(), **pool_options)
+        event.listen(sync_engine, "connect", _set_default_statement_timeout)
+        query_stats.install(sync_engine)
+        _engine = sync_engine
+
+
+def get_engine():
+    """
+    The blocking-style engine handlers use; under DATABASE_ASYNC this is the
+    async engine's sync facade.
+    """
+    if _engine is None:
+        _create_engines()
+    return _engine
+
+
+def __getattr__(name):
+    if name == "engine":
+        return get_engine()
+    if name == "async_engine":
+        get_engine()
+        return _async_engine
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _set_default_statement_timeout(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"SET statement_timeout = {DB_STATEMENT_TIMEOUT_MS}")
+    cursor.close()
+    # asyncpg starts a transaction for the SET; end it so the session value sticks.
+    dbapi_connection.commit()
+
+
+# Declared to match schema.sql instead of reflected, so no query runs at import.
 metadata = MetaData()
 
-customer_info = Table('customer_info', metadata, autoload_with=engine)
-potion_catalog = Table('potion_catalog', metadata, autoload_with=engine)
-carts = Table('carts', metadata, autoload_with=engine)
-carts_items = Table('carts_items', metadata, autoload_with=engine)
\ No newline at end of file
+customer_info = Table(
+    'customer_info', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('created_at', DateTime, server_default=func.now()),
+    Column('customer_name', Text, nullable=False, unique=True),
+    Column('customer_class', Text, nullable=False),
+    Column('level', Integer, nullable=False),
+)
+
+potion_catalog = Table(
+    'potion_catalog', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', Text, nullable=False, unique=True),
+    Column('red_component', Integer),
+    Column('green_component', Integer),
+    Column('blue_component', Integer),
+    Column('dark_component', Integer),
+    Column('price', Integer, nullable=False),
+    Column('quantity', Integer, nullable=False),
+    Column('sku', Text, nullable=False, unique=True),
+    Column('inventory', Integer, nullable=False),
+    Column('created_at', DateTime, server_default=func.now()),
+)
+
+carts = Table(
+    'carts', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('customer_id', Integer, ForeignKey('customer_info.id'), nullable=False),
+    Column('created_at', DateTime, server_default=func.now()),
+    Column('updated_at', DateTime, server_default=func.now()),
+    Column('status', Text, server_default='active'),
+)
+
+carts_items = Table(
+    'carts_items', metadata,
+    Column('cart_id', Integer, ForeignKey('carts.id', ondelete='CASCADE'), primary_key=True),
+    Column('catalog_id', Integer, ForeignKey('potion_catalog.id'), primary_key=True),
+    Column('quantity', Integer, nullable=False),
+    Column('sku', Text, nullable=False),
+    Column('created_at', DateTime, server_default=func.now()),
+)
+
+
+def endpoint(handler):
+    """
+    Route decorator: under DATABASE_ASYNC, turn a blocking handler into an
+    async def one that runs in a greenlet on the event loop. Sync mode returns
+    the handler unchanged, so FastAPI keeps running it in the threadpool.
+    """
+    if not DATABASE_ASYNC:
+        return handler
+
+    @functools.wraps(handler)
+    async def run_on_event_loop(*args, **kwargs):
+        return await greenlet_spawn(handler, *args, **kwargs)
+
+    return run_on_event_loop
+
+
+def stream(chunks):
+    """
+    Wrap a generator that reads from db.engine for a StreamingResponse. Under
+    DATABASE_ASYNC each chunk is produced in a greenlet, and the generator is
+    closed there too if the client goes away early.
+    """
+    if not DATABASE_ASYNC:
+        return chunks
+
+    async def pull():
+        exhausted = object()
+        try:
+            while True:
+                chunk = await greenlet_spawn(next, chunks, exhausted)
+                if chunk is exhausted:
+                    return
+                yield chunk
+        finally:
+            await greenlet_spawn(chunks.close)
+
+    return pull()
+
+
+def run_blocking(function, *args, **kwargs):
+    """
+    Call CPU-bound work such as an ILP solve from a handler. Under
+    DATABASE_ASYNC it runs on a worker thread so other requests keep being
+    served from the event loop meanwhile.
+    """
+    if not DATABASE_ASYNC:
+        return function(*args, **kwargs)
+    return await_only(asyncio.to_thread(function, *args, **kwargs))
+
+
+_pool_stats_lock = threading.Lock()
+_pool_stats = {"checkouts": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0, "timeouts": 0}
+
+
+@contextmanager
+def begin(statement_timeout_ms=None, isolation_level=None):
+    """
+    engine.begin() that records how long the pool took to hand out a
+    connection, optionally with a statement_timeout and an isolation level
+    (e.g. "REPEATABLE READ") for this transaction only.
+    """
+    start = time.perf_counter()
+    checked_out = False
+    try:
+        with get_engine().connect() as connection:
+            checked_out = True
+            _record_checkout(time.perf_counter() - start)
+            if isolation_level is not None:
+                # Reset to the engine default when the connection goes back to the pool.
+                connection.execution_options(isolation_level=isolation_level)
+            with connection.begin():
+                if statement_timeout_ms is not None and statement_timeout_ms != DB_STATEMENT_TIMEOUT_MS:
+                    # SET rather than a SELECT, which would take a REPEATABLE
+                    # READ transaction's snapshot before the caller's first query.
+                    connection.execute(text(f"SET LOCAL statement_timeout = {int(statement_timeout_ms)}"))
+                yield connection
+    except exc.TimeoutError:
+        if not checked_out:
+            with _pool_stats_lock:
+                _pool_stats["timeouts"] += 1
+        raise
+
+
+def _record_checkout(waited):
+    with _pool_stats_lock:
+        _pool_stats["checkouts"] += 1
+        _pool_stats["wait_seconds_total"] += waited
+        _pool_stats["wait_seconds_max"] = max(_pool_stats["wait_seconds_max"], waited)
+
+
+def pool_status():
+    """
+    Pool configuration, current occupancy and connection wait times.
+    """
+    pool = get_engine().pool
+    with _pool_stats_lock:
+        stats = dict(_pool_stats)
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "checkouts": stats["checkouts"],
+        "checkout_timeouts": stats["timeouts"],
+        "wait_seconds_total": round(stats["wait_seconds_total"], 6),
+        "wait_seconds_max": round(stats["wait_seconds_max"], 6),
+        "wait_seconds_avg": round(stats["wait_seconds_total"] / stats["checkouts"], 6) if stats["checkouts"] else 0.0,
+    }
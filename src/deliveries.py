@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import sqlalchemy
+
+# The exchange retries deliveries it did not get an answer for, so each
+# delivery is recorded in delivered_orders under (endpoint, order_id) along
+# with the response it produced. claim() runs first in the delivery's
+# transaction: a replay finds the stored response in one primary key lookup
+# and returns it without touching the ledgers. A new order inserts its row
+# instead, and a concurrent duplicate blocks on that row until the first
+# delivery commits, then returns its response. A rejection the handler
+# returns is stored like any other response; deliveries that raise roll back
+# with their claim, so a retry of a failed delivery runs it again.
+#
+# Some deliveries (POST /inventory/deliver) carry no order id. Those are keyed
+# by body_order_id(), a hash of the request body, and claimed with a replay
+# window: the same body again within UNKEYED_REPLAY_SECONDS is a retry and
+# gets the stored response; after that it is a new order. The window must be
+# shorter than a tick, since the exchange can send the same body for the next
+# tick's order. Concurrent duplicates serialize on an advisory lock instead of
+# the primary key, because a new order reuses the old one's row.
+UNKEYED_REPLAY_SECONDS = float(os.environ.get("DELIVERY_UNKEYED_REPLAY_SECONDS", "600"))
+
+
+def body_order_id(body):
+    """
+    The stand-in order id of a delivery sent without one: a signed 64-bit
+    hash of its JSON body.
+    """
+    digest = hashlib.blake2b(json.dumps(body, sort_keys=True).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def claim(connection, endpoint, order_id, replay_seconds=None):
+    """
+    The stored response if endpoint already delivered order_id, else None
+    once the order is claimed for this transaction. Call record() with the
+    response before the transaction commits. With replay_seconds, only a
+    delivery that recent counts (see the module comment).
+    """
+    key = {"endpoint": endpoint, "order_id": order_id}
+    if replay_seconds is not None:
+        return _claim_within(connection, key, replay_seconds)
+    stored = connection.execute(sqlalchemy.text("""
+        SELECT response FROM delivered_orders WHERE endpoint = :endpoint AND order_id = :order_id
+    """), key).one_or_none()
+    if stored is not None:
+        return stored.response
+
+    claimed = connection.execute(sqlalchemy.text("""
+        INSERT INTO delivered_orders (endpoint, order_id) VALUES (:endpoint, :order_id)
+        ON CONFLICT (endpoint, order_id) DO NOTHING
+        RETURNING order_id
+    """), key).one_or_none()
+    if claimed is not None:
+        return None
+
+    # Another transaction delivered the order while this one waited on the
+    # insert; this statement sees its committed row.
+    return connection.execute(sqlalchemy.text("""
+        SELECT response FROM delivered_orders WHERE endpoint = :endpoint AND order_id = :order_id
+    """), key).scalar_one()
+
+
+def _claim_within(connection, key, replay_seconds):
+    connection.execute(sqlalchemy.text("""
+        SELECT pg_advisory_xact_lock(hashtextextended(:endpoint, :order_id))
+    """), key)
+    # Read after the lock, so a duplicate that waited sees the first one's row.
+    stored = connection.execute(sqlalchemy.text("""
+        SELECT response FROM delivered_orders
+        WHERE endpoint = :endpoint AND order_id = :order_id
+          AND created_at >= LOCALTIMESTAMP - make_interval(secs => :replay_seconds)
+    """), dict(key, replay_seconds=replay_seconds)).one_or_none()
+    if stored is not None:
+        return stored.response
+
+    connection.execute(sqlalchemy.text("""
+        INSERT INTO delivered_orders (endpoint, order_id) VALUES (:endpoint, :order_id)
+        ON CONFLICT (endpoint, order_id) DO UPDATE
+        SET response = NULL, created_at = LOCALTIMESTAMP
+    """), key)
+    return None
+
+
+def record(connection, endpoint, order_id, response):
+    """
+    Store the response of a delivery claimed in this transaction, and return it.
+    """
+    connection.execute(sqlalchemy.text("""
+        UPDATE delivered_orders SET response = CAST(:response AS JSONB)
+        WHERE endpoint = :endpoint AND order_id = :order_id
+    """), {"endpoint": endpoint, "order_id": order_id, "response": json.dumps(response)})
+    return response
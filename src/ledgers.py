@@ -0,0 +1,206 @@
+import logging
+import os
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import sqlalchemy
+from src import balances
+
+logger = logging.getLogger(__name__)
+
+# The gold, ml and potion ledgers are range-partitioned on created_at, one
+# partition per LEDGER_PARTITION_DAYS (see migrations/0004_partitioned_ledgers.sql).
+# ensure_partitions() creates the current and next partitions ahead of time;
+# a DEFAULT partition catches anything outside them.
+#
+# compact() folds every closed partition (one that ends at or before the start
+# of the current one) into the ledger's summary table, one row per account,
+# moves its rows to the ledger's archive table and drops it. Full totals are
+# then the summary plus the live partitions, so they come out the same before
+# and after a compaction, and balance checks only ever scan hot rows.
+LEDGER_PARTITION_DAYS = int(os.environ.get("LEDGER_PARTITION_DAYS", "7"))
+LEDGER_PARTITIONS_AHEAD = 1
+
+# Partitions start on multiples of the period from this Monday.
+_EPOCH = datetime(2000, 1, 3)
+_BOUND = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+@dataclass(frozen=True)
+class Ledger:
+    name: str
+    table: str
+    columns: str
+    # Adds the totals of the rows in {source} matching {where} to the summary.
+    fold: str
+
+
+LEDGERS = [
+    Ledger("gold", "gold_ledger_entries", "id, transaction_id, change, created_at, description", """
+        UPDATE gold_ledger_summary s
+        SET change = s.change + f.change, entries = s.entries + f.entries,
+            compacted_before = GREATEST(s.compacted_before, :before), updated_at = CURRENT_TIMESTAMP
+        FROM (
+            SELECT COALESCE(SUM(change), 0) AS change, COUNT(*) AS entries
+            FROM {source} WHERE {where}
+        ) f
+    """),
+    Ledger("ml", "ml_ledger_entries",
+           "id, transaction_id, red_ml_change, green_ml_change, blue_ml_change, dark_ml_change, "
+           "created_at, description", """
+        UPDATE ml_ledger_summary s
+        SET red_ml_change = s.red_ml_change + f.red,
+            green_ml_change = s.green_ml_change + f.green,
+            blue_ml_change = s.blue_ml_change + f.blue,
+            dark_ml_change = s.dark_ml_change + f.dark,
+            entries = s.entries + f.entries,
+            compacted_before = GREATEST(s.compacted_before, :before), updated_at = CURRENT_TIMESTAMP
+        FROM (
+            SELECT COALESCE(SUM(red_ml_change), 0) AS red, COALESCE(SUM(green_ml_change), 0) AS green,
+                   COALESCE(SUM(blue_ml_change), 0) AS blue, COALESCE(SUM(dark_ml_change), 0) AS dark,
+                   COUNT(*) AS entries
+            FROM {source} WHERE {where}
+        ) f
+    """),
+    Ledger("potion", "potion_inventory_ledger_entries",
+           "id, potion_catalog_id, transaction_id, change, created_at, description", """
+        INSERT INTO potion_ledger_summaries (potion_catalog_id, change, entries, compacted_before)
+        SELECT potion_catalog_id, SUM(change), COUNT(*), :before
+        FROM {source} WHERE {where}
+        GROUP BY potion_catalog_id
+        ON CONFLICT (potion_catalog_id) DO UPDATE
+        SET change = potion_ledger_summaries.change + EXCLUDED.change,
+            entries = potion_ledger_summaries.entries + EXCLUDED.entries,
+            compacted_before = GREATEST(potion_ledger_summaries.compacted_before, EXCLUDED.compacted_before),
+            updated_at = CURRENT_TIMESTAMP
+    """),
+]
+
+
+def period_start(moment):
+    periods = (moment - _EPOCH) // timedelta(days=LEDGER_PARTITION_DAYS)
+    return _EPOCH + periods * timedelta(days=LEDGER_PARTITION_DAYS)
+
+
+def _now(connection):
+    # created_at defaults to the database clock, so partitions follow it too.
+    return connection.execute(sqlalchemy.text("SELECT LOCALTIMESTAMP")).scalar_one()
+
+
+def _partitions(connection, table):
+    """
+    (name, start, end) of each partition of table; start and end are None for
+    the DEFAULT partition.
+    """
+    rows = connection.execute(sqlalchemy.text("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) AS bound
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = CAST(:table AS regclass)
+        ORDER BY c.relname
+    """), {"table": table}).fetchall()
+    partitions = []
+    for row in rows:
+        match = _BOUND.search(row.bound)
+        if match:
+            partitions.append((row.relname, datetime.fromisoformat(match[1]), datetime.fromisoformat(match[2])))
+        else:
+            partitions.append((row.relname, None, None))
+    return partitions
+
+
+def ensure_partitions(connection, now=None):
+    """
+    Create the current partition and the next LEDGER_PARTITIONS_AHEAD of
+    every ledger. Rows already in the DEFAULT partition for a new range are
+    moved into it. Returns the names of the partitions created.
+    """
+    start = period_start(now or _now(connection))
+    period = timedelta(days=LEDGER_PARTITION_DAYS)
+    created = []
+    for ledger in LEDGERS:
+        existing = {name for name, _, _ in _partitions(connection, ledger.table)}
+        for offset in range(LEDGER_PARTITIONS_AHEAD + 1):
+            range_start = start + offset * period
+            name = f"{ledger.table}_p{range_start:%Y%m%d}"
+            if name in existing:
+                continue
+            bounds = {"start": range_start, "end": range_start + period}
+            # Built detached and then attached, since a new partition may not
+            # overlap rows still sitting in the DEFAULT partition.
+            connection.execute(sqlalchemy.text(
+                f"CREATE TABLE {name} (LIKE {ledger.table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+            ))
+            connection.execute(sqlalchemy.text(f"""
+                WITH moved AS (
+                    DELETE FROM {ledger.table}_default
+                    WHERE created_at >= :start AND created_at < :end
+                    RETURNING {ledger.columns}
+                )
+                INSERT INTO {name} ({ledger.columns}) SELECT {ledger.columns} FROM moved
+            """), bounds)
+            connection.execute(sqlalchemy.text(
+                f"ALTER TABLE {ledger.table} ATTACH PARTITION {name} "
+                f"FOR VALUES FROM ('{range_start.isoformat()}') TO ('{(range_start + period).isoformat()}')"
+            ))
+            created.append(name)
+    if created:
+        logger.info("Created ledger partitions: %s", created)
+    return created
+
+
+def _compact_rows(connection, ledger, source, where, before, bounds):
+    """
+    Fold the rows of source matching where into the summary and copy them to
+    the archive. Returns how many rows that was.
+    """
+    connection.execute(sqlalchemy.text(ledger.fold.format(source=source, where=where)), dict(bounds, before=before))
+    return connection.execute(sqlalchemy.text(f"""
+        INSERT INTO {ledger.table}_archive ({ledger.columns})
+        SELECT {ledger.columns} FROM {source} WHERE {where}
+    """), bounds).rowcount
+
+
+def compact(connection):
+    """
+    Fold every closed ledger partition, plus DEFAULT partition rows older than
+    the current partition, into the summaries and archive their rows. Writes a
+    balance checkpoint first, so later checkpoints never need archived rows,
+    and compacts nothing while the balances disagree with the ledgers.
+    """
+    balances.lock_ledgers(connection, "ACCESS EXCLUSIVE")
+    now = _now(connection)
+    ensure_partitions(connection, now)
+    checkpoint = balances.checkpoint(connection)
+    if checkpoint["checkpoint_id"] is None:
+        # The checkpoint is what lets later ones skip archived rows; a drifted
+        # shop is repaired (by the next tick, or /admin/balances/check) first.
+        return {"error": "Balances disagree with the ledgers; repair them before compacting.",
+                "mismatches": checkpoint["mismatches"]}
+    hot_start = period_start(now)
+
+    compacted = []
+    for ledger in LEDGERS:
+        for name, start, end in _partitions(connection, ledger.table):
+            if start is None:
+                bounds = {"before": hot_start}
+                entries = _compact_rows(connection, ledger, name, "created_at < :before", hot_start, bounds)
+                connection.execute(sqlalchemy.text(f"DELETE FROM {name} WHERE created_at < :before"), bounds)
+            elif end <= hot_start:
+                entries = _compact_rows(connection, ledger, name, "TRUE", end, {})
+                connection.execute(sqlalchemy.text(f"ALTER TABLE {ledger.table} DETACH PARTITION {name}"))
+                connection.execute(sqlalchemy.text(f"DROP TABLE {name}"))
+            else:
+                continue
+            if start is None and entries == 0:
+                continue
+            connection.execute(sqlalchemy.text("""
+                INSERT INTO ledger_compactions (ledger, partition_name, range_start, range_end, entries)
+                VALUES (:ledger, :partition_name, :range_start, :range_end, :entries)
+            """), {"ledger": ledger.name, "partition_name": name, "range_start": start,
+                   "range_end": end or hot_start, "entries": entries})
+            compacted.append({"ledger": ledger.name, "partition": name, "entries": entries})
+
+    logger.info("Compacted %s ledger partitions.", len(compacted))
+    return {"checkpoint_id": checkpoint["checkpoint_id"], "compacted_before": hot_start.isoformat(),
+            "partitions": compacted}
@@ -0,0 +1,149 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+
+# Structured logging off the request path. Handlers log through the standard
+# logging module; records go onto an in-process queue untouched and a
+# background thread formats them as one JSON object per line on stdout. The
+# message and any traceback are rendered when the record is queued, so later
+# changes to a mutable argument do not show up in the log; building the JSON
+# line, including extra={"payload": ...}, is left to the background thread.
+# Pass %-style args rather than f-strings, so records dropped by sampling are
+# never rendered at all.
+#
+# LOG_LEVEL sets the root level (default INFO). LOG_SAMPLE_RATES keeps only a
+# share of the requests to a route for DEBUG and INFO records, e.g.
+# "GET /catalog/=0.1,POST /carts/visits/{visit_id}=0.05"; warnings and errors
+# are always kept. When the queue (LOG_QUEUE_SIZE) is full, records are
+# dropped instead of making the request wait.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+
+
+def _parse_sample_rates(value):
+    rates = {}
+    for entry in filter(None, (part.strip() for part in value.split(","))):
+        route, _, rate = entry.rpartition("=")
+        rates[route.strip()] = float(rate)
+    return rates
+
+
+LOG_SAMPLE_RATES = _parse_sample_rates(os.environ.get("LOG_SAMPLE_RATES", ""))
+
+_request = ContextVar("log_request", default=(None, True))
+
+
+@contextmanager
+def request(route):
+    """
+    Tag records logged inside the block with route and decide once, for the
+    whole request, whether its DEBUG and INFO records are sampled in.
+    """
+    rate = LOG_SAMPLE_RATES.get(route, 1.0)
+    token = _request.set((route, rate >= 1.0 or random.random() < rate))
+    try:
+        yield
+    finally:
+        _request.reset(token)
+
+
+class _RequestFilter(logging.Filter):
+    def filter(self, record):
+        route, sampled = _request.get()
+        record.route = route
+        return sampled or record.levelno >= logging.WARNING
+
+
+class _LazyQueueHandler(QueueHandler):
+    """
+    QueueHandler that renders only the message and traceback before queueing,
+    leaving the JSON line to the listener thread, and drops records instead of
+    blocking when the queue is full.
+    """
+
+    dropped = 0
+    _exceptions = logging.Formatter()
+
+    def prepare(self, record):
+        # As QueueHandler.prepare does, but the traceback stays apart from the
+        # message so JsonFormatter can still put it under "exception".
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exceptions.formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _LazyQueueHandler.dropped += 1
+
+
+def _to_json(value):
+    if hasattr(value, "dict"):
+        return value.dict()
+    return str(value)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "route", None):
+            entry["route"] = record.route
+        if getattr(record, "payload", None) is not None:
+            entry["payload"] = record.payload
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=_to_json)
+
+
+_listener = None
+
+
+def configure():
+    """
+    Route the root logger through the background queue. Safe to call more
+    than once.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter())
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = _LazyQueueHandler(log_queue)
+    handler.addFilter(_RequestFilter())
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def dropped_records():
+    """
+    Records discarded because the log queue was full.
+    """
+    return _LazyQueueHandler.dropped
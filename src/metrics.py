@@ -0,0 +1,207 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from starlette.routing import Match
+from src import logs
+from src import plan_cache
+from src import query_stats
+from src import solver_pool
+
+# Request metrics per route template (e.g. /carts/{cart_id}/checkout rather
+# than every cart id): a latency histogram, the number of requests in flight,
+# a count per status code, and how many SQL statements the route runs (see
+# query_stats). render() writes them in the Prometheus text format for
+# GET /metrics.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNMATCHED_ROUTE = "unmatched"
+
+_lock = threading.Lock()
+_bucket_counts = defaultdict(lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+_latency_sums = defaultdict(float)
+_in_flight = defaultdict(int)
+_responses = defaultdict(int)
+_queries = defaultdict(int)
+_query_seconds = defaultdict(float)
+_max_queries = defaultdict(int)
+
+
+def _route_template(routes, scope):
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", UNMATCHED_ROUTE)
+    return UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware that times every HTTP request against the route it
+    matches. Streaming responses are timed until their last chunk is sent.
+    """
+
+    def __init__(self, app, routes):
+        self.app = app
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        key = (scope["method"], _route_template(self.routes, scope))
+        status = 500
+
+        with logs.request(" ".join(key)), query_stats.track(" ".join(key)) as queries:
+
+            async def record_status(message):
+                nonlocal status
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    if query_stats.QUERY_STATS_HEADER:
+                        # Statements a streaming body runs after this point are not included.
+                        message = dict(message, headers=list(message.get("headers", [])) + [
+                            (b"x-query-stats", queries.header().encode())
+                        ])
+                await send(message)
+
+            with _lock:
+                _in_flight[key] += 1
+            start = time.perf_counter()
+            try:
+                await self.app(scope, receive, record_status)
+            finally:
+                _observe(key, status, time.perf_counter() - start, queries)
+
+
+def _observe(key, status, seconds, queries):
+    with _lock:
+        _in_flight[key] -= 1
+        _bucket_counts[key][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        _latency_sums[key] += seconds
+        _responses[key + (status,)] += 1
+        _queries[key] += queries.count
+        _query_seconds[key] += queries.seconds
+        _max_queries[key] = max(_max_queries[key], queries.count)
+
+
+def _labels(method, route, **extra):
+    pairs = [("method", method), ("route", route)] + [(name, str(value)) for name, value in extra.items()]
+    return ",".join(f'{name}="{value}"' for name, value in pairs)
+
+
+def render(pool=None):
+    """
+    All request metrics, plus connection pool gauges when pool (a
+    db.pool_status() dict) is given, in the Prometheus text format.
+    """
+    with _lock:
+        bucket_counts = {key: list(counts) for key, counts in _bucket_counts.items()}
+        latency_sums = dict(_latency_sums)
+        in_flight = dict(_in_flight)
+        responses = dict(_responses)
+        queries = dict(_queries)
+        query_seconds = dict(_query_seconds)
+        max_queries = dict(_max_queries)
+
+    lines = [
+        "# HELP http_request_duration_seconds Request latency by route.",
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    for (method, route), counts in sorted(bucket_counts.items()):
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"http_request_duration_seconds_bucket{{{_labels(method, route, le=le)}}} {cumulative}")
+        lines.append(f"http_request_duration_seconds_sum{{{_labels(method, route)}}} {latency_sums[(method, route)]:.6f}")
+        lines.append(f"http_request_duration_seconds_count{{{_labels(method, route)}}} {cumulative}")
+
+    lines += [
+        "# HELP http_requests_in_flight Requests currently being served by route.",
+        "# TYPE http_requests_in_flight gauge",
+    ]
+    for (method, route), count in sorted(in_flight.items()):
+        lines.append(f"http_requests_in_flight{{{_labels(method, route)}}} {count}")
+
+    lines += [
+        "# HELP http_responses_total Responses by route and status code.",
+        "# TYPE http_responses_total counter",
+    ]
+    for (method, route, status), count in sorted(responses.items()):
+        lines.append(f"http_responses_total{{{_labels(method, route, status=status)}}} {count}")
+
+    lines += [
+        "# HELP db_queries_total SQL statements run by route.",
+        "# TYPE db_queries_total counter",
+    ]
+    for (method, route), count in sorted(queries.items()):
+        lines.append(f"db_queries_total{{{_labels(method, route)}}} {count}")
+
+    lines += [
+        "# HELP db_query_seconds_total Time spent in SQL statements by route.",
+        "# TYPE db_query_seconds_total counter",
+    ]
+    for (method, route), seconds in sorted(query_seconds.items()):
+        lines.append(f"db_query_seconds_total{{{_labels(method, route)}}} {seconds:.6f}")
+
+    lines += [
+        "# HELP db_queries_per_request_max Most SQL statements one request has run, by route.",
+        "# TYPE db_queries_per_request_max gauge",
+    ]
+    for (method, route), count in sorted(max_queries.items()):
+        lines.append(f"db_queries_per_request_max{{{_labels(method, route)}}} {count}")
+
+    lines += [
+        "# HELP log_records_dropped_total Log records discarded because the log queue was full.",
+        "# TYPE log_records_dropped_total counter",
+        f"log_records_dropped_total {logs.dropped_records()}",
+    ]
+
+    caches = plan_cache.all_stats()
+    for metric, field, kind, description in (
+        ("plan_cache_hits_total", "hits", "counter", "Planner calls answered from the plan cache."),
+        ("plan_cache_misses_total", "misses", "counter", "Planner calls that had to run the solver."),
+        ("plan_cache_entries", "size", "gauge", "Plans currently cached."),
+    ):
+        lines += [f"# HELP {metric} {description}", f"# TYPE {metric} {kind}"]
+        lines += [f'{metric}{{cache="{cache["name"]}"}} {cache[field]}' for cache in caches]
+
+    solver_stats = solver_pool.stats()
+    lines += [
+        "# HELP solver_pool_size Planner solves that can run at once (0 runs them inline).",
+        "# TYPE solver_pool_size gauge",
+        f"solver_pool_size {solver_stats['size']}",
+        "# HELP solver_pool_solves_total Planner solves sent to the solver pool.",
+        "# TYPE solver_pool_solves_total counter",
+        f"solver_pool_solves_total {solver_stats['solves']}",
+        "# HELP solver_pool_timeouts_total Solves that ran out of time and served a fallback plan.",
+        "# TYPE solver_pool_timeouts_total counter",
+        f"solver_pool_timeouts_total {solver_stats['timeouts']}",
+        "# HELP solver_pool_failures_total Solves whose worker process died.",
+        "# TYPE solver_pool_failures_total counter",
+        f"solver_pool_failures_total {solver_stats['failures']}",
+    ]
+
+    if pool is not None:
+        lines += [
+            "# TYPE db_pool_size gauge",
+            f"db_pool_size {pool['pool_size']}",
+            "# TYPE db_pool_max_overflow gauge",
+            f"db_pool_max_overflow {pool['max_overflow']}",
+            "# TYPE db_pool_checked_out gauge",
+            f"db_pool_checked_out {pool['checked_out']}",
+            "# TYPE db_pool_overflow gauge",
+            f"db_pool_overflow {pool['overflow']}",
+            "# TYPE db_pool_checkouts_total counter",
+            f"db_pool_checkouts_total {pool['checkouts']}",
+            "# TYPE db_pool_checkout_timeouts_total counter",
+            f"db_pool_checkout_timeouts_total {pool['checkout_timeouts']}",
+            "# HELP db_pool_wait_seconds_total Time spent waiting for a pooled connection.",
+            "# TYPE db_pool_wait_seconds_total counter",
+            f"db_pool_wait_seconds_total {pool['wait_seconds_total']}",
+            "# TYPE db_pool_wait_seconds_max gauge",
+            f"db_pool_wait_seconds_max {pool['wait_seconds_max']}",
+        ]
+    return "\n".join(lines) + "\n"
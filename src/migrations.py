@@ -0,0 +1,177 @@
+"""
+Apply the SQL files in migrations/ in version order.
+
+Each file runs in its own transaction and is recorded in schema_migrations
+with a checksum, so it is applied exactly once. A session advisory lock keeps
+two runners (say, two deploys starting together) from applying the same file
+twice. Databases built from schema.sql already have every migration in it;
+mark them applied with --baseline instead of running them.
+
+    python -m src.migrations             # apply pending migrations
+    python -m src.migrations --status
+    python -m src.migrations --baseline  # record all migrations as applied
+    python -m src.migrations --baseline 0003
+"""
+import argparse
+import hashlib
+import logging
+import re
+from dataclasses import dataclass
+from pathlib import Path
+import sqlalchemy
+from sqlalchemy.pool import NullPool
+from src import database as db
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "migrations"
+# Key of the advisory lock held while migrating.
+LOCK_KEY = int.from_bytes(hashlib.blake2b(b"schema_migrations", digest_size=8).digest(), "big", signed=True)
+_FILENAME = re.compile(r"^(\d{4})_\w+\.sql$")
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: str
+    name: str
+    sql: str
+
+    @property
+    def checksum(self):
+        return hashlib.sha256(self.sql.encode()).hexdigest()
+
+
+def available(directory=MIGRATIONS_DIR):
+    """
+    Every migration file in directory, oldest first.
+    """
+    migrations = []
+    for path in sorted(Path(directory).glob("*.sql")):
+        match = _FILENAME.match(path.name)
+        if not match:
+            raise ValueError(f"Migration file names must look like 0001_name.sql: {path.name}")
+        migrations.append(Migration(match[1], path.stem, path.read_text()))
+    versions = [migration.version for migration in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f"Duplicate migration versions in {directory}.")
+    return migrations
+
+
+def _ensure_table(connection):
+    connection.execute(sqlalchemy.text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            checksum TEXT NOT NULL,
+            baseline BOOLEAN NOT NULL DEFAULT FALSE,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+
+
+def applied(connection):
+    """
+    Checksum of each recorded migration, by version.
+    """
+    rows = connection.execute(sqlalchemy.text("SELECT version, checksum FROM schema_migrations")).fetchall()
+    return {row.version: row.checksum for row in rows}
+
+
+def _record(connection, migration, baseline):
+    connection.execute(sqlalchemy.text("""
+        INSERT INTO schema_migrations (version, name, checksum, baseline)
+        VALUES (:version, :name, :checksum, :baseline)
+    """), {"version": migration.version, "name": migration.name, "checksum": migration.checksum,
+           "baseline": baseline})
+
+
+def _run(connection, sql):
+    # Through the driver cursor without parameters, so a % in the file is not
+    # taken for a placeholder.
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute(sql)
+    finally:
+        cursor.close()
+
+
+def migrate(engine=None, directory=MIGRATIONS_DIR, baseline=False, baseline_through=None):
+    """
+    Apply the pending migrations in order, or with baseline record them (up
+    to baseline_through, if given) without running them. Returns the
+    versions applied or recorded.
+    """
+    migrations = available(directory)
+    engine = engine or sqlalchemy.create_engine(db.database_connection_url(), poolclass=NullPool)
+    done = []
+    with engine.connect() as connection:
+        connection.execute(sqlalchemy.text("SELECT pg_advisory_lock(:key)"), {"key": LOCK_KEY})
+        connection.commit()
+        try:
+            with connection.begin():
+                _ensure_table(connection)
+                recorded = applied(connection)
+
+            for migration in migrations:
+                if migration.version in recorded:
+                    if recorded[migration.version] != migration.checksum:
+                        logger.warning("Migration %s changed after it was applied.", migration.name)
+                    continue
+                if baseline:
+                    if baseline_through is not None and migration.version > baseline_through:
+                        break
+                    with connection.begin():
+                        _record(connection, migration, baseline=True)
+                    logger.info("Recorded migration %s as applied.", migration.name)
+                else:
+                    with connection.begin():
+                        connection.execute(sqlalchemy.text("SET LOCAL statement_timeout = 0"))
+                        _run(connection, migration.sql)
+                        _record(connection, migration, baseline=False)
+                    logger.info("Applied migration %s.", migration.name)
+                done.append(migration.version)
+        finally:
+            connection.execute(sqlalchemy.text("SELECT pg_advisory_unlock(:key)"), {"key": LOCK_KEY})
+            connection.commit()
+    return done
+
+
+def status(engine=None, directory=MIGRATIONS_DIR):
+    """
+    (name, state) of every migration file, state being applied, baseline,
+    changed or pending.
+    """
+    engine = engine or sqlalchemy.create_engine(db.database_connection_url(), poolclass=NullPool)
+    with engine.begin() as connection:
+        _ensure_table(connection)
+        rows = connection.execute(sqlalchemy.text(
+            "SELECT version, checksum, baseline FROM schema_migrations"
+        )).fetchall()
+    recorded = {row.version: row for row in rows}
+    states = []
+    for migration in available(directory):
+        row = recorded.get(migration.version)
+        if row is None:
+            state = "pending"
+        elif row.checksum != migration.checksum:
+            state = "changed"
+        else:
+            state = "baseline" if row.baseline else "applied"
+        states.append((migration.name, state))
+    return states
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--status", action="store_true", help="list migrations and whether they are applied")
+    parser.add_argument("--baseline", nargs="?", const="", metavar="VERSION",
+                        help="record migrations (through VERSION, if given) as applied without running them")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.status:
+        for name, state in status():
+            print(f"{name:<40} {state}")
+    else:
+        done = migrate(baseline=args.baseline is not None, baseline_through=args.baseline or None)
+        print(f"{'Recorded' if args.baseline is not None else 'Applied'} {len(done)} migrations.")
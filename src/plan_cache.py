@@ -0,0 +1,68 @@
+import copy
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+# Memoized planner results. A plan depends only on the shop state and recipes
+# it was computed from, so a repeated or retried plan call with unchanged
+# inputs can return the earlier answer instead of running the solver again.
+# Entries are keyed by a digest of those inputs and evicted least recently
+# used first.
+BOTTLING_PLAN_CACHE_SIZE = int(os.environ.get("BOTTLING_PLAN_CACHE_SIZE", "128"))
+
+
+def key(*inputs):
+    """
+    Digest of the planner inputs. Pass plain values (numbers, strings,
+    tuples, sorted items) so equal states always produce equal keys.
+    """
+    return hashlib.blake2b(repr(inputs).encode(), digest_size=16).digest()
+
+
+class PlanCache:
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, plan_key):
+        """
+        A copy of the plan stored under plan_key, or None on a miss.
+        """
+        with self._lock:
+            plan = self._plans.get(plan_key)
+            if plan is None:
+                self.misses += 1
+                return None
+            self._plans.move_to_end(plan_key)
+            self.hits += 1
+        return copy.deepcopy(plan)
+
+    def put(self, plan_key, plan):
+        if self.maxsize <= 0:
+            return
+        plan = copy.deepcopy(plan)
+        with self._lock:
+            self._plans[plan_key] = plan
+            self._plans.move_to_end(plan_key)
+            while len(self._plans) > self.maxsize:
+                self._plans.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"name": self.name, "size": len(self._plans), "hits": self.hits, "misses": self.misses}
+
+
+bottling_plans = PlanCache("bottling", BOTTLING_PLAN_CACHE_SIZE)
+
+
+def all_stats():
+    return [bottling_plans.stats()]
@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+import warnings
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+
+# Per-request SQL statistics. Engine hooks count and time every statement and
+# add it to the stats of the request being served, which MetricsMiddleware
+# opens with track(). Statements are grouped by shape: their SQL text with
+# whitespace collapsed, which is the same for every call since parameters are
+# bound. A shape that runs more than QUERY_REPEAT_LIMIT times in one request
+# is usually a query inside a Python loop and raises RepeatedQueryWarning.
+# Handlers catch broad exceptions and may swallow the warning even when it is
+# raised as an error, so each one is also handed to the collect_repeats()
+# blocks open at the time; the test suite fails any test that has one (see
+# test/conftest.py).
+QUERY_REPEAT_LIMIT = int(os.environ.get("QUERY_REPEAT_LIMIT", "10"))
+# QUERY_STATS_HEADER=1 adds an X-Query-Stats header to every response.
+QUERY_STATS_HEADER = os.environ.get("QUERY_STATS_HEADER", "").lower() in ("1", "true", "yes")
+
+
+class RepeatedQueryWarning(UserWarning):
+    pass
+
+
+class RequestQueries:
+    def __init__(self, label):
+        self.label = label
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+        self.violations = []
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        shape = " ".join(statement.split())
+        self.shapes[shape] += 1
+        if self.shapes[shape] == QUERY_REPEAT_LIMIT + 1:
+            message = f"{self.label} ran the same statement more than {QUERY_REPEAT_LIMIT} times: {shape[:200]}"
+            self.violations.append(message)
+            with _collectors_lock:
+                for collected in _collectors.values():
+                    collected.append(message)
+            warnings.warn(RepeatedQueryWarning(message), stacklevel=2)
+
+    @property
+    def max_repeats(self):
+        return max(self.shapes.values(), default=0)
+
+    def header(self):
+        return f"count={self.count}; time_ms={self.seconds * 1000:.1f}; max_repeats={self.max_repeats}"
+
+
+_current = ContextVar("request_queries", default=None)
+_collectors_lock = threading.Lock()
+# Keyed by id: two open collectors can hold equal lists.
+_collectors = {}
+
+
+@contextmanager
+def track(label):
+    """
+    Collect the statements run inside the block (including in threadpool
+    workers and greenlets started from it) into a RequestQueries.
+    """
+    stats = RequestQueries(label)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def collect_repeats():
+    """
+    Collect the message of every RepeatedQueryWarning raised inside the block,
+    from any thread, including ones the handler caught.
+    """
+    collected = []
+    with _collectors_lock:
+        _collectors[id(collected)] = collected
+    try:
+        yield collected
+    finally:
+        with _collectors_lock:
+            del _collectors[id(collected)]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_start"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info.pop("query_start")
+    stats = _current.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
+
+
+def install(engine):
+    """
+    Attach the statement hooks to engine.
+    """
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
@@ -0,0 +1,93 @@
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping
+import sqlalchemy
+
+POTION_CAPACITY_PER_UNIT = 50
+ML_CAPACITY_PER_UNIT = 10000
+
+
+@dataclass(frozen=True)
+class ShopState:
+    """
+    Gold, ml, potion and capacity figures for the shop as read in one statement.
+    Capacity units include the one unit of each every shop starts with.
+    """
+    gold: int
+    red_ml: int
+    green_ml: int
+    blue_ml: int
+    dark_ml: int
+    potions: Mapping[int, int]
+    potion_capacity_units: int
+    ml_capacity_units: int
+
+    @property
+    def ml(self):
+        return {
+            "red": self.red_ml,
+            "green": self.green_ml,
+            "blue": self.blue_ml,
+            "dark": self.dark_ml
+        }
+
+    @property
+    def total_ml(self):
+        return self.red_ml + self.green_ml + self.blue_ml + self.dark_ml
+
+    @property
+    def total_potions(self):
+        return sum(self.potions.values())
+
+    @property
+    def potion_capacity(self):
+        return self.potion_capacity_units * POTION_CAPACITY_PER_UNIT
+
+    @property
+    def ml_capacity(self):
+        return self.ml_capacity_units * ML_CAPACITY_PER_UNIT
+
+
+def load(connection, lock_gold=False, lock_ml=False):
+    """
+    Read the current ShopState in a single round trip. lock_gold and lock_ml lock
+    the corresponding balance rows until the transaction ends (ml first, matching
+    the lock order documented in src/checkout.py).
+    """
+    query = """
+        SELECT
+            g.balance AS gold,
+            m.red_ml, m.green_ml, m.blue_ml, m.dark_ml,
+            p.potion_ids, p.potion_quantities,
+            c.potion_capacity, c.ml_capacity
+        FROM ml_balance m
+        CROSS JOIN gold_balance g
+        CROSS JOIN LATERAL (
+            SELECT
+                COALESCE(array_agg(potion_catalog_id), '{}') AS potion_ids,
+                COALESCE(array_agg(quantity), '{}') AS potion_quantities
+            FROM potion_balances
+        ) p
+        CROSS JOIN LATERAL (
+            SELECT
+                COALESCE(SUM(potion_capacity), 0) AS potion_capacity,
+                COALESCE(SUM(ml_capacity), 0) AS ml_capacity
+            FROM capacity_purchases
+        ) c
+    """
+    locked = [alias for alias, lock in (("m", lock_ml), ("g", lock_gold)) if lock]
+    if locked:
+        query += f" FOR UPDATE OF {', '.join(locked)}"
+
+    row = connection.execute(sqlalchemy.text(query)).one()
+
+    return ShopState(
+        gold=row.gold,
+        red_ml=row.red_ml,
+        green_ml=row.green_ml,
+        blue_ml=row.blue_ml,
+        dark_ml=row.dark_ml,
+        potions=MappingProxyType(dict(zip(row.potion_ids, row.potion_quantities))),
+        potion_capacity_units=1 + row.potion_capacity,
+        ml_capacity_units=1 + row.ml_capacity
+    )
@@ -0,0 +1,221 @@
+import atexit
+import importlib
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Planner solves run in a small pool of worker processes, so a long solve
+# holds neither the GIL nor a request thread that cheap endpoints need.
+# SOLVER_POOL_SIZE caps how many solves run at once; 0 runs them inline in
+# the request as before. A solve waits at most SOLVER_TIMEOUT_MS for a free
+# worker and then gets SOLVER_TIMEOUT_MS to finish, counting the time to start
+# the worker if it has none. When the time is up, the worker is killed
+# together with any CBC process it started, and run() raises SolverTimeout so
+# the caller can serve a quick fallback plan instead. The next solve starts a
+# fresh worker. A worker still starting when its solve gives up is kept and
+# keeps starting, for the next solve; one not ready after _START_TIMEOUT
+# seconds is killed. The app calls start() when it starts, so requests do not
+# pay for starting the first workers.
+SOLVER_POOL_SIZE = int(os.environ.get("SOLVER_POOL_SIZE", "2"))
+SOLVER_TIMEOUT_MS = float(os.environ.get("SOLVER_TIMEOUT_MS", "2000"))
+
+# Imported by each worker before it takes work, so a solve does not pay for
+# them: the solvers, and the classes of the arguments handlers pass in.
+PRELOAD = ["src.bottling", "src.wholesale", "src.api.barrels", "sqlalchemy.engine"]
+_START_TIMEOUT = 30
+
+
+class SolverTimeout(Exception):
+    pass
+
+
+def _serve(connection, preload):
+    if hasattr(os, "setpgrp"):
+        # Own process group, so killing the worker also kills its CBC child.
+        os.setpgrp()
+    for module in preload:
+        importlib.import_module(module)
+    connection.send(("ready", None))
+    while True:
+        try:
+            function, args = connection.recv()
+        except EOFError:
+            return
+        try:
+            connection.send(("ok", function(*args)))
+        except Exception as e:
+            connection.send(("error", e))
+
+
+class _Worker:
+    def __init__(self, context):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child, PRELOAD), daemon=True)
+        self.process.start()
+        child.close()
+        self.started_at = time.monotonic()
+        self.ready = False
+        with _lock:
+            _workers.add(self)
+
+    def wait_ready(self, timeout):
+        """
+        Whether the worker has finished starting, waiting up to timeout
+        seconds for it. Raises RuntimeError once it is past _START_TIMEOUT.
+        """
+        if not self.ready:
+            start_left = self.started_at + _START_TIMEOUT - time.monotonic()
+            if self.connection.poll(max(min(timeout, start_left), 0)):
+                self.connection.recv()
+                self.ready = True
+            elif timeout >= start_left:
+                raise RuntimeError("Solver worker did not start.")
+        return self.ready
+
+    def kill(self):
+        with _lock:
+            _workers.discard(self)
+        if self.process.is_alive():
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except (AttributeError, OSError):
+                # No process groups here, or the worker never got to make one.
+                self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+_lock = threading.Lock()
+_slots = None
+# Every started worker, idle or serving a solve, so shutdown() can kill them all.
+_workers = set()
+_stats = {"solves": 0, "timeouts": 0, "failures": 0}
+
+
+def _context():
+    # forkserver forks workers from a clean, single-threaded process rather
+    # than from the app with its log and request threads.
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    context = multiprocessing.get_context(method)
+    if method == "forkserver":
+        context.set_forkserver_preload(PRELOAD)
+    return context
+
+
+def _pool():
+    global _slots
+    with _lock:
+        if _slots is None:
+            # One slot per worker; a slot holds None until its worker is started.
+            _slots = queue.Queue()
+            for _ in range(SOLVER_POOL_SIZE):
+                _slots.put(None)
+            atexit.register(shutdown)
+        return _slots
+
+
+def start():
+    """
+    Start every idle slot's worker without waiting for it to be ready.
+    """
+    if SOLVER_POOL_SIZE <= 0:
+        return
+    slots = _pool()
+    idle = []
+    while True:
+        try:
+            idle.append(slots.get_nowait())
+        except queue.Empty:
+            break
+    try:
+        context = _context()
+        for index, worker in enumerate(idle):
+            if worker is None:
+                idle[index] = _Worker(context)
+    finally:
+        for worker in idle:
+            slots.put(worker)
+
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+def run(function, *args, timeout_ms=None):
+    """
+    function(*args) in a pool worker. function, args and the result must be
+    picklable. Raises SolverTimeout if the solve runs out of time or its
+    worker dies; exceptions raised by function are re-raised here.
+    """
+    if SOLVER_POOL_SIZE <= 0:
+        return function(*args)
+
+    timeout = (SOLVER_TIMEOUT_MS if timeout_ms is None else timeout_ms) / 1000
+    slots = _pool()
+    _count("solves")
+    try:
+        worker = slots.get(timeout=timeout)
+    except queue.Empty:
+        _count("timeouts")
+        _give_up(function, "no solver worker was free")
+
+    deadline = time.monotonic() + timeout
+    try:
+        if worker is None or not worker.process.is_alive():
+            if worker is not None:
+                worker.kill()
+                worker = None
+            worker = _Worker(_context())
+        if not worker.wait_ready(max(deadline - time.monotonic(), 0)):
+            _count("timeouts")
+            _give_up(function, "its worker is still starting")
+        worker.connection.send((function, args))
+        if not worker.connection.poll(max(deadline - time.monotonic(), 0)):
+            worker.kill()
+            worker = None
+            _count("timeouts")
+            _give_up(function, "it ran out of time")
+        status, value = worker.connection.recv()
+    except (EOFError, OSError, RuntimeError):
+        if worker is not None:
+            worker.kill()
+            worker = None
+        _count("failures")
+        _give_up(function, "its worker failed")
+    finally:
+        slots.put(worker)
+
+    if status == "error":
+        raise value
+    return value
+
+
+def _give_up(function, reason):
+    name = f"{function.__module__}.{function.__qualname__}"
+    logger.warning("Solve %s did not finish: %s.", name, reason)
+    raise SolverTimeout(f"{name} did not finish: {reason}.")
+
+
+def stats():
+    with _lock:
+        return dict(_stats, size=SOLVER_POOL_SIZE)
+
+
+def shutdown():
+    """
+    Kill all started workers, including any serving a solve; those solves
+    fail with SolverTimeout. The pool starts new workers on the next solve.
+    """
+    global _slots
+    with _lock:
+        _slots = None
+        workers = list(_workers)
+    for worker in workers:
+        worker.kill()
@@ -0,0 +1,322 @@
+import logging
+import math
+import os
+from dataclasses import dataclass
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+# Wholesale barrel purchase plans. A plan buys whole barrels from the catalog
+# to get as much ml as possible, within the gold on hand and free ml capacity.
+# Each color also has a target: the most ml of that color worth buying.
+#
+# By default a color's target is unlimited while the shop holds less than
+# ML_THRESHOLD ml of it, and zero after that. BARREL_ML_TARGETS, e.g.
+# "red=5000,green=5000,blue=3000,dark=0", replaces that rule with a desired
+# level per color; the target becomes whatever is missing to reach it.
+# Mixed-color barrels split their ml across colors by their potion_type and
+# are bought only if every color they carry has room.
+#
+# "knapsack" (the default) solves this exactly in-process. Barrels are
+# grouped: one group per color with a finite target, and one for all the
+# rest. For each group, a bounded knapsack over gcd-scaled ml finds the least
+# gold that buys each ml amount, and the groups are merged under the shared
+# capacity. A mixed barrel touching a color with a finite target couples the
+# groups, and so does a state space over BARREL_DP_MAX_STATES; those plans go
+# to the "pulp" ILP instead. "greedy" buys the cheapest ml first, for when there
+# is no time to solve.
+BARREL_SOLVER = os.environ.get("BARREL_SOLVER", "knapsack").lower()
+BARREL_DP_MAX_STATES = int(os.environ.get("BARREL_DP_MAX_STATES", "2000000"))
+
+ML_THRESHOLD = 1000
+ML_COLORS = ["red", "green", "blue", "dark"]
+UNLIMITED = math.inf
+
+
+def _parse_targets(value):
+    levels = {}
+    for entry in filter(None, (part.strip() for part in value.split(","))):
+        color, _, level = entry.partition("=")
+        levels[color.strip()] = int(level)
+    return levels
+
+
+BARREL_ML_TARGETS = _parse_targets(os.environ.get("BARREL_ML_TARGETS", ""))
+
+
+@dataclass(frozen=True)
+class Solution:
+    quantities: Dict[str, int]
+    ml: int
+    gold: int
+    solver: str
+
+
+def color_targets(ml, levels=None):
+    """
+    Most ml of each color worth buying: up to the configured level if there is
+    one, otherwise unlimited below ML_THRESHOLD and nothing above it.
+    """
+    levels = BARREL_ML_TARGETS if levels is None else levels
+    if levels:
+        return {color: max(levels.get(color, 0) - ml[color], 0) for color in ML_COLORS}
+    return {color: UNLIMITED if ml[color] < ML_THRESHOLD else 0 for color in ML_COLORS}
+
+
+def color_shares(barrel):
+    """
+    Fraction of the barrel's ml that goes to each color, keyed by color.
+    """
+    total = sum(barrel.potion_type)
+    if total <= 0:
+        return {}
+    return {color: share / total for color, share in zip(ML_COLORS, barrel.potion_type) if share > 0}
+
+
+def split_ml(barrel, ml):
+    """
+    ml from this barrel type, split across colors by its potion_type. Any
+    rounding remainder goes to the barrel's largest color.
+    """
+    total = sum(barrel.potion_type)
+    split = {color: ml * part // total for color, part in zip(ML_COLORS, barrel.potion_type)}
+    largest = ML_COLORS[barrel.potion_type.index(max(barrel.potion_type))]
+    split[largest] += ml - sum(split.values())
+    return split
+
+
+def eligible(catalog, targets, gold, capacity):
+    """
+    Barrels worth considering, each with the most that could be bought on its
+    own within stock, gold, capacity and its colors' targets.
+    """
+    result = []
+    for barrel in catalog:
+        shares = color_shares(barrel)
+        if not shares or barrel.ml_per_barrel <= 0 or any(targets[color] <= 0 for color in shares):
+            continue
+        most = min(barrel.quantity, capacity // barrel.ml_per_barrel)
+        if barrel.price > 0:
+            most = min(most, gold // barrel.price)
+        for color, share in shares.items():
+            if targets[color] != UNLIMITED:
+                most = min(most, int(targets[color] // (barrel.ml_per_barrel * share)))
+        if most > 0:
+            result.append((barrel, most))
+    return result
+
+
+def solve_pulp(candidates, gold, capacity, targets):
+    """
+    Solve the purchase model as an ILP with CBC through pulp.
+    """
+    # pulp is slow to import; load it on the first solve, not at app start.
+    from pulp import LpMaximize, LpProblem, LpVariable, lpSum, LpInteger, PULP_CBC_CMD
+
+    prob = LpProblem("Wholesale_Purchase_Plan", LpMaximize)
+    barrel_vars = {
+        barrel.sku: (barrel, LpVariable(f"b_{index}", lowBound=0, upBound=most, cat=LpInteger))
+        for index, (barrel, most) in enumerate(candidates)
+    }
+
+    prob += lpSum([barrel.ml_per_barrel * var for barrel, var in barrel_vars.values()]), "Total_ML"
+    prob += lpSum([barrel.price * var for barrel, var in barrel_vars.values()]) <= gold, "GoldConstraint"
+    prob += lpSum([barrel.ml_per_barrel * var for barrel, var in barrel_vars.values()]) <= capacity, "MLCapacityConstraint"
+    for color in ML_COLORS:
+        if targets[color] == UNLIMITED:
+            continue
+        carrying = [(barrel, var) for barrel, var in barrel_vars.values() if color in color_shares(barrel)]
+        if carrying:
+            prob += lpSum([
+                barrel.ml_per_barrel * color_shares(barrel)[color] * var for barrel, var in carrying
+            ]) <= targets[color], f"{color.capitalize()}TargetConstraint"
+
+    prob.solve(PULP_CBC_CMD(msg=False))
+
+    quantities = {}
+    for sku, (barrel, var) in barrel_vars.items():
+        quantity = int(round(var.varValue)) if var.varValue else 0
+        if quantity > 0:
+            quantities[sku] = quantity
+    return _solution(candidates, quantities, "pulp")
+
+
+def _solution(candidates, quantities, solver):
+    barrels = {barrel.sku: barrel for barrel, _ in candidates}
+    return Solution(
+        quantities,
+        sum(barrels[sku].ml_per_barrel * quantity for sku, quantity in quantities.items()),
+        sum(barrels[sku].price * quantity for sku, quantity in quantities.items()),
+        solver
+    )
+
+
+def solve_greedy(candidates, gold, capacity, targets):
+    """
+    A quick feasible plan: barrels with the least gold per ml first, as many
+    as still fit. Not optimal.
+    """
+    targets_left = dict(targets)
+    quantities = {}
+    for barrel, most in sorted(candidates, key=lambda entry: entry[0].price / entry[0].ml_per_barrel):
+        shares = color_shares(barrel)
+        take = min(most, capacity // barrel.ml_per_barrel)
+        if barrel.price > 0:
+            take = min(take, gold // barrel.price)
+        for color, share in shares.items():
+            if targets_left[color] != UNLIMITED:
+                take = min(take, int(targets_left[color] // (barrel.ml_per_barrel * share)))
+        if take <= 0:
+            continue
+        quantities[barrel.sku] = take
+        gold -= barrel.price * take
+        capacity -= barrel.ml_per_barrel * take
+        for color, share in shares.items():
+            targets_left[color] -= barrel.ml_per_barrel * share * take
+    return _solution(candidates, quantities, "greedy")
+
+
+class _Group:
+    """
+    Bounded knapsack over one group of barrels: cost[m] is the least gold
+    that buys exactly m * unit ml from the group, for m up to limit.
+    """
+
+    def __init__(self, candidates, unit, limit):
+        self.limit = limit
+        self.cost = [0] + [UNLIMITED] * limit
+        # Bounded quantities become 0/1 chunks of 1, 2, 4, ... barrels.
+        self.chunks = []
+        self.taken = []
+        for barrel, most in candidates:
+            size, left = 1, most
+            while left > 0:
+                count = min(size, left)
+                self._add(barrel, count, barrel.ml_per_barrel // unit * count, barrel.price * count)
+                left -= count
+                size *= 2
+
+    def _add(self, barrel, count, weight, price):
+        cost = self.cost
+        taken = bytearray(self.limit + 1)
+        for m in range(self.limit, weight - 1, -1):
+            candidate = cost[m - weight] + price
+            if candidate < cost[m]:
+                cost[m] = candidate
+                taken[m] = 1
+        self.chunks.append((barrel, count, weight))
+        self.taken.append(taken)
+
+    def quantities(self, m):
+        result = {}
+        for (barrel, count, weight), taken in zip(reversed(self.chunks), reversed(self.taken)):
+            if taken[m]:
+                result[barrel.sku] = result.get(barrel.sku, 0) + count
+                m -= weight
+        return result
+
+
+def _merge(left, right, limit):
+    """
+    Min-plus convolution of two cost arrays up to limit, with the split used
+    for each total.
+    """
+    limit = min(limit, len(left) + len(right) - 2)
+    cost = [UNLIMITED] * (limit + 1)
+    split = [0] * (limit + 1)
+    for a, left_cost in enumerate(left):
+        if left_cost == UNLIMITED or a > limit:
+            continue
+        for b in range(min(len(right) - 1, limit - a) + 1):
+            total = left_cost + right[b]
+            if total < cost[a + b]:
+                cost[a + b] = total
+                split[a + b] = a
+    return cost, split
+
+
+def solve_knapsack(candidates, gold, capacity, targets):
+    """
+    Solve the purchase model exactly by dynamic programming. Among plans with
+    the most ml, the cheapest one wins. Returns None if the model does not fit
+    the grouped knapsack (see the module comment).
+    """
+    unit = 0
+    for barrel, _ in candidates:
+        unit = math.gcd(unit, barrel.ml_per_barrel)
+    limit = capacity // unit
+
+    groups = {}
+    for barrel, most in candidates:
+        capped = [color for color in color_shares(barrel) if targets[color] != UNLIMITED]
+        if len(capped) > 1 or (capped and len(color_shares(barrel)) > 1):
+            return None
+        groups.setdefault(capped[0] if capped else None, []).append((barrel, most))
+
+    sizes = {
+        color: min(limit, int(targets[color] // unit)) if color else limit
+        for color in groups
+    }
+    # Knapsack work is one pass over the group per chunk of barrels, merge
+    # work the product of the two sides; merging the smallest groups first
+    # keeps the running total short.
+    order = sorted(groups, key=lambda color: sizes[color])
+    states, merged = 0, None
+    for color in order:
+        states += sum(most.bit_length() for _, most in groups[color]) * sizes[color]
+        if merged is not None:
+            states += (merged + 1) * (sizes[color] + 1)
+            merged = min(limit, merged + sizes[color])
+        else:
+            merged = sizes[color]
+    if states > BARREL_DP_MAX_STATES:
+        return None
+
+    solved = [_Group(groups[color], unit, sizes[color]) for color in order]
+    cost, splits = solved[0].cost, []
+    for group in solved[1:]:
+        cost, split = _merge(cost, group.cost, limit)
+        splits.append(split)
+
+    affordable = [m for m, price in enumerate(cost) if price <= gold]
+    if not affordable:
+        # Only with negative gold: even buying nothing costs too much.
+        return _solution(candidates, {}, "knapsack")
+    best = max(affordable)
+    quantities = {}
+    for group, split in zip(reversed(solved[1:]), reversed(splits)):
+        a = split[best]
+        quantities.update(group.quantities(best - a))
+        best = a
+    quantities.update(solved[0].quantities(best))
+    return _solution(candidates, quantities, "knapsack")
+
+
+def plan(catalog, gold, ml, capacity, solver=None, levels=None):
+    """
+    The wholesale purchase plan, as the barrels plan response: one
+    {"sku", "quantity"} entry per barrel to buy, in catalog order.
+    """
+    solver = solver or BARREL_SOLVER
+    targets = color_targets(ml, levels)
+    candidates = eligible(catalog, targets, gold, capacity)
+    if not candidates:
+        logger.info("No barrels needed or affordable.")
+        return []
+
+    solution = None
+    if solver == "greedy":
+        solution = solve_greedy(candidates, gold, capacity, targets)
+    if solver == "knapsack":
+        solution = solve_knapsack(candidates, gold, capacity, targets)
+        if solution is None:
+            logger.info("Barrel plan does not fit the knapsack solver, using pulp.")
+    if solution is None:
+        solution = solve_pulp(candidates, gold, capacity, targets)
+    logger.info("Barrel plan from %s solver: %s ml for %s gold.", solution.solver, solution.ml, solution.gold)
+
+    return [
+        {"sku": barrel.sku, "quantity": solution.quantities[barrel.sku]}
+        for barrel in catalog
+        if solution.quantities.get(barrel.sku, 0) > 0
+    ]
@@ -0,0 +1,112 @@
+import os
+import warnings
+
+import pytest
+import sqlalchemy
+
+from src import query_stats
+
+# Tests that need Postgres run against TEST_POSTGRES_URI, a scratch database
+# with the migrations applied, and are skipped when it is not set.
+TEST_POSTGRES_URI = os.environ.get("TEST_POSTGRES_URI")
+
+
+@pytest.fixture(autouse=True)
+def repeated_queries_fail():
+    """
+    A statement repeated past QUERY_REPEAT_LIMIT in one request fails the
+    test instead of only warning (see src/query_stats.py), even when the
+    handler catches the error and answers with an error body. A test that
+    repeats statements on purpose takes the fixture and clears the list.
+    """
+    with warnings.catch_warnings(), query_stats.collect_repeats() as repeats:
+        warnings.simplefilter("error", query_stats.RepeatedQueryWarning)
+        yield repeats
+    if repeats:
+        pytest.fail("Statements repeated within a request:\n" + "\n".join(repeats), pytrace=False)
+
+
+@pytest.fixture(scope="session")
+def engine():
+    if not TEST_POSTGRES_URI:
+        pytest.skip("TEST_POSTGRES_URI is not set")
+    engine = sqlalchemy.create_engine(TEST_POSTGRES_URI)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def connection(engine):
+    """
+    A connection in a transaction that is rolled back after the test, so
+    nothing the test writes lands.
+    """
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            yield connection
+        finally:
+            transaction.rollback()
+
+
+# Sizes of the seeded fixture's search tables.
+LINE_ITEMS = 20_000
+CUSTOMERS = 2_000
+POTIONS = 50
+ANALYZE = "ANALYZE potion_catalog, customer_info, carts, carts_items"
+
+
+@pytest.fixture(scope="module")
+def seeded(engine):
+    """
+    A connection with enough customers, carts and line items for the planner
+    to treat the search tables as large, in a transaction that is rolled back
+    after the module. Plans on the empty test tables depend on leftover
+    statistics instead.
+    """
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            yield seed(connection)
+        finally:
+            transaction.rollback()
+            # ANALYZE records table sizes outside the transaction; count the
+            # tables again without the seed so later plans see their real size.
+            connection.execute(sqlalchemy.text(ANALYZE))
+            connection.commit()
+
+
+def seed(connection):
+    connection.execute(sqlalchemy.text("""
+        INSERT INTO potion_catalog (name, red_component, green_component, blue_component, dark_component,
+                                    price, quantity, sku, inventory)
+        SELECT 'Test Potion ' || g, 0, 0, 0, 1000 + g, 10 + g, 0, 'TEST_POTION_' || g, 0
+        FROM generate_series(1, :potions) g
+    """), {"potions": POTIONS})
+
+    connection.execute(sqlalchemy.text("""
+        INSERT INTO customer_info (customer_name, customer_class, level)
+        SELECT 'test-customer-' || g, 'Test', g % 20
+        FROM generate_series(1, :customers) g
+    """), {"customers": CUSTOMERS})
+
+    connection.execute(sqlalchemy.text("""
+        INSERT INTO carts (customer_id, status, created_at)
+        SELECT ci.id, 'checked_out', now() - g * interval '1 second'
+        FROM generate_series(1, :line_items) g
+        JOIN customer_info ci ON ci.customer_name = 'test-customer-' || (1 + g % :customers)
+    """), {"line_items": LINE_ITEMS, "customers": CUSTOMERS})
+
+    connection.execute(sqlalchemy.text("""
+        INSERT INTO carts_items (cart_id, catalog_id, quantity, sku)
+        SELECT c.id, pc.id, 1 + c.id % 5, pc.sku
+        FROM carts c
+        JOIN potion_catalog pc ON pc.sku = 'TEST_POTION_' || (1 + c.id % :potions)
+        WHERE c.status = 'checked_out'
+          AND c.customer_id IN (SELECT id FROM customer_info WHERE customer_name LIKE 'test-customer-%')
+    """), {"potions": POTIONS})
+
+    connection.execute(sqlalchemy.text(ANALYZE))
+    # At test sizes a scan can rightly win, so plan as if the tables were large.
+    connection.execute(sqlalchemy.text("SET LOCAL enable_seqscan = off"))
+    return connection
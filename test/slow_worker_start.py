@@ -0,0 +1,4 @@
+import time
+
+# Preloaded by solver pool workers in test_solver_pool, to make them slow to start.
+time.sleep(0.5)
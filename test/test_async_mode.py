@@ -0,0 +1,49 @@
+import json
+import os
+import subprocess
+import sys
+
+# DATABASE_ASYNC is read at import, so each mode gets its own interpreter.
+SERVE_REQUESTS = """
+import asyncio
+import json
+from fastapi.testclient import TestClient
+from src import database as db
+from src.api import inventory
+from src.api.server import app
+
+with TestClient(app) as client:
+    response = client.get("/inventory/audit", headers={"access_token": "async-mode-test"})
+print(json.dumps({
+    "driver": db.get_engine().dialect.driver,
+    "coroutine": asyncio.iscoroutinefunction(inventory.audit_inventory),
+    "status": response.status_code,
+    "body": response.json(),
+}))
+"""
+
+
+def serve(engine, async_mode):
+    env = dict(
+        os.environ,
+        POSTGRES_URI=engine.url.render_as_string(hide_password=False),
+        DATABASE_ASYNC="1" if async_mode else "0",
+        LOG_LEVEL="WARNING",
+        API_KEY="async-mode-test",
+    )
+    env.pop("ASYNC_POSTGRES_URI", None)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    completed = subprocess.run([sys.executable, "-c", SERVE_REQUESTS], cwd=root, env=env,
+                               capture_output=True, text=True, timeout=60)
+    assert completed.returncode == 0, completed.stderr
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def test_endpoint_serves_the_same_response_in_async_mode(engine):
+    sync = serve(engine, async_mode=False)
+    async_ = serve(engine, async_mode=True)
+
+    assert (sync["driver"], sync["coroutine"]) == ("psycopg2", False)
+    assert (async_["driver"], async_["coroutine"]) == ("asyncpg", True)
+    assert sync["status"] == async_["status"] == 200
+    assert async_["body"] == sync["body"]
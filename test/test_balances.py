@@ -0,0 +1,88 @@
+from contextlib import contextmanager
+
+import pytest
+import sqlalchemy
+
+from src import balances
+from src import database as db
+
+
+class Connection:
+    def __init__(self, name, log):
+        self.name = name
+        self.log = log
+
+    def execute(self, statement, parameters=None):
+        self.log.append((self.name, " ".join(str(statement).split())))
+
+
+def test_snapshot_is_taken_behind_the_ledger_barrier(monkeypatch):
+    log = []
+    names = iter(["snapshot", "barrier"])
+
+    @contextmanager
+    def begin(statement_timeout_ms=None, isolation_level=None):
+        connection = Connection(next(names), log)
+        log.append((connection.name, f"BEGIN {isolation_level or 'default'}"))
+        yield connection
+        log.append((connection.name, "COMMIT"))
+
+    monkeypatch.setattr(db, "begin", begin)
+
+    with balances.snapshot() as connection:
+        connection.execute("SELECT gold")
+
+    assert log == [
+        ("snapshot", "BEGIN REPEATABLE READ"),
+        ("barrier", "BEGIN default"),
+        ("barrier", f"SET LOCAL lock_timeout = {balances.SNAPSHOT_LOCK_TIMEOUT_MS}"),
+        ("barrier", "LOCK TABLE gold_ledger_entries, ml_ledger_entries, potion_inventory_ledger_entries IN SHARE MODE"),
+        ("snapshot", "SELECT 1"),
+        # The barrier lets writers go before any of the snapshot's real reads.
+        ("barrier", "COMMIT"),
+        ("snapshot", "SELECT gold"),
+        ("snapshot", "COMMIT"),
+    ]
+
+
+# Everything taking and checking checkpoints writes, parents first.
+BALANCE_TABLES = ["gold_balance", "ml_balance", "potion_balances", "balance_checkpoints", "balance_checkpoint_potions"]
+
+
+@pytest.fixture
+def shop_engine(engine, monkeypatch):
+    """
+    Point db.begin at the test database. The balances code commits in its own
+    transactions, so the balance and checkpoint tables are put back as they
+    were afterwards.
+    """
+    with engine.connect() as connection:
+        saved = {table: connection.execute(sqlalchemy.text(f"SELECT * FROM {table}")).mappings().all()
+                 for table in BALANCE_TABLES}
+    monkeypatch.setattr(db, "_engine", engine)
+    yield engine
+    with engine.begin() as connection:
+        for table in reversed(BALANCE_TABLES):
+            connection.execute(sqlalchemy.text(f"DELETE FROM {table}"))
+        for table, rows in saved.items():
+            if rows:
+                columns = list(rows[0].keys())
+                connection.execute(sqlalchemy.text(f"""
+                    INSERT INTO {table} ({", ".join(columns)})
+                    VALUES ({", ".join(f":{column}" for column in columns)})
+                """), [dict(row) for row in rows])
+
+
+def test_checkpoint_repairs_drift(shop_engine):
+    balances.take_checkpoint()
+    with shop_engine.begin() as connection:
+        connection.execute(sqlalchemy.text("UPDATE gold_balance SET balance = balance + 7"))
+        gold = connection.execute(sqlalchemy.text("SELECT balance FROM gold_balance")).scalar_one()
+
+    result = balances.take_checkpoint()
+
+    assert result["consistent"] is False
+    assert result["mismatches"] == [f"gold: ledger {gold - 7}, snapshot {gold}"]
+    assert result["checkpoint_id"] is not None
+    assert balances.run_check() == {"consistent": True, "mismatches": [], "repaired": False}
+    assert balances.take_checkpoint()["consistent"] is True
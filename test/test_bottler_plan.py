@@ -0,0 +1,112 @@
+from contextlib import contextmanager
+from types import MappingProxyType, SimpleNamespace
+
+import pytest
+
+from src import bottling
+from src import catalog_index
+from src import database as db
+from src import plan_cache
+from src import shop_state
+from src import solver_pool
+from src.api import bottler
+
+RECIPES = [
+    SimpleNamespace(id=1, sku="RED", name="Red", price=50,
+                    red_component=100, green_component=0, blue_component=0, dark_component=0),
+    SimpleNamespace(id=2, sku="PURPLE", name="Purple", price=65,
+                    red_component=50, green_component=0, blue_component=50, dark_component=0),
+    SimpleNamespace(id=3, sku="GREEN", name="Green", price=45,
+                    red_component=0, green_component=100, blue_component=0, dark_component=0),
+]
+STATE = shop_state.ShopState(
+    gold=500, red_ml=1200, green_ml=300, blue_ml=700, dark_ml=0,
+    # load() hands out a read-only mapping, which does not pickle.
+    potions=MappingProxyType({1: 4, 3: 2}),
+    potion_capacity_units=1, ml_capacity_units=1,
+)
+
+
+@pytest.fixture
+def shop(monkeypatch):
+    """
+    Serve the bottler plan from STATE and RECIPES instead of the database.
+    """
+    connections = []
+
+    @contextmanager
+    def begin(statement_timeout_ms=None):
+        connection = SimpleNamespace(open=True)
+        connections.append(connection)
+        yield connection
+        connection.open = False
+
+    def current(connection):
+        assert connection.open
+        return SimpleNamespace(by_id={recipe.id: recipe for recipe in RECIPES})
+
+    monkeypatch.setattr(db, "begin", begin)
+    monkeypatch.setattr(shop_state, "load", lambda connection, **locks: STATE)
+    monkeypatch.setattr(catalog_index, "current", current)
+    plan_cache.bottling_plans.clear()
+    yield connections
+    plan_cache.bottling_plans.clear()
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(solver_pool, "SOLVER_POOL_SIZE", 1)
+    solver_pool.shutdown()
+    yield
+    solver_pool.shutdown()
+
+
+def expected_plan():
+    recipes = [bottling.Recipe.from_row(recipe) for recipe in RECIPES]
+    return bottling.plan(recipes, STATE.ml, dict(STATE.potions), STATE.potion_capacity - STATE.total_potions)
+
+
+def test_plan_is_solved_in_a_pool_worker(shop, pool):
+    solves = solver_pool.stats()["solves"]
+
+    plan = bottler.get_bottle_plan()
+
+    assert plan == expected_plan()
+    assert plan, "the shop state leaves room for a non-empty plan"
+    stats = solver_pool.stats()
+    assert stats["solves"] == solves + 1
+    assert stats["failures"] == 0
+
+
+def test_plan_is_solved_after_the_transaction_ends(shop, monkeypatch):
+    monkeypatch.setattr(solver_pool, "SOLVER_POOL_SIZE", 0)
+    expected = expected_plan()
+    solve = bottling.solve
+
+    def checked_solve(*args, **kwargs):
+        assert not any(connection.open for connection in shop)
+        return solve(*args, **kwargs)
+
+    monkeypatch.setattr(bottling, "solve", checked_solve)
+
+    assert bottler.get_bottle_plan() == expected
+
+
+@pytest.mark.parametrize("optimal", [True, False])
+def test_only_optimal_plans_are_cached(shop, monkeypatch, optimal):
+    monkeypatch.setattr(solver_pool, "SOLVER_POOL_SIZE", 0)
+    expected = expected_plan()
+    solves = []
+    solve = bottling.solve
+
+    def budgeted_solve(*args, **kwargs):
+        solves.append(args)
+        return solve(*args, **kwargs)[0], optimal
+
+    monkeypatch.setattr(bottling, "solve", budgeted_solve)
+
+    first = bottler.get_bottle_plan()
+    second = bottler.get_bottle_plan()
+
+    assert first == second == expected
+    assert len(solves) == (1 if optimal else 2)
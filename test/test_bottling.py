@@ -0,0 +1,55 @@
+import random
+
+import pytest
+
+from benchmarks.bottling_solvers import random_instance
+from src import bottling
+
+SEEDS = range(40)
+
+
+def instance(seed, recipe_count=6):
+    """
+    A seeded random shop state with something to bottle.
+    """
+    rng = random.Random(seed)
+    while True:
+        recipes, ml, inventory, capacity = random_instance(rng, recipe_count)
+        candidate_list = bottling.candidates(recipes, inventory, capacity)
+        if candidate_list:
+            return candidate_list, ml, capacity
+
+
+def assert_feasible(solution, candidate_list, ml, capacity):
+    by_id = {candidate.recipe.id: candidate for candidate in candidate_list}
+    assert all(0 < quantity <= by_id[potion_id].upper_bound for potion_id, quantity in solution.quantities.items())
+    assert sum(solution.quantities.values()) <= capacity
+    for color_index, color in enumerate(bottling.ML_COLORS):
+        used = sum(by_id[potion_id].components[color_index] * quantity
+                   for potion_id, quantity in solution.quantities.items())
+        assert used <= ml[color]
+    assert solution.objective == pytest.approx(bottling.objective(candidate_list, solution.quantities))
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_native_matches_pulp(seed):
+    candidate_list, ml, capacity = instance(seed)
+
+    native = bottling.solve_native(candidate_list, ml, capacity, time_budget_ms=10_000)
+    pulp = bottling.solve_pulp(candidate_list, ml, capacity)
+
+    assert native.optimal and pulp.optimal
+    assert_feasible(native, candidate_list, ml, capacity)
+    assert native.objective == pytest.approx(pulp.objective)
+
+
+@pytest.mark.parametrize("seed", SEEDS[:10])
+def test_native_out_of_budget_returns_a_feasible_plan(seed):
+    candidate_list, ml, capacity = instance(seed, recipe_count=12)
+
+    native = bottling.solve_native(candidate_list, ml, capacity, time_budget_ms=0)
+    pulp = bottling.solve_pulp(candidate_list, ml, capacity)
+
+    assert native.optimal is False
+    assert_feasible(native, candidate_list, ml, capacity)
+    assert native.objective <= pulp.objective + 1e-6
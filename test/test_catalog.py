@@ -0,0 +1,67 @@
+from contextlib import contextmanager
+
+import pytest
+import sqlalchemy
+from fastapi.testclient import TestClient
+
+from src import catalog_cache
+from src import catalog_index
+from src import database as db
+from src import ledgers
+from src.api import auth
+from src.api import server
+
+SKU = "CATALOG_PRICE_TEST"
+HEADERS = {"access_token": "test"}
+
+
+@pytest.fixture
+def client(connection, monkeypatch):
+    """
+    A client whose requests all run in the test's rolled-back transaction,
+    with a potion in stock priced above everything else in the catalog.
+    """
+    ledgers.ensure_partitions(connection)
+    potion_id = connection.execute(sqlalchemy.text("""
+        INSERT INTO potion_catalog (name, red_component, green_component, blue_component, dark_component,
+                                    price, quantity, sku, inventory)
+        VALUES ('catalog price test', 3, 41, 27, 29, 900000, 0, :sku, 0)
+        RETURNING id
+    """), {"sku": SKU}).scalar_one()
+    connection.execute(sqlalchemy.text("""
+        INSERT INTO potion_inventory_ledger_entries (potion_catalog_id, change, description)
+        VALUES (:potion_id, 5, 'catalog price test stock')
+    """), {"potion_id": potion_id})
+
+    @contextmanager
+    def begin(statement_timeout_ms=None, isolation_level=None):
+        yield connection
+
+    monkeypatch.setattr(db, "begin", begin)
+    monkeypatch.setattr(auth, "api_keys", ["test"])
+    catalog_cache.invalidate()
+    catalog_index.invalidate()
+    yield TestClient(server.app)
+    catalog_cache.invalidate()
+    catalog_index.invalidate()
+
+
+def listed_price(client):
+    return {item["sku"]: item["price"] for item in client.get("/catalog/", headers=HEADERS).json()}[SKU]
+
+
+def test_price_change_shows_in_the_catalog_at_once(client):
+    assert listed_price(client) == 900000
+    # Served from the caches from here on.
+    assert listed_price(client) == 900000
+
+    response = client.post(f"/admin/catalog/{SKU}/price", json={"price": 950000}, headers=HEADERS)
+
+    assert response.json() == {"sku": SKU, "price": 950000}
+    assert listed_price(client) == 950000
+
+
+def test_price_change_for_an_unknown_sku_is_an_error(client):
+    response = client.post("/admin/catalog/NO_SUCH_POTION/price", json={"price": 10}, headers=HEADERS)
+
+    assert response.json() == {"error": "No potion with SKU NO_SUCH_POTION."}
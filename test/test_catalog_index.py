@@ -0,0 +1,109 @@
+from collections import namedtuple
+
+import pytest
+
+from src import catalog_index
+
+Row = namedtuple("Row", "id sku name price red_component green_component blue_component dark_component")
+
+CATALOG = [Row(potion_id, f"SKU_{potion_id}", f"potion {potion_id}", 10 * potion_id, potion_id, 0, 100 - potion_id, 0)
+           for potion_id in range(1, 6)]
+
+
+class Result:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def fetchall(self):
+        return self.rows
+
+    def first(self):
+        return self.rows[0] if self.rows else None
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class FakeConnection:
+    """
+    Answers the catalog index's queries from CATALOG and records them.
+    """
+
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, statement, parameters=None):
+        sql = " ".join(str(statement).split())
+        parameters = parameters or {}
+        self.statements.append(sql)
+        if "LIMIT" in sql:
+            return Result(CATALOG[:parameters["limit"]])
+        if "sku = :sku" in sql:
+            return Result([row for row in CATALOG if row.sku == parameters["sku"]])
+        if "id = ANY" in sql:
+            return Result([row for row in CATALOG if row.id in parameters["potion_ids"]])
+        wanted = set(zip(parameters["reds"], parameters["greens"], parameters["blues"], parameters["darks"]))
+        return Result([row for row in CATALOG
+                       if (row.red_component, row.green_component, row.blue_component, row.dark_component) in wanted])
+
+
+@pytest.fixture
+def max_potions(monkeypatch):
+    def bound(limit):
+        monkeypatch.setattr(catalog_index, "CATALOG_INDEX_MAX_POTIONS", limit)
+    catalog_index.invalidate()
+    yield bound
+    catalog_index.invalidate()
+
+
+def test_index_holds_the_whole_catalog_within_the_bound(max_potions):
+    max_potions(5)
+    connection = FakeConnection()
+
+    index = catalog_index.current(connection)
+
+    assert index.complete
+    assert sorted(index.by_id) == [1, 2, 3, 4, 5]
+    assert catalog_index.row_for_sku(connection, "SKU_5").id == 5
+    assert len(connection.statements) == 1
+
+
+def test_lookups_past_the_bound_go_to_the_database(max_potions):
+    max_potions(3)
+    connection = FakeConnection()
+
+    index = catalog_index.current(connection)
+
+    assert not index.complete
+    assert sorted(index.by_id) == [1, 2, 3]
+    assert catalog_index.row_for_sku(connection, "SKU_2").id == 2
+    assert len(connection.statements) == 1
+
+    assert catalog_index.row_for_sku(connection, "SKU_5").id == 5
+    assert catalog_index.row_for_sku(connection, "SKU_9") is None
+    assert sorted(catalog_index.rows_for_ids(connection, [1, 4, 9])) == [1, 4]
+    recipes = catalog_index.resolve_potion_types(connection, [[1, 0, 99, 0], [4, 0, 96, 0], [0, 0, 0, 100]])
+    assert recipes[(1, 0, 99, 0)].id == 1
+    assert recipes[(4, 0, 96, 0)].id == 4
+    assert recipes[(0, 0, 0, 100)] is None
+    # Misses were answered by direct queries, not by reloading the index.
+    assert catalog_index.current(connection) is index
+    assert len(connection.statements) == 5
+
+
+def test_load_racing_a_catalog_write_is_not_kept(max_potions):
+    max_potions(5)
+
+    class WrittenDuringLoad(FakeConnection):
+        def execute(self, statement, parameters=None):
+            result = super().execute(statement, parameters)
+            if len(self.statements) == 1:
+                catalog_index.invalidate()
+            return result
+
+    connection = WrittenDuringLoad()
+
+    assert catalog_index.current(connection).complete
+    catalog_index.current(connection)
+
+    assert len(connection.statements) == 2
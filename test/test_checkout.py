@@ -0,0 +1,47 @@
+import sqlalchemy
+
+from src import catalog_index
+from src import checkout
+from src import ledgers
+
+
+def test_checkout_charges_the_current_price(connection):
+    """
+    A price change lands at the next checkout even while the catalog index
+    still holds the old price.
+    """
+    ledgers.ensure_partitions(connection)
+    potion_id = connection.execute(sqlalchemy.text("""
+        INSERT INTO potion_catalog (name, red_component, green_component, blue_component, dark_component,
+                                    price, quantity, sku, inventory)
+        VALUES ('checkout price test', 7, 31, 29, 33, 50, 0, 'CHECKOUT_PRICE_TEST', 0)
+        RETURNING id
+    """)).scalar_one()
+    connection.execute(sqlalchemy.text("""
+        INSERT INTO potion_inventory_ledger_entries (potion_catalog_id, change, description)
+        VALUES (:potion_id, 5, 'checkout price test stock')
+    """), {"potion_id": potion_id})
+    customer_id = connection.execute(sqlalchemy.text("""
+        INSERT INTO customer_info (customer_name, customer_class, level)
+        VALUES ('checkout price test', 'Tester', 1) RETURNING id
+    """)).scalar_one()
+    cart_id = connection.execute(sqlalchemy.text("""
+        INSERT INTO carts (customer_id) VALUES (:customer_id) RETURNING id
+    """), {"customer_id": customer_id}).scalar_one()
+    connection.execute(sqlalchemy.text("""
+        INSERT INTO carts_items (cart_id, catalog_id, quantity, sku)
+        VALUES (:cart_id, :potion_id, 2, 'CHECKOUT_PRICE_TEST')
+    """), {"cart_id": cart_id, "potion_id": potion_id})
+
+    catalog_index.invalidate()
+    try:
+        assert catalog_index.current(connection).by_id[potion_id].price == 50
+        connection.execute(sqlalchemy.text("""
+            UPDATE potion_catalog SET price = 80 WHERE id = :potion_id
+        """), {"potion_id": potion_id})
+
+        result = checkout.checkout_cart(connection, cart_id)
+    finally:
+        catalog_index.invalidate()
+
+    assert result == {"total_gold_paid": 160, "total_potions_bought": 2}
@@ -0,0 +1,130 @@
+import threading
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+import sqlalchemy
+from fastapi.testclient import TestClient
+
+from src import balances
+from src import database as db
+from src import deliveries
+from src.api import auth
+from src.api import server
+
+ENDPOINT = "test_deliveries"
+RESPONSE = {"message": "delivered"}
+
+
+@pytest.fixture
+def committed(engine):
+    """
+    The engine, for tests whose deliveries have to commit; their
+    delivered_orders rows are deleted afterwards.
+    """
+    yield engine
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text("DELETE FROM delivered_orders WHERE endpoint = :endpoint"),
+                           {"endpoint": ENDPOINT})
+
+
+def deliver(engine, order_id, applied, replay_seconds=None, started=None, release=None):
+    """
+    One delivery in its own transaction: claim, "apply" by appending to
+    applied, record. Returns the response it answered with.
+    """
+    with engine.begin() as connection:
+        replayed = deliveries.claim(connection, ENDPOINT, order_id, replay_seconds)
+        if started is not None:
+            started.set()
+        if replayed is not None:
+            return replayed
+        applied.append(order_id)
+        if release is not None:
+            release.wait(5)
+        return deliveries.record(connection, ENDPOINT, order_id, RESPONSE)
+
+
+@pytest.mark.parametrize("replay_seconds", [None, 600], ids=["order_id", "body"])
+def test_replay_returns_the_stored_response(committed, replay_seconds):
+    applied = []
+
+    assert deliver(committed, 1, applied, replay_seconds) == RESPONSE
+    assert deliver(committed, 1, applied, replay_seconds) == RESPONSE
+
+    assert applied == [1]
+
+
+def test_body_keyed_delivery_is_new_after_the_replay_window(committed):
+    applied = []
+
+    deliver(committed, 1, applied, replay_seconds=600)
+    with committed.begin() as connection:
+        connection.execute(sqlalchemy.text("""
+            UPDATE delivered_orders SET created_at = created_at - INTERVAL '1 hour' WHERE endpoint = :endpoint
+        """), {"endpoint": ENDPOINT})
+    deliver(committed, 1, applied, replay_seconds=600)
+
+    assert applied == [1, 1]
+
+
+@pytest.mark.parametrize("replay_seconds", [None, 600], ids=["order_id", "body"])
+def test_concurrent_duplicate_is_applied_once(committed, replay_seconds):
+    applied, responses = [], []
+    first_claimed, release = threading.Event(), threading.Event()
+
+    first = threading.Thread(target=lambda: responses.append(
+        deliver(committed, 2, applied, replay_seconds, started=first_claimed, release=release)))
+    first.start()
+    assert first_claimed.wait(5)
+    duplicate = threading.Thread(target=lambda: responses.append(deliver(committed, 2, applied, replay_seconds)))
+    duplicate.start()
+    # The duplicate waits on the first delivery's claim until it commits.
+    duplicate.join(0.3)
+    assert duplicate.is_alive()
+    release.set()
+    first.join(5)
+    duplicate.join(5)
+
+    assert applied == [2]
+    assert responses == [RESPONSE, RESPONSE]
+
+
+def test_failed_delivery_leaves_no_record(committed):
+    applied = []
+
+    with pytest.raises(RuntimeError):
+        with committed.begin() as connection:
+            assert deliveries.claim(connection, ENDPOINT, 3) is None
+            raise RuntimeError("delivery failed")
+
+    with committed.connect() as connection:
+        assert connection.execute(sqlalchemy.text("""
+            SELECT COUNT(*) FROM delivered_orders WHERE endpoint = :endpoint
+        """), {"endpoint": ENDPOINT}).scalar_one() == 0
+    assert deliver(committed, 3, applied) == RESPONSE
+    assert applied == [3]
+
+
+def test_capacity_delivery_without_order_id_is_keyed_by_its_body(monkeypatch):
+    claims = []
+
+    @contextmanager
+    def begin(statement_timeout_ms=None, isolation_level=None):
+        yield SimpleNamespace()
+
+    def claim(connection, endpoint, order_id, replay_seconds=None):
+        claims.append((endpoint, order_id, replay_seconds))
+        return {"status": "success", "message": "replayed"}
+
+    monkeypatch.setattr(auth, "api_keys", ["test"])
+    monkeypatch.setattr(db, "begin", begin)
+    monkeypatch.setattr(deliveries, "claim", claim)
+    monkeypatch.setattr(balances, "get_gold", lambda *args, **kwargs: pytest.fail("replay touched the ledgers"))
+    body = {"potion_capacity": 1, "ml_capacity": 0}
+
+    with TestClient(server.app) as client:
+        response = client.post("/inventory/deliver", json=body, headers={"access_token": "test"})
+
+    assert response.json() == {"status": "success", "message": "replayed"}
+    assert claims == [("inventory/unkeyed", deliveries.body_order_id(body), deliveries.UNKEYED_REPLAY_SECONDS)]
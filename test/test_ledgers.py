@@ -0,0 +1,60 @@
+from datetime import timedelta
+
+import sqlalchemy
+
+from src import balances
+from src import ledgers
+
+
+def write_entries(connection, created_at, potion_id, amount):
+    connection.execute(sqlalchemy.text("""
+        INSERT INTO gold_ledger_entries (change, created_at, description)
+        VALUES (:amount, :created_at, 'compaction test')
+    """), {"amount": amount, "created_at": created_at})
+    connection.execute(sqlalchemy.text("""
+        INSERT INTO ml_ledger_entries (red_ml_change, green_ml_change, blue_ml_change, dark_ml_change,
+                                       created_at, description)
+        VALUES (:amount, 2 * :amount, 0, -1, :created_at, 'compaction test')
+    """), {"amount": amount, "created_at": created_at})
+    connection.execute(sqlalchemy.text("""
+        INSERT INTO potion_inventory_ledger_entries (potion_catalog_id, change, created_at, description)
+        VALUES (:potion_id, :amount, :created_at, 'compaction test')
+    """), {"potion_id": potion_id, "amount": amount, "created_at": created_at})
+
+
+def test_compaction_keeps_totals_and_balances(connection):
+    period = timedelta(days=ledgers.LEDGER_PARTITION_DAYS)
+    now = ledgers._now(connection)
+    hot_start = ledgers.period_start(now)
+    ledgers.ensure_partitions(connection, now)
+    # Two closed partitions, plus rows old enough to land in DEFAULT.
+    old = ledgers.ensure_partitions(connection, now - 3 * period)
+    assert len(old) == 2 * len(ledgers.LEDGERS)
+    potion_id = connection.execute(sqlalchemy.text("SELECT MIN(id) FROM potion_catalog")).scalar_one()
+    for created_at, amount in [
+        (hot_start - 10 * period, 3),
+        (hot_start - 3 * period, 5),
+        (hot_start - 2 * period + timedelta(hours=1), 7),
+        (now, 11),
+    ]:
+        write_entries(connection, created_at, potion_id, amount)
+
+    totals = balances._ledger_totals(connection)
+    snapshot = balances._snapshot(connection)
+
+    result = ledgers.compact(connection)
+
+    assert "error" not in result
+    compacted = {entry["partition"] for entry in result["partitions"]}
+    assert set(old) <= compacted
+    assert {f"{ledger.table}_default" for ledger in ledgers.LEDGERS} <= compacted
+    for ledger in ledgers.LEDGERS:
+        live = ledgers._partitions(connection, ledger.table)
+        assert not any(name in old for name, _, _ in live)
+        assert all(end is None or end > hot_start for _, _, end in live)
+        assert connection.execute(sqlalchemy.text(
+            f"SELECT COUNT(*) FROM {ledger.table} WHERE created_at < :before"
+        ), {"before": hot_start}).scalar_one() == 0
+    assert balances._ledger_totals(connection) == totals
+    assert balances._snapshot(connection) == snapshot
+    assert balances.check(connection)["consistent"] is True
@@ -0,0 +1,47 @@
+import json
+import logging
+import queue
+
+import pytest
+
+from src import logs
+
+
+@pytest.fixture
+def queued():
+    """
+    A logger whose records go through the lazy queue handler; yields the
+    logger and a function returning the next queued record as JSON.
+    """
+    log_queue = queue.Queue()
+    handler = logs._LazyQueueHandler(log_queue)
+    logger = logging.getLogger("test_logs")
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    yield logger, lambda: json.loads(logs.JsonFormatter().format(log_queue.get_nowait()))
+    logger.removeHandler(handler)
+
+
+def test_message_is_rendered_when_logged(queued):
+    logger, next_entry = queued
+    ml_inventory = {"red": 100}
+
+    logger.info("Initial ML Inventory: %s", ml_inventory)
+    ml_inventory["red"] -= 40
+
+    entry = next_entry()
+    assert entry["message"] == "Initial ML Inventory: {'red': 100}"
+
+
+def test_traceback_survives_the_queue(queued):
+    logger, next_entry = queued
+
+    try:
+        raise ValueError("bad delivery")
+    except ValueError:
+        logger.exception("Delivery failed for %s.", "order 7")
+
+    entry = next_entry()
+    assert entry["message"] == "Delivery failed for order 7."
+    assert "ValueError: bad delivery" in entry["exception"]
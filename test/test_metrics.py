@@ -0,0 +1,146 @@
+import re
+from collections import defaultdict
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from src import database as db
+from src import metrics
+from src.api import auth
+from src.api import server
+
+POOL = {
+    "pool_size": 5, "max_overflow": 10, "checked_out": 1, "checked_in": 4, "overflow": 0, "checkouts": 7,
+    "checkout_timeouts": 0, "wait_seconds_total": 0.25, "wait_seconds_max": 0.125, "wait_seconds_avg": 0.035714,
+}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Empty request metrics, timed by a clock that only moves when a test
+    advances it.
+    """
+    for name in ("_latency_sums", "_query_seconds"):
+        monkeypatch.setattr(metrics, name, defaultdict(float))
+    for name in ("_in_flight", "_responses", "_queries", "_max_queries"):
+        monkeypatch.setattr(metrics, name, defaultdict(int))
+    monkeypatch.setattr(metrics, "_bucket_counts", defaultdict(lambda: [0] * (len(metrics.LATENCY_BUCKETS) + 1)))
+    now = SimpleNamespace(seconds=0.0)
+    monkeypatch.setattr(metrics, "time", SimpleNamespace(perf_counter=lambda: now.seconds))
+
+    def advance(seconds):
+        now.seconds += seconds
+    return advance
+
+
+@pytest.fixture
+def client(clock):
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    def get_item(item_id: int, seconds: float = 0.0):
+        clock(seconds)
+        if item_id == 0:
+            raise HTTPException(status_code=404, detail="No such item.")
+        return {"item_id": item_id}
+
+    @app.get("/broken")
+    def broken():
+        raise RuntimeError("broken")
+
+    @app.get("/stream")
+    def stream():
+        def chunks():
+            for chunk in (b"first", b"second"):
+                clock(0.2)
+                yield chunk
+        return StreamingResponse(chunks())
+
+    app.add_middleware(metrics.MetricsMiddleware, routes=app.routes)
+    return TestClient(app, raise_server_exceptions=False)
+
+
+def sample(text, name, **labels):
+    """
+    The value of the metric line with exactly these labels, or None.
+    """
+    rendered = ",".join(f'{label}="{value}"' for label, value in labels.items())
+    match = re.search(rf"^{re.escape(name)}\{{{re.escape(rendered)}\}} (\S+)$", text, re.MULTILINE)
+    return float(match.group(1)) if match else None
+
+
+def test_responses_are_counted_by_route_template_and_status(client):
+    client.get("/items/1")
+    client.get("/items/2")
+    client.get("/items/0")
+    client.get("/broken")
+    client.get("/nowhere")
+
+    text = metrics.render()
+
+    assert sample(text, "http_responses_total", method="GET", route="/items/{item_id}", status=200) == 2
+    assert sample(text, "http_responses_total", method="GET", route="/items/{item_id}", status=404) == 1
+    assert sample(text, "http_responses_total", method="GET", route="/broken", status=500) == 1
+    assert sample(text, "http_responses_total", method="GET", route=metrics.UNMATCHED_ROUTE, status=404) == 1
+    assert "/items/1" not in text
+    assert sample(text, "http_requests_in_flight", method="GET", route="/items/{item_id}") == 0
+
+
+def test_latency_lands_in_its_bucket(client):
+    client.get("/items/1", params={"seconds": 0.03})
+    client.get("/items/1", params={"seconds": 3})
+
+    text = metrics.render()
+
+    labels = {"method": "GET", "route": "/items/{item_id}"}
+    assert sample(text, "http_request_duration_seconds_bucket", **labels, le="0.025") == 0
+    assert sample(text, "http_request_duration_seconds_bucket", **labels, le="0.05") == 1
+    assert sample(text, "http_request_duration_seconds_bucket", **labels, le="2.5") == 1
+    assert sample(text, "http_request_duration_seconds_bucket", **labels, le="5.0") == 2
+    assert sample(text, "http_request_duration_seconds_bucket", **labels, le="+Inf") == 2
+    assert sample(text, "http_request_duration_seconds_count", **labels) == 2
+    assert sample(text, "http_request_duration_seconds_sum", **labels) == pytest.approx(3.03)
+
+
+def test_streaming_response_is_timed_to_its_last_chunk(client):
+    response = client.get("/stream")
+
+    assert response.content == b"firstsecond"
+    text = metrics.render()
+    labels = {"method": "GET", "route": "/stream"}
+    assert sample(text, "http_responses_total", **labels, status=200) == 1
+    assert sample(text, "http_request_duration_seconds_bucket", **labels, le="0.25") == 0
+    assert sample(text, "http_request_duration_seconds_bucket", **labels, le="0.5") == 1
+    assert sample(text, "http_request_duration_seconds_sum", **labels) == pytest.approx(0.4)
+
+
+@pytest.fixture
+def shop(clock, monkeypatch):
+    monkeypatch.setattr(auth, "api_keys", ["test"])
+    monkeypatch.setattr(db, "pool_status", lambda: dict(POOL))
+    return TestClient(server.app)
+
+
+def test_metrics_endpoint_renders_the_prometheus_text_format(shop):
+    shop.get("/metrics", headers={"access_token": "test"})
+
+    response = shop.get("/metrics", headers={"access_token": "test"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE http_request_duration_seconds histogram" in response.text
+    assert sample(response.text, "http_responses_total", method="GET", route="/metrics", status=200) == 1
+    assert re.search(r"^db_pool_size 5$", response.text, re.MULTILINE)
+    assert re.search(r"^db_pool_wait_seconds_total 0.25$", response.text, re.MULTILINE)
+
+
+@pytest.mark.parametrize("headers", [{}, {"access_token": "wrong"}], ids=["missing", "wrong"])
+def test_metrics_endpoint_needs_an_api_key(shop, headers):
+    response = shop.get("/metrics", headers=headers)
+
+    assert response.status_code == 401
+    assert "http_responses_total" not in response.text
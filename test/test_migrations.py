@@ -0,0 +1,85 @@
+import logging
+import uuid
+
+import pytest
+import sqlalchemy
+
+from src import migrations
+
+FILES = {
+    "0001_create_widgets.sql": "CREATE TABLE widgets (id SERIAL PRIMARY KEY, name TEXT NOT NULL);",
+    "0002_create_gadgets.sql": "CREATE TABLE gadgets (id SERIAL PRIMARY KEY);",
+    # A % in a migration is SQL, not a driver placeholder.
+    "0003_seed_widgets.sql": "INSERT INTO widgets (name) SELECT 'widget ' || (7 % 3);",
+}
+
+
+@pytest.fixture
+def schema_engine(engine):
+    """
+    An engine whose connections work in a fresh schema, dropped after the test.
+    """
+    schema = f"test_migrations_{uuid.uuid4().hex[:12]}"
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text(f"CREATE SCHEMA {schema}"))
+    scoped = sqlalchemy.create_engine(engine.url, connect_args={"options": f"-csearch_path={schema}"})
+    yield scoped
+    scoped.dispose()
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text(f"DROP SCHEMA {schema} CASCADE"))
+
+
+@pytest.fixture
+def directory(tmp_path):
+    for name, sql in FILES.items():
+        (tmp_path / name).write_text(sql)
+    return tmp_path
+
+
+def tables(engine):
+    return set(sqlalchemy.inspect(engine).get_table_names())
+
+
+def test_migrate_applies_each_migration_once(schema_engine, directory):
+    assert migrations.migrate(schema_engine, directory) == ["0001", "0002", "0003"]
+    assert {"widgets", "gadgets", "schema_migrations"} <= tables(schema_engine)
+
+    assert migrations.migrate(schema_engine, directory) == []
+    with schema_engine.connect() as connection:
+        names = connection.execute(sqlalchemy.text("SELECT name FROM widgets")).scalars().all()
+    assert names == ["widget 1"]
+    assert migrations.status(schema_engine, directory) == [
+        ("0001_create_widgets", "applied"),
+        ("0002_create_gadgets", "applied"),
+        ("0003_seed_widgets", "applied"),
+    ]
+
+
+def test_baseline_through_a_version_records_without_running(schema_engine, directory):
+    with schema_engine.begin() as connection:
+        # The schema the baseline stands for, built some other way.
+        connection.execute(sqlalchemy.text("CREATE TABLE widgets (id SERIAL PRIMARY KEY, name TEXT NOT NULL)"))
+
+    assert migrations.migrate(schema_engine, directory, baseline=True, baseline_through="0001") == ["0001"]
+    assert "gadgets" not in tables(schema_engine)
+    assert migrations.status(schema_engine, directory) == [
+        ("0001_create_widgets", "baseline"),
+        ("0002_create_gadgets", "pending"),
+        ("0003_seed_widgets", "pending"),
+    ]
+
+    assert migrations.migrate(schema_engine, directory) == ["0002", "0003"]
+    assert "gadgets" in tables(schema_engine)
+
+
+def test_changed_migration_is_reported_not_rerun(schema_engine, directory, caplog):
+    migrations.migrate(schema_engine, directory)
+    (directory / "0003_seed_widgets.sql").write_text("INSERT INTO widgets (name) VALUES ('changed');")
+
+    with caplog.at_level(logging.WARNING, logger=migrations.__name__):
+        assert migrations.migrate(schema_engine, directory) == []
+
+    assert "Migration 0003_seed_widgets changed after it was applied." in caplog.messages
+    assert dict(migrations.status(schema_engine, directory))["0003_seed_widgets"] == "changed"
+    with schema_engine.connect() as connection:
+        assert connection.execute(sqlalchemy.text("SELECT COUNT(*) FROM widgets")).scalar_one() == 1
@@ -0,0 +1,98 @@
+import os
+
+import pytest
+import sqlalchemy
+
+from src import query_stats
+
+pytest_plugins = ["pytester"]
+
+# A route that loops over lookups and, like the shop's handlers, answers any
+# exception with an error body.
+ROUTE_TEST = """
+import sqlalchemy
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from src import query_stats
+from src.metrics import MetricsMiddleware
+
+engine = sqlalchemy.create_engine("sqlite://")
+query_stats.install(engine)
+app = FastAPI()
+
+
+@app.get("/items/{{count}}")
+def get_items(count: int):
+    try:
+        with engine.connect() as connection:
+            for item_id in range(count):
+                connection.execute(sqlalchemy.text("SELECT :item_id"), {{"item_id": item_id}})
+    except Exception as error:
+        return {{"error": str(error)}}
+    return {{"items": count}}
+
+
+app.add_middleware(MetricsMiddleware, routes=app.routes)
+
+
+def test_route():
+    with TestClient(app) as client:
+        assert client.get("/items/{count}").status_code == 200
+"""
+
+
+@pytest.fixture
+def engine():
+    engine = sqlalchemy.create_engine("sqlite://")
+    query_stats.install(engine)
+    yield engine
+    engine.dispose()
+
+
+def lookups(engine, times):
+    with engine.connect() as connection:
+        for item_id in range(times):
+            connection.execute(sqlalchemy.text("SELECT :item_id"), {"item_id": item_id})
+
+
+def test_queries_within_the_limit_pass(engine):
+    with query_stats.track("GET /items") as stats:
+        lookups(engine, query_stats.QUERY_REPEAT_LIMIT)
+
+    assert stats.max_repeats == query_stats.QUERY_REPEAT_LIMIT
+
+
+def test_query_repeated_in_a_loop_fails(engine, repeated_queries_fail):
+    with pytest.raises(query_stats.RepeatedQueryWarning, match="GET /items ran the same statement"):
+        with query_stats.track("GET /items"):
+            lookups(engine, query_stats.QUERY_REPEAT_LIMIT + 1)
+
+    assert len(repeated_queries_fail) == 1
+    repeated_queries_fail.clear()
+
+
+def test_queries_outside_a_request_are_not_counted(engine):
+    lookups(engine, query_stats.QUERY_REPEAT_LIMIT + 1)
+
+
+@pytest.mark.parametrize("count, outcome", [
+    (query_stats.QUERY_REPEAT_LIMIT, {"passed": 1}),
+    (query_stats.QUERY_REPEAT_LIMIT + 1, {"passed": 1, "errors": 1}),
+])
+def test_route_that_swallows_the_error_still_fails(pytester, repeated_queries_fail, count, outcome):
+    """
+    The route answers 200 either way; the suite's conftest fails the test
+    when the request repeated a statement.
+    """
+    conftest = os.path.join(os.path.dirname(__file__), "conftest.py")
+    with open(conftest) as source:
+        pytester.makeconftest(source.read())
+    pytester.makepyfile(ROUTE_TEST.format(count=count))
+
+    result = pytester.runpytest_inprocess()
+    # The inner run's repeat reaches this test's collector too.
+    repeated_queries_fail.clear()
+
+    result.assert_outcomes(**outcome)
+    if "errors" in outcome:
+        result.stdout.fnmatch_lines(["*GET /items/{count} ran the same statement more than*"])
@@ -0,0 +1,120 @@
+import base64
+import json
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import sqlalchemy
+from fastapi.testclient import TestClient
+
+from src import database as db
+from src.api import auth
+from src.api import carts
+from src.api import server
+
+SKU = "KEYSET_TEST"
+START = datetime(2030, 1, 1, 12, 0)
+
+
+@pytest.fixture
+def search(connection, monkeypatch):
+    """
+    search_orders over a seeded set of line items with ties in every sort
+    column, run in the test's rolled-back transaction.
+    """
+    potion_ids = [connection.execute(sqlalchemy.text("""
+        INSERT INTO potion_catalog (name, red_component, green_component, blue_component, dark_component,
+                                    price, quantity, sku, inventory)
+        VALUES (:name, :red, 0, :blue, 0, :price, 0, :sku, 0)
+        RETURNING id
+    """), {"name": f"keyset potion {index}", "red": 91 + index, "blue": 9 - index,
+           "price": price, "sku": f"{SKU}_{index}"}).scalar_one()
+        for index, price in enumerate([10, 20, 20])]
+    customer_ids = [connection.execute(sqlalchemy.text("""
+        INSERT INTO customer_info (customer_name, customer_class, level)
+        VALUES (:name, 'Tester', 1) RETURNING id
+    """), {"name": f"keyset customer {index}"}).scalar_one() for index in range(3)]
+
+    # Six carts over four distinct timestamps, each buying two or three potions.
+    for cart_index in range(6):
+        cart_id = connection.execute(sqlalchemy.text("""
+            INSERT INTO carts (customer_id, created_at) VALUES (:customer_id, :created_at) RETURNING id
+        """), {"customer_id": customer_ids[cart_index % 3],
+               "created_at": START + timedelta(minutes=cart_index // 2 + cart_index % 2)}).scalar_one()
+        for potion_index, potion_id in enumerate(potion_ids[:2 + cart_index % 2]):
+            connection.execute(sqlalchemy.text("""
+                INSERT INTO carts_items (cart_id, catalog_id, quantity, sku) VALUES (:cart_id, :catalog_id, :quantity, :sku)
+            """), {"cart_id": cart_id, "catalog_id": potion_id, "quantity": 1 + potion_index % 2,
+                   "sku": f"{SKU}_{potion_index}"})
+
+    @contextmanager
+    def begin(statement_timeout_ms=None, isolation_level=None):
+        yield connection
+
+    monkeypatch.setattr(db, "begin", begin)
+
+    def run(sort_col, sort_order, link=""):
+        search_page = parse_qs(urlparse(link).query).get("search_page", [""])[0]
+        return carts.search_orders(potion_sku=SKU, search_page=search_page, sort_col=sort_col, sort_order=sort_order)
+
+    return run
+
+
+def sort_key(result, sort_col):
+    return result[sort_col.value]
+
+
+@pytest.mark.parametrize("sort_order", list(carts.search_sort_order))
+@pytest.mark.parametrize("sort_col", list(carts.search_sort_options))
+def test_pages_round_trip(search, sort_col, sort_order):
+    pages = [search(sort_col, sort_order)]
+    while pages[-1]["next"]:
+        pages.append(search(sort_col, sort_order, pages[-1]["next"]))
+
+    rows = [result for page in pages for result in page["results"]]
+    ids = [result["line_item_id"] for result in rows]
+    assert len(ids) == 15
+    assert len(set(ids)) == len(ids)
+    assert [len(page["results"]) for page in pages] == [5, 5, 5]
+    assert pages[0]["previous"] == ""
+
+    # Equal keys come out in line_item_id order, in the sort's direction.
+    keys = [(sort_key(result, sort_col), result["line_item_id"]) for result in rows]
+    ties = [(a, b) for a, b in zip(keys, keys[1:]) if a[0] == b[0]]
+    assert ties
+    for (_, first_id), (_, second_id) in ties:
+        assert (first_id < second_id) == (sort_order == carts.search_sort_order.asc)
+
+    # Walking back with the previous links returns every earlier page as it was.
+    page = pages[-1]
+    for expected in reversed(pages[:-1]):
+        page = search(sort_col, sort_order, page["previous"])
+        assert page["results"] == expected["results"]
+    assert page["previous"] == ""
+
+
+def cursor(**payload):
+    token = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+    return token.rstrip("=")
+
+
+@pytest.mark.parametrize("sort_col, key, line_item_id", [
+    ("customer_name", 5, 1),
+    ("item_sku", ["1 x red"], 1),
+    ("line_item_total", "20", 1),
+    ("line_item_total", True, 1),
+    ("timestamp", 1700000000, 1),
+    ("timestamp", "not a time", 1),
+    ("customer_name", "keyset customer 0", "1"),
+])
+def test_cursor_with_the_wrong_key_type_is_rejected(monkeypatch, sort_col, key, line_item_id):
+    monkeypatch.setattr(auth, "api_keys", ["test"])
+    token = cursor(col=sort_col, order="desc", key=key, id=line_item_id, dir="next")
+
+    response = TestClient(server.app).get(
+        "/carts/search/", params={"sort_col": sort_col, "sort_order": "desc", "search_page": token},
+        headers={"access_token": "test"}
+    )
+
+    assert response.status_code == 400
@@ -0,0 +1,31 @@
+import json
+
+import pytest
+import sqlalchemy
+
+from src.api import carts
+
+# A small potion_catalog may be cheaper to scan than to probe, so the SKU filter
+# also passes if the matching potions reach their line items by index.
+EXPECTED_INDEXES = {
+    "customer_name": {"customer_info_customer_name_trgm_idx"},
+    "potion_sku": {"potion_catalog_sku_trgm_idx", "carts_items_catalog_id_idx"},
+}
+
+
+@pytest.mark.parametrize("name, value", [("customer_name", "customer-424"), ("potion_sku", "POTION_17")])
+def test_search_filter_uses_its_trigram_index(seeded, name, value):
+    query = carts.build_search_query(
+        value if name == "customer_name" else "",
+        value if name == "potion_sku" else "",
+        carts.search_sort_options.timestamp,
+        carts.search_sort_order.desc,
+        None,
+        6
+    )
+    compiled = query.compile(dialect=seeded.dialect)
+    plan = seeded.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar_one()
+    plan = json.dumps(plan) if isinstance(plan, list) else plan
+
+    used = {index for index in EXPECTED_INDEXES[name] if index in plan}
+    assert used, f"{name} search did not use any of {sorted(EXPECTED_INDEXES[name])}"
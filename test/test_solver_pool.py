@@ -0,0 +1,72 @@
+import operator
+import threading
+import time
+
+import pytest
+
+from src import solver_pool
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """
+    A one-worker pool whose counters are put back afterwards.
+    """
+    monkeypatch.setattr(solver_pool, "SOLVER_POOL_SIZE", 1)
+    monkeypatch.setattr(solver_pool, "_stats", dict(solver_pool._stats))
+    solver_pool.shutdown()
+    yield
+    solver_pool.shutdown()
+
+
+def test_started_pool_solves_with_its_started_worker(pool):
+    solver_pool.start()
+    [worker] = solver_pool._workers
+
+    assert solver_pool.run(operator.add, 1, 2, timeout_ms=30000) == 3
+    assert solver_pool._workers == {worker}
+
+
+def test_worker_start_counts_against_the_solve_budget(pool, monkeypatch):
+    # The forkserver starts once per process; only the worker's start is timed.
+    solver_pool.run(operator.add, 1, 2, timeout_ms=30000)
+    solver_pool.shutdown()
+    monkeypatch.setattr(solver_pool, "PRELOAD", solver_pool.PRELOAD + ["test.slow_worker_start"])
+
+    start = time.monotonic()
+    with pytest.raises(solver_pool.SolverTimeout, match="still starting"):
+        solver_pool.run(operator.add, 1, 2, timeout_ms=100)
+    assert time.monotonic() - start < 0.5
+
+    # The worker kept starting and serves the next solve.
+    [worker] = solver_pool._workers
+    assert solver_pool.run(operator.add, 1, 2, timeout_ms=30000) == 3
+    assert solver_pool._workers == {worker}
+
+
+def test_shutdown_kills_workers_serving_a_solve(pool):
+    failures = solver_pool.stats()["failures"]
+    errors = []
+
+    def solve():
+        try:
+            solver_pool.run(time.sleep, 30, timeout_ms=60000)
+        except solver_pool.SolverTimeout as e:
+            errors.append(e)
+
+    solving = threading.Thread(target=solve)
+    solving.start()
+    deadline = time.monotonic() + 30
+    while not any(worker.ready for worker in list(solver_pool._workers)):
+        assert time.monotonic() < deadline, "the worker did not start"
+        time.sleep(0.01)
+    [worker] = solver_pool._workers
+
+    solver_pool.shutdown()
+    solving.join(5)
+
+    assert not solving.is_alive()
+    assert not worker.process.is_alive()
+    assert not solver_pool._workers
+    assert len(errors) == 1
+    assert solver_pool.stats()["failures"] == failures + 1
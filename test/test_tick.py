@@ -0,0 +1,64 @@
+import logging
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src import balances
+from src import database as db
+from src import ledgers
+from src.api import auth
+from src.api import server
+
+TICK = {"day": "Edgeday", "hour": 14}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(auth, "api_keys", ["test"])
+    return TestClient(server.app)
+
+
+@pytest.fixture
+def housekeeping(monkeypatch):
+    """
+    Record the tick's background steps instead of running them against the database.
+    """
+    steps = []
+
+    @contextmanager
+    def begin(statement_timeout_ms=None, isolation_level=None):
+        yield SimpleNamespace()
+
+    monkeypatch.setattr(db, "begin", begin)
+    monkeypatch.setattr(ledgers, "ensure_partitions", lambda connection: steps.append("partitions"))
+    monkeypatch.setattr(balances, "take_checkpoint",
+                        lambda: steps.append("checkpoint") or {"consistent": True})
+    return steps
+
+
+def test_tick_runs_housekeeping(client, housekeeping):
+    response = client.post("/info/current_time", json=TICK, headers={"access_token": "test"})
+
+    assert response.status_code == 200
+    assert housekeeping == ["partitions", "checkpoint"]
+
+
+def test_tick_succeeds_when_housekeeping_fails(client, housekeeping, monkeypatch, caplog):
+    def fail(*args):
+        raise RuntimeError("lock timeout")
+
+    monkeypatch.setattr(ledgers, "ensure_partitions", fail)
+    monkeypatch.setattr(balances, "take_checkpoint", fail)
+
+    with caplog.at_level(logging.ERROR):
+        response = client.post("/info/current_time", json=TICK, headers={"access_token": "test"})
+
+    assert response.status_code == 200
+    assert response.json() == "OK"
+    failures = [record.getMessage() for record in caplog.records if record.levelno == logging.ERROR]
+    assert failures == [
+        "Creating ledger partitions failed at Edgeday 14.",
+        "Balance checkpoint failed at Edgeday 14.",
+    ]
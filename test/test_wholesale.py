@@ -0,0 +1,80 @@
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from benchmarks.barrel_solvers import random_instance, random_levels
+from src import wholesale
+
+SEEDS = range(40)
+
+
+def instance(seed, mixed, capped):
+    """
+    A seeded random wholesale state with barrels worth buying, under the
+    threshold rule or, if capped, random per-color target levels.
+    """
+    rng = random.Random(seed)
+    while True:
+        catalog, gold, ml, capacity = random_instance(rng, rng.choice([4, 8, 16]), mixed, units=1)
+        levels = random_levels(rng) if capped else {}
+        targets = wholesale.color_targets(ml, levels)
+        candidates = wholesale.eligible(catalog, targets, gold, capacity)
+        if candidates:
+            return catalog, gold, ml, capacity, levels, targets, candidates
+
+
+def assert_feasible(solution, candidates, gold, capacity, targets):
+    most = {barrel.sku: limit for barrel, limit in candidates}
+    barrels = {barrel.sku: barrel for barrel, _ in candidates}
+    assert all(0 < quantity <= most[sku] for sku, quantity in solution.quantities.items())
+    assert solution.gold <= gold
+    assert solution.ml <= capacity
+    for color in wholesale.ML_COLORS:
+        if targets[color] != wholesale.UNLIMITED:
+            bought = sum(barrels[sku].ml_per_barrel * wholesale.color_shares(barrels[sku]).get(color, 0) * quantity
+                         for sku, quantity in solution.quantities.items())
+            assert bought <= targets[color] + 1e-6
+
+
+@pytest.mark.parametrize("capped", [False, True], ids=["threshold", "levels"])
+@pytest.mark.parametrize("seed", SEEDS)
+def test_knapsack_matches_pulp(seed, capped):
+    _, gold, _, capacity, _, targets, candidates = instance(seed, mixed=0.1 if not capped else 0.0, capped=capped)
+
+    knapsack = wholesale.solve_knapsack(candidates, gold, capacity, targets)
+    pulp = wholesale.solve_pulp(candidates, gold, capacity, targets)
+
+    assert knapsack is not None
+    assert_feasible(knapsack, candidates, gold, capacity, targets)
+    assert knapsack.ml == pulp.ml
+    # Among plans with the most ml, the knapsack buys the cheapest.
+    assert knapsack.gold <= pulp.gold
+
+
+@pytest.mark.parametrize("seed", SEEDS[:10])
+def test_coupled_groups_fall_back_to_pulp(seed):
+    rng = random.Random(seed)
+    while True:
+        catalog, gold, ml, capacity, levels, targets, candidates = instance(rng.randrange(10 ** 6), mixed=1.0, capped=True)
+        if wholesale.solve_knapsack(candidates, gold, capacity, targets) is None:
+            break
+
+    purchases = wholesale.plan(catalog, gold, ml, capacity, solver="knapsack", levels=levels)
+    pulp = wholesale.solve_pulp(candidates, gold, capacity, targets)
+
+    solution = wholesale._solution(candidates, {entry["sku"]: entry["quantity"] for entry in purchases}, "plan")
+    assert_feasible(solution, candidates, gold, capacity, targets)
+    assert solution.ml == pulp.ml
+
+
+def test_knapsack_without_gold_buys_nothing():
+    free = SimpleNamespace(sku="FREE", ml_per_barrel=500, potion_type=[1, 0, 0, 0], price=0, quantity=3)
+    paid = SimpleNamespace(sku="PAID", ml_per_barrel=500, potion_type=[0, 1, 0, 0], price=100, quantity=3)
+    targets = wholesale.color_targets({color: 0 for color in wholesale.ML_COLORS}, {})
+    candidates = wholesale.eligible([free, paid], targets, -5, 10000)
+
+    solution = wholesale.solve_knapsack(candidates, -5, 10000, targets)
+
+    assert solution.quantities == {}
+    assert (solution.ml, solution.gold) == (0, 0)